@@ -0,0 +1,202 @@
+"""Offline stand-ins for the Telethon client and events the handlers in ``qr.py`` use.
+
+Nothing here touches the network. :class:`FakeClient` implements
+``send_message``, ``send_file``, ``upload_file`` and ``iter_download``
+(of media on fake incoming messages); messages and callback
+queries implement ``edit``, ``delete``, ``answer``, ``get_sender`` and
+``download_media``. Every call waits ``rtt`` seconds (or just yields to the
+loop), and uploads are additionally paced by ``upload_bandwidth`` bytes per
+second when set, so handlers interleave as they would against Telegram.
+
+Sent media come back as real ``types.Photo`` / ``types.Document`` objects
+with fresh ids, so ``FileRefStore`` and the resend path work unchanged.
+"""
+import asyncio
+import io
+import itertools
+import mimetypes
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Union
+
+from PIL import Image
+from telethon import events
+from telethon.tl import types
+
+_ids = itertools.count(1)
+
+
+class FakeClient:
+    def __init__(self, rtt: float = 0.0, upload_bandwidth: Optional[float] = None):
+        self.rtt = rtt
+        self.upload_bandwidth = upload_bandwidth
+        self.calls: Dict[str, int] = {}
+        self.uploaded_bytes = 0
+        # The last file sent to each chat, so callers can check delivery.
+        self.last_file: Dict[int, "FakeMessage"] = {}
+        # Bytes of incoming photos and documents by id, for iter_download.
+        self.media: Dict[int, bytes] = {}
+
+    async def call(self, method: str, upload_bytes: int = 0):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        delay = self.rtt
+        if upload_bytes and self.upload_bandwidth:
+            delay += upload_bytes / self.upload_bandwidth
+        await asyncio.sleep(delay)
+
+    async def send_message(self, entity: int, message: str = "", **kwargs) -> "FakeMessage":
+        await self.call("send_message")
+        return FakeMessage(self, entity, entity, message, buttons=kwargs.get("buttons"))
+
+    async def send_file(self, entity: int, file, caption: Optional[str] = None, force_document: bool = False, **kwargs) -> "FakeMessage":
+        media: Union[types.Photo, types.Document]
+        if isinstance(file, types.InputPhoto):
+            await self.call("send_file")
+            media = _photo(file.id, file.access_hash)
+        elif isinstance(file, types.InputDocument):
+            await self.call("send_file")
+            media = _document(file.id, file.access_hash, 0)
+        else:
+            size = _read_size(file)
+            self.uploaded_bytes += size
+            await self.call("send_file", size)
+            media = _document(next(_ids), next(_ids), size) if force_document else _photo(next(_ids), next(_ids))
+
+        message = FakeMessage(self, entity, entity, caption or "")
+        if isinstance(media, types.Photo):
+            message.photo = media
+        else:
+            message.document = media
+        self.last_file[entity] = message
+        return message
+
+    async def upload_file(self, file, **kwargs) -> types.InputFile:
+        size = _read_size(file)
+        self.uploaded_bytes += size
+        await self.call("upload_file", size)
+        return types.InputFile(next(_ids), 1, getattr(file, "name", "file"), "")
+
+    async def iter_download(self, file, *, request_size: int = 512 * 1024, **kwargs):
+        data = self.media[file.id]
+        for start in range(0, len(data), request_size):
+            await self.call("iter_download")
+            yield data[start:start + request_size]
+
+
+def _read_size(file) -> int:
+    if isinstance(file, (bytes, bytearray)):
+        return len(file)
+    if isinstance(file, str):
+        return os.path.getsize(file)
+    # Drain the stream the way an upload would.
+    size = 0
+    while True:
+        chunk = file.read(512 * 1024)
+        if not chunk:
+            return size
+        size += len(chunk)
+
+
+def _photo(photo_id: int, access_hash: int, sizes: Optional[List[types.PhotoSize]] = None) -> types.Photo:
+    return types.Photo(photo_id, access_hash, b"ref", datetime.now(timezone.utc), sizes or [], 1)
+
+
+def _document(document_id: int, access_hash: int, size: int, mime_type: str = "application/octet-stream") -> types.Document:
+    return types.Document(document_id, access_hash, b"ref", datetime.now(timezone.utc), mime_type, size, 1, [])
+
+
+class FakeMessage:
+    """An incoming or sent message in a private chat (``chat_id == sender_id``)."""
+
+    def __init__(
+        self,
+        client: FakeClient,
+        chat_id: int,
+        sender_id: int,
+        text: str = "",
+        media: Optional[bytes] = None,
+        photo: bool = False,
+        document_name: Optional[str] = None,
+        buttons=None,
+    ):
+        self.client = client
+        self.id = next(_ids)
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.text = text
+        self.buttons = buttons
+        self.media = media
+        self.photo: Optional[types.Photo] = None
+        self.document: Optional[types.Document] = None
+        if photo:
+            # Incoming photos have a single size, the image as sent.
+            sizes = []
+            if media is not None:
+                with Image.open(io.BytesIO(media)) as img:
+                    sizes.append(types.PhotoSize("y", img.width, img.height, len(media)))
+            self.photo = _photo(next(_ids), next(_ids), sizes)
+        if document_name is not None:
+            mime_type = mimetypes.guess_type(document_name)[0] or "application/octet-stream"
+            self.document = _document(next(_ids), next(_ids), len(media or b""), mime_type)
+            self.document.attributes = [types.DocumentAttributeFilename(document_name)]
+        if media is not None:
+            for item in (self.photo, self.document):
+                if item is not None:
+                    client.media[item.id] = media
+
+    async def get_sender(self) -> types.User:
+        return types.User(self.sender_id, first_name="Load")
+
+    async def edit(self, text: str, **kwargs) -> "FakeMessage":
+        await self.client.call("edit")
+        self.text = text
+        self.buttons = kwargs.get("buttons", self.buttons)
+        return self
+
+    async def delete(self):
+        await self.client.call("delete")
+
+    async def download_media(self, file=None) -> Union[bytes, str, None]:
+        if self.media is None:
+            return None
+        await self.client.call("download_media", len(self.media))
+        if isinstance(file, str):
+            with open(file, "wb") as f:
+                f.write(self.media)
+            return file
+        return self.media
+
+
+class FakeCallbackQuery(events.CallbackQuery.Event):
+    """A button press on a bot message.
+
+    Subclasses Telethon's event so ``isinstance`` checks in the handlers
+    hold; the properties that would read a real update are shadowed by
+    plain attributes.
+    """
+
+    data = sender_id = chat_id = None
+
+    def __init__(self, client: FakeClient, user_id: int, data: Union[str, bytes], message: Optional[FakeMessage] = None):
+        self._client = client
+        self.data = data.encode() if isinstance(data, str) else data
+        self.sender_id = user_id
+        self.chat_id = user_id
+        self.message = message or FakeMessage(client, user_id, user_id)
+        self.answers: List[Optional[str]] = []
+        self.alerts: List[str] = []
+
+    async def get_sender(self) -> types.User:
+        return types.User(self.sender_id, first_name="Load")
+
+    async def answer(self, message: Optional[str] = None, **kwargs):
+        await self._client.call("answer")
+        self.answers.append(message)
+        if message and kwargs.get("alert"):
+            self.alerts.append(message)
+
+    async def edit(self, text: str, **kwargs) -> FakeMessage:
+        return await self.message.edit(text, **kwargs)
+
+    async def delete(self):
+        await self.message.delete()
@@ -0,0 +1,224 @@
+"""Replay simulated users through the bot's handlers, offline, and measure them.
+
+Each user runs the interactive flow: ``/qr``, sends a payload, changes size
+and error level, picks a style, sometimes adds a label, and presses
+Generate. Updates go through the routers (and ``admission_handler`` with
+``--rate-limits``) as Telethon would dispatch them, but ``qr.bot`` is a
+:class:`benchmarks.fakes.FakeClient`, so nothing touches the network. The
+render pool, caches, sessions and admission control are the real ones.
+
+Run from the repository root (``config.py`` must be importable; its
+credentials are never used)::
+
+    python -m benchmarks.load --users 2000 --concurrency 500
+    python -m benchmarks.load --users 5000 --payloads 200 --rtt 0.05 --think 0.5
+
+Reports throughput, p50/p90/p99 latency per step and per flow, render and
+cache counters, and the peak RSS of the bot process plus its render workers.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+
+from telethon import events
+
+import qr
+from benchmarks.fakes import FakeCallbackQuery, FakeClient, FakeMessage
+from utils import ERROR_LEVELS, LOGGER, SIZES, STYLES, FileRefStore, RenderCache, SessionStore
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class LoadRun:
+    def __init__(self, args):
+        self.args = args
+        self.client = FakeClient(rtt=args.rtt, upload_bandwidth=args.bandwidth)
+        self.steps: Dict[str, List[float]] = {}
+        self.flows: List[float] = []
+        self.limited = 0
+        self.alerts: Dict[str, int] = {}
+        self.failed = 0
+        self.peak_rss_kb = 0
+
+    async def dispatch(self, step: str, event):
+        """Deliver one update the way Telethon runs the registered handlers."""
+        start = time.perf_counter()
+        if self.args.rate_limits:
+            try:
+                await qr.admission_handler(event)
+            except events.StopPropagation:
+                self.limited += 1
+                return
+        if isinstance(event, FakeCallbackQuery):
+            await qr.callback_router(event)
+            for alert in event.alerts:
+                self.alerts[alert] = self.alerts.get(alert, 0) + 1
+        else:
+            await qr.message_router(event)
+        self.steps.setdefault(step, []).append(time.perf_counter() - start)
+
+    async def think(self, rng: random.Random):
+        if self.args.think:
+            await asyncio.sleep(rng.uniform(0, 2 * self.args.think))
+
+    async def user(self, user_id: int):
+        rng = random.Random(user_id)
+        args = self.args
+        text = f"https://example.com/load/{rng.randrange(args.payloads):08d}".ljust(args.length, "x")[:args.length]
+        start = time.perf_counter()
+        think_time = 0.0
+
+        async def step(name: str, event):
+            nonlocal think_time
+            await self.dispatch(name, event)
+            paused = time.perf_counter()
+            await self.think(rng)
+            think_time += time.perf_counter() - paused
+
+        await step("/qr", FakeMessage(self.client, user_id, user_id, "/qr"))
+        await step("data", FakeMessage(self.client, user_id, user_id, text))
+        await step("size", FakeCallbackQuery(self.client, user_id, f"size_{rng.choice(list(SIZES))}"))
+        await step("error", FakeCallbackQuery(self.client, user_id, f"error_{rng.choice(list(ERROR_LEVELS))}"))
+        await step("change_style", FakeCallbackQuery(self.client, user_id, "change_style"))
+        await step("style", FakeCallbackQuery(self.client, user_id, f"style_{rng.choice(list(STYLES))}"))
+        if rng.random() < args.label_share:
+            await step("add_label", FakeCallbackQuery(self.client, user_id, "add_label"))
+            await step("label", FakeMessage(self.client, user_id, user_id, f"Load test {rng.randrange(args.payloads)}"))
+
+        self.client.last_file.pop(user_id, None)
+        await self.dispatch("generate", FakeCallbackQuery(self.client, user_id, "generate"))
+        if self.client.last_file.pop(user_id, None) is None:
+            self.failed += 1
+        else:
+            self.flows.append(time.perf_counter() - start - think_time)
+
+    async def sample_memory(self):
+        pids = [os.getpid()]
+        executor = qr.render_pool._executor
+        if executor is not None:
+            pids += list(executor._processes)
+        while True:
+            self.peak_rss_kb = max(self.peak_rss_kb, sum(rss_kb(pid) for pid in pids))
+            await asyncio.sleep(0.2)
+
+    async def run(self) -> float:
+        limit = asyncio.Semaphore(self.args.concurrency)
+
+        async def bounded(user_id: int):
+            async with limit:
+                await self.user(user_id)
+
+        sampler = asyncio.create_task(self.sample_memory())
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(bounded(1_000_000 + i) for i in range(self.args.users)))
+        finally:
+            sampler.cancel()
+        return time.perf_counter() - start
+
+    def report(self, wall: float):
+        cache = qr.render_cache.stats()
+        completed = len(self.flows)
+        print(f"\n{self.args.users} users, {completed} QR codes delivered in {wall:.1f}s: {completed / wall:.1f} flows/s")
+        print(f"failed {self.failed}, rate limited updates {self.limited}")
+        for alert, count in sorted(self.alerts.items()):
+            print(f"  alert {alert!r}: {count}")
+        print(f"renders {cache['misses']}, cache hits {cache['hits']}, uploads {self.client.uploaded_bytes / 1e6:.1f} MB")
+        if qr.speculator is not None:
+            print("speculative renders: " + ", ".join(f"{key} {value}" for key, value in qr.speculator.stats().items()))
+
+        print(f"\n{'step':<14} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        rows = list(self.steps.items()) + [("flow", self.flows)]
+        for name, values in rows:
+            print(
+                f"{name:<14} {len(values):>7} "
+                + " ".join(f"{percentile(values, q) * 1000:>9.1f}" for q in (0.5, 0.9, 0.99, 1.0))
+            )
+
+        stages = qr.stage_seconds.totals()
+        if stages:
+            print("\nmean per stage: " + ", ".join(
+                f"{stage} {total / count * 1000:.1f}ms" for stage, (count, total) in sorted(stages.items()) if count
+            ))
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"peak RSS: {self.peak_rss_kb / 1024:.0f} MB with workers, {own / 1024:.0f} MB bot process")
+
+
+async def main(args) -> int:
+    # Nothing may leak into the bot's real state files.
+    qr.file_refs = FileRefStore(":memory:")
+    qr.sessions = SessionStore(max_sessions=args.users * 2)
+    qr.render_cache = RenderCache(max_bytes=qr.render_cache.max_bytes)
+    qr.render_pool.cache = qr.render_cache
+
+    if args.no_speculation:
+        qr.speculator = None
+
+    run = LoadRun(args)
+    qr.bot = run.client
+    await qr.render_pool.start()
+    qr.sessions.start()
+    qr.file_refs.start()
+    if qr.speculator is not None:
+        qr.speculator.start()
+    try:
+        if args.verbose:
+            LOGGER.setLevel(logging.DEBUG)
+            wall = await run.run()
+        else:
+            # The handlers' per-update logs would swamp the report.
+            logging.disable(logging.WARNING)
+            try:
+                wall = await run.run()
+            finally:
+                logging.disable(logging.NOTSET)
+    finally:
+        qr.sessions.stop()
+        qr.file_refs.close()
+        if qr.speculator is not None:
+            qr.speculator.stop()
+        qr.render_pool.shutdown()
+    run.report(wall)
+    return 1 if run.failed else 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000, help="simulated users, each running one flow")
+    parser.add_argument("--concurrency", type=int, default=250, help="users in a flow at the same time")
+    parser.add_argument("--payloads", type=int, default=1_000_000, help="distinct payloads to draw from (lower means more cache hits)")
+    parser.add_argument("--length", type=int, default=60, help="payload length in characters")
+    parser.add_argument("--label-share", type=float, default=0.3, help="fraction of users adding a label")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between a user's steps, in seconds")
+    parser.add_argument("--rtt", type=float, default=0.0, help="simulated Telegram API round trip, in seconds")
+    parser.add_argument("--no-speculation", action="store_true", help="disable speculative rendering of the settings screen")
+    parser.add_argument("--verbose", action="store_true", help="keep the handlers' debug and INFO logs")
+    parser.add_argument("--rate-limits", action="store_true", help="apply the per-user and per-chat rate limits")
+    parser.add_argument("--bandwidth", type=float, default=None, help="simulated upload bandwidth, in bytes per second")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
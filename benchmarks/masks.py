@@ -0,0 +1,118 @@
+"""Check the NumPy encoder path against qrcode's make(fit=True) and time both.
+
+For every payload length and error level, each of the eight masks is scored
+with :func:`utils.mask_penalty` and ``qrcode.util.lost_point`` on the grid
+qrcode itself builds, and the matrix from :func:`utils.encode_matrix` is
+compared bit for bit with the reference symbol, made by qrcode from the same
+segments (:func:`utils.plan_segments`). The timing includes qrcode's own
+segmentation; the summary counts symbols that segmentation made smaller.
+Run from the repository root::
+
+    python -m benchmarks.masks
+    python -m benchmarks.masks --lengths 2953 --errors low --random 0 --repeat 3
+
+``--random`` adds that many payloads of random length and content (seeded
+with ``--seed``), mixing numeric, alphanumeric, byte and Kanji data. Exits with
+status 1 on any mismatch.
+"""
+import argparse
+import random
+import string
+import sys
+import time
+
+import qrcode
+from qrcode import util
+
+from utils.matrix import encode_matrix, pack_modules
+from utils.render import ERROR_LEVELS, MAX_TEXT_LENGTH
+from utils.segments import plan_segments
+from utils.symbol import mask_penalty
+
+ALPHABETS = (
+    string.digits,
+    string.digits + string.ascii_uppercase + " $%*+-./:",
+    string.printable,
+    "äöü€✓ab",
+    "日本語漢字テキスト" + string.digits,
+    string.ascii_lowercase + string.digits * 4 + "/:.?=",
+)
+
+
+def reference(text: str, error_correction: int) -> qrcode.QRCode:
+    qr = qrcode.QRCode(version=None, error_correction=error_correction, border=0)
+    qr.add_data(text)
+    qr.data_list = plan_segments(text, error_correction).segments
+    qr.make(fit=True)
+    return qr
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def penalties_match(qr: qrcode.QRCode) -> bool:
+    for pattern in range(8):
+        qr.makeImpl(True, pattern)
+        if mask_penalty(qr.modules) != util.lost_point(qr.modules):
+            return False
+    return True
+
+
+def payloads(args):
+    for length in args.lengths:
+        yield ("https://example.com/?id=" + "x" * length)[:length]
+    rng = random.Random(args.seed)
+    for _ in range(args.random):
+        alphabet = rng.choice(ALPHABETS)
+        length = rng.randint(1, 300 if rng.random() < 0.8 else MAX_TEXT_LENGTH)
+        yield "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 500, 1200, 2953])
+    parser.add_argument("--errors", nargs="+", default=list(ERROR_LEVELS), choices=list(ERROR_LEVELS))
+    parser.add_argument("--random", type=int, default=200, help="extra payloads of random length and alphabet")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    failures = checked = skipped = smaller = 0
+    print(f"{'len':>5} {'error':>7} {'ver':>3} {'saved':>5} {'ref ms':>9} {'numpy ms':>9} {'speedup':>8}  result")
+    for text in payloads(args):
+        for error in args.errors:
+            try:
+                qr, ref_time = timed(lambda: reference(text, ERROR_LEVELS[error]), args.repeat)
+            except (ValueError, qrcode.exceptions.DataOverflowError):
+                skipped += 1
+                continue
+            matrix, out_time = timed(lambda: encode_matrix(text, ERROR_LEVELS[error]), args.repeat)
+            same_matrix = matrix[:3] == pack_modules(qr.version, qr.modules)[:3]
+            same_penalties = penalties_match(qr)
+            checked += 1
+            smaller += matrix.default_version > matrix.version
+            if not (same_matrix and same_penalties):
+                failures += 1
+                result = "matrix differs" if not same_matrix else "penalty differs"
+            else:
+                result = "ok"
+            if result != "ok" or len(text) in args.lengths:
+                print(
+                    f"{len(text):>5} {error:>7} {qr.version:>3} {matrix.default_version - matrix.version:>5} "
+                    f"{ref_time * 1000:>9.1f} {out_time * 1000:>9.1f} {ref_time / out_time:>7.1f}x  {result}"
+                )
+
+    print(f"{checked} symbols checked, {failures} mismatches, {skipped} payloads too long for their error level")
+    print(f"{smaller} symbols are smaller than with qrcode's default segmentation")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
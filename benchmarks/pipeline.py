@@ -0,0 +1,205 @@
+"""Time the full render pipeline per stage across the settings grid.
+
+Every combination of payload length, error level, size, style, logo, label
+and output format is rendered through :func:`utils.render.render_job`, the
+same code the bot's workers run. For each case the report has the best time
+of every stage, the peak memory traced during one render and the output size.
+
+Run from the repository root::
+
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --lengths 20 2953 --sizes xlarge --save base.json
+    python -m benchmarks.pipeline --compare base.json --threshold 0.15
+
+Lengths that do not fit a symbol at some error level (2953 bytes only fit
+version 40 at ``low``) are skipped for that level. Peak memory covers Python
+and NumPy allocations seen by ``tracemalloc``; Pillow's image buffers are
+allocated outside it. Process caches (fonts, logo variants, module tiles)
+are warm after the first repeat, so best times reflect a running worker.
+
+With ``--compare``, cases whose total time or output size grew by more than
+``--threshold`` against the baseline are listed and the exit status is 1.
+Slowdowns under ``--min-delta-ms`` are treated as timer noise.
+"""
+import argparse
+import io
+import itertools
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import numpy as np
+import PIL
+import qrcode
+from PIL import Image
+from qrcode.exceptions import DataOverflowError
+
+from utils.logos import LOGO_SHAPE_KEYS, ingest_logo, max_logo_size
+from utils.render import ERROR_LEVELS, MAX_TEXT_LENGTH, OUTPUT_FORMATS, SIZES, STYLES, RenderJob, render_job
+
+STAGES = ("segment", "encode", "mask", "rasterize", "logo", "label", "compose", "vector", "save")
+DEFAULT_LENGTHS = [20, 100, 500, 1200, MAX_TEXT_LENGTH]
+LABEL = "Scan me for the full menu"
+
+
+def payload(length: int) -> str:
+    return ("https://example.com/?id=" + "x" * length)[:length]
+
+
+def sample_logo(text: str):
+    # A gradient with a transparent corner exercises resizing and alpha.
+    x, y = np.meshgrid(np.arange(512), np.arange(512))
+    rgba = np.stack([x // 2, y // 2, (x + y) // 4, np.where(x + y < 128, 0, 255)], axis=-1).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG")
+    return ingest_logo(buf.getvalue(), max_logo_size(text, max(SIZES.values())))
+
+
+def case_key(length: int, error: str, size: str, style: str, logo: bool, label: bool, output: str) -> str:
+    return f"{length}/{error}/{size}/{style}/{'logo' if logo else '-'}/{'label' if label else '-'}/{output}"
+
+
+def measure(job: RenderJob, repeat: int) -> Dict:
+    best: Dict[str, float] = {}
+    best_total = float("inf")
+    for _ in range(repeat):
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        data, matrix = render_job(job, timings)
+        best_total = min(best_total, time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            best[stage] = min(best.get(stage, seconds), seconds)
+
+    tracemalloc.start()
+    render_job(job)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "version": matrix.version,
+        "total_ms": round(best_total * 1000, 3),
+        "stages_ms": {stage: round(best[stage] * 1000, 3) for stage in STAGES if best.get(stage, 0) > 0},
+        "peak_kb": round(peak / 1024, 1),
+        "bytes": len(data),
+    }
+
+
+def run_grid(args) -> Dict[str, Dict]:
+    results = {}
+    print(f"{'case':<48} {'ver':>3} {'total ms':>9} {'peak KB':>8} {'bytes':>9}  stages ms")
+    for length in args.lengths:
+        text = payload(length)
+        logo = sample_logo(text) if any(args.logo) else None
+        for error in args.errors:
+            for size, style, with_logo, with_label, output in itertools.product(
+                args.sizes, args.styles, args.logo, args.label, args.formats
+            ):
+                key = case_key(length, error, size, style, with_logo, with_label, output)
+                job = RenderJob(
+                    text=text,
+                    size=size,
+                    error=error,
+                    style=style,
+                    logo=logo if with_logo else None,
+                    logo_shape=args.logo_shape if with_logo else None,
+                    label=LABEL if with_label else None,
+                    output=output,
+                )
+                try:
+                    result = measure(job, args.repeat)
+                except (ValueError, DataOverflowError):
+                    print(f"{key:<48} does not fit at error level {error}, skipped")
+                    break
+                results[key] = result
+                stages = " ".join(f"{stage}={ms:.1f}" for stage, ms in result["stages_ms"].items())
+                print(
+                    f"{key:<48} {result['version']:>3} {result['total_ms']:>9.1f} "
+                    f"{result['peak_kb']:>8.0f} {result['bytes']:>9}  {stages}"
+                )
+    return results
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "qrcode": getattr(qrcode, "__version__", "unknown"),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict, threshold: float, min_delta_ms: float) -> List[str]:
+    regressions = []
+    base = baseline["results"]
+    shared = [key for key in results if key in base]
+    print(f"\nagainst baseline from {baseline['environment'].get('date', '?')}: {len(shared)} shared cases")
+    for key in shared:
+        for metric in ("total_ms", "bytes"):
+            old, new = base[key][metric], results[key][metric]
+            if metric == "total_ms" and new - old < min_delta_ms:
+                continue
+            if old and (new - old) / old > threshold:
+                regressions.append(f"{key} {metric}: {old} -> {new} (+{(new - old) / old:.0%})")
+
+    def total(metric: str, source: Dict) -> float:
+        return sum(source[key][metric] for key in shared)
+
+    if shared:
+        for metric in ("total_ms", "bytes", "peak_kb"):
+            old, new = total(metric, base), total(metric, results)
+            print(f"  {metric:<9} {old:>14.1f} -> {new:>14.1f} ({(new - old) / old:+.1%})" if old else f"  {metric}: n/a")
+    return regressions
+
+
+def flag(value: str) -> bool:
+    return value in ("yes", "true", "1")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=DEFAULT_LENGTHS)
+    parser.add_argument("--errors", nargs="+", default=list(ERROR_LEVELS), choices=list(ERROR_LEVELS))
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--styles", nargs="+", default=list(STYLES), choices=list(STYLES))
+    parser.add_argument("--formats", nargs="+", default=["png"], choices=list(OUTPUT_FORMATS))
+    parser.add_argument("--logo", type=flag, nargs="+", default=[False, True], metavar="{yes,no}")
+    parser.add_argument("--label", type=flag, nargs="+", default=[False, True], metavar="{yes,no}")
+    parser.add_argument("--logo-shape", default="square", choices=LOGO_SHAPE_KEYS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", metavar="JSON", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="JSON", help="baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative growth counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+    if any(length > MAX_TEXT_LENGTH or length < 1 for length in args.lengths):
+        parser.error(f"lengths must be between 1 and {MAX_TEXT_LENGTH}")
+
+    start = time.perf_counter()
+    results = run_grid(args)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"\n{len(results)} cases in {time.perf_counter() - start:.1f}s, peak RSS {peak_rss / 1024:.0f} MB")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=1, sort_keys=True)
+        print(f"baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Check the NumPy rasterizer against qrcode's StyledPilImage and time both.
+
+Run from the repository root::
+
+    python -m benchmarks.raster
+    python -m benchmarks.raster --lengths 2000 --sizes xlarge --repeat 1
+
+Exits with status 1 if any rendering differs from the reference by more than
+``--tolerance`` on any channel of any pixel.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import qrcode
+from qrcode.image.styledpil import StyledPilImage
+from qrcode.image.styles.colormasks import SolidFillColorMask
+from qrcode.image.styles.moduledrawers import (
+    SquareModuleDrawer,
+    RoundedModuleDrawer,
+    CircleModuleDrawer,
+)
+
+from utils.matrix import pack_modules
+from utils.raster import rasterize
+from utils.render import ERROR_LEVELS, SIZES, STYLES
+
+DRAWERS = {"square": SquareModuleDrawer, "rounded": RoundedModuleDrawer, "circle": CircleModuleDrawer}
+# qrcode has no equivalent of gradient and image fills, so only flat styles
+# are compared. No flat style uses the rounded drawer, so a solid rounded
+# case keeps those tiles checked too.
+FLAT_STYLES = {name: style for name, style in STYLES.items() if not style.get("fill")}
+FLAT_STYLES["rounded"] = {"module": "rounded", "color": STYLES["gradient"]["color"]}
+
+
+def reference(qr: qrcode.QRCode, style):
+    img = qr.make_image(
+        image_factory=StyledPilImage,
+        module_drawer=DRAWERS[style["module"]](),
+        color_mask=SolidFillColorMask(front_color=style["color"]),
+    )
+    return img.get_image().convert("RGB")
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[20, 300])
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--styles", nargs="+", default=list(FLAT_STYLES), choices=list(FLAT_STYLES))
+    parser.add_argument("--error", default="medium", choices=list(ERROR_LEVELS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    failures = 0
+    print(f"{'len':>5} {'ver':>3} {'size':>6} {'style':>8} {'ref ms':>9} {'numpy ms':>9} {'speedup':>8} {'max diff':>8}")
+    for length in args.lengths:
+        text = ("https://example.com/?id=" + "x" * length)[:length]
+        for size in args.sizes:
+            qr = qrcode.QRCode(error_correction=ERROR_LEVELS[args.error], box_size=SIZES[size], border=4)
+            qr.add_data(text)
+            qr.make(fit=True)
+            matrix = pack_modules(qr.version, qr.modules)
+            for name in args.styles:
+                style = FLAT_STYLES[name]
+                ref, ref_time = timed(lambda: reference(qr, style), args.repeat)
+                out, out_time = timed(lambda: rasterize(matrix, SIZES[size], style), args.repeat)
+                if ref.size != out.size:
+                    diff = 255
+                else:
+                    diff = int(np.abs(np.asarray(ref, dtype=np.int16) - np.asarray(out, dtype=np.int16)).max())
+                failures += diff > args.tolerance
+                print(
+                    f"{length:>5} {qr.version:>3} {size:>6} {name:>8} "
+                    f"{ref_time * 1000:>9.1f} {out_time * 1000:>9.1f} {ref_time / out_time:>7.1f}x {diff:>8}"
+                )
+
+    if failures:
+        print(f"{failures} rendering(s) differ from the reference")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
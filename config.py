@@ -2,3 +2,115 @@ API_ID = YOUR_API_ID
 API_HASH = "YOUR_API_HASH"
 BOT_TOKEN = "YOUR_BOT_TOKEN"
 UPDATE_URL = "t.me/abirxdhackz"
+
+# Rendering runs in a pool of worker processes (defaults to one per CPU core).
+RENDER_WORKERS = None
+RENDER_QUEUE_SIZE = 64
+RENDER_TIMEOUT = 30
+
+# Finished PNGs are cached by content. Set RENDER_CACHE_DIR to spill evicted
+# entries to disk (and keep them across restarts).
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_DIR = None
+RENDER_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+# Encoded module matrices, keyed by (text, error level), reused across size
+# and style changes.
+MATRIX_CACHE_ENTRIES = 4096
+
+# Debugging aid: also write every generated image to DOWNLOADS_DIR. Uploads
+# are always streamed from memory.
+DEBUG_SAVE_RENDERS = False
+DOWNLOADS_DIR = "downloads"
+
+# Uploaded images are remembered by render cache key and resent by file
+# reference instead of being uploaded again. The FILE_REFS_MAX_ENTRIES most
+# recently used are kept; writes reach FILE_REFS_DB in batches.
+FILE_REFS_DB = "file_refs.db"
+FILE_REFS_MAX_ENTRIES = 100_000
+
+# Logos are fetched at the smallest photo size (or JPEG thumbnail) that still
+# covers the largest render, streamed with a hard cap of LOGO_MAX_FILE_BYTES.
+# PNG, JPEG and WebP files sent as documents are accepted too.
+LOGO_MAX_FILE_BYTES = 5 * 1024 * 1024
+
+# Conversation sessions: idle sessions expire after SESSION_TTL seconds and
+# the oldest are evicted past SESSION_MAX_COUNT or SESSION_MAX_BYTES.
+# SESSION_BACKEND is "memory" or "sqlite"; with "sqlite", sessions survive
+# restarts and can be shared by several bot processes through SESSION_DB.
+SESSION_BACKEND = "memory"
+SESSION_DB = "sessions.db"
+SESSION_MAX_COUNT = 100_000
+SESSION_TTL = 3600
+SESSION_MAX_BYTES = 256 * 1024 * 1024
+SESSION_SWEEP_INTERVAL = 60
+
+# HTTP render service: run standalone with python3 server.py, or set
+# RENDER_SERVER_IN_BOT to serve it from the bot process on the bot's render
+# pool. Set RENDER_SERVER_SOCKET to listen on a Unix socket instead of TCP.
+RENDER_SERVER_IN_BOT = False
+RENDER_SERVER_HOST = "127.0.0.1"
+RENDER_SERVER_PORT = 8080
+RENDER_SERVER_SOCKET = None
+RENDER_SERVER_MAX_BODY = 10 * 1024 * 1024
+
+# /batch: one payload per line, or CSV with text,size,error,style,label,format,
+# name columns (format is png, palette, svg or pdf). Rows are rendered
+# BATCH_WINDOW at a time and written straight into a ZIP under BATCH_DIR (the
+# system temp dir when None). A batch keeps at most BATCH_CONCURRENCY chunks
+# on the render workers (half of them when None), each taking an admission
+# slot only when no user is waiting for one.
+BATCH_MAX_ROWS = 50_000
+BATCH_MAX_FILE_BYTES = 20 * 1024 * 1024
+BATCH_WINDOW = 256
+BATCH_PROGRESS_INTERVAL = 3
+BATCH_DIR = None
+BATCH_CONCURRENCY = None
+
+# Inline mode (@bot text): each query is answered with one photo per style in
+# INLINE_STYLES. Renders wait INLINE_DEBOUNCE seconds for the user to stop
+# typing and give up after INLINE_TIMEOUT; Telegram caches the answer per
+# query text for INLINE_CACHE_TIME seconds. Enable inline mode in @BotFather.
+INLINE_STYLES = ("classic", "blue", "gradient", "dark", "green")
+INLINE_SIZE = "medium"
+INLINE_DEBOUNCE = 0.4
+INLINE_TIMEOUT = 8
+INLINE_CACHE_TIME = 300
+
+# Admission control. Each user and each chat has a token bucket refilled at
+# *_RATE actions per second up to *_BURST; messages and button presses over
+# the limit are dropped with a notice. Renders that miss the cache share
+# ADMISSION_CONCURRENCY slots (twice the render workers when None). Up to
+# ADMISSION_MAX_WAITING more wait in line, and anything past that is turned
+# away at once.
+ADMISSION_USER_RATE = 1.0
+ADMISSION_USER_BURST = 8
+ADMISSION_CHAT_RATE = 5.0
+ADMISSION_CHAT_BURST = 30
+ADMISSION_CONCURRENCY = None
+ADMISSION_MAX_WAITING = 100
+
+# zlib level (0-9) for PNG output: PNG_COMPRESS_LEVEL for regular PNGs,
+# PALETTE_COMPRESS_LEVEL for the compact palette format.
+PNG_COMPRESS_LEVEL = 6
+PALETTE_COMPRESS_LEVEL = 6
+
+# Prometheus metrics (stage and handler latency histograms, cache, queue and
+# session counters) on http://METRICS_HOST:METRICS_PORT/metrics; disabled
+# when METRICS_PORT is None. The render server also answers /metrics.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+
+# Run this fraction of renders under cProfile and keep the profiles of those
+# slower than PROFILE_SLOW_SECONDS in PROFILE_DIR (0 disables profiling).
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_SLOW_SECONDS = 0.5
+PROFILE_DIR = "profiles"
+
+# Speculative rendering: the settings currently on a user's screen are
+# rendered in the background, so Generate is usually a cache hit. At most
+# SPECULATIVE_CONCURRENCY renders run at once (half the render workers when
+# None), and only while a worker is idle and no real render is waiting.
+SPECULATIVE_RENDERING = True
+SPECULATIVE_CONCURRENCY = None
+SPECULATIVE_MAX_PENDING = 1000
@@ -1,39 +1,123 @@
-import io
+import asyncio
+import math
 import os
-from typing import Dict
+import shutil
+import tempfile
+import time
+from typing import Awaitable, Callable, Collection, Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
 
 import uvloop
 from telethon import TelegramClient, events, Button
+from telethon.errors import FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError
 from telethon.tl.custom import Message
-import qrcode
-from qrcode import ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q, ERROR_CORRECT_H
-from qrcode.image.styles.moduledrawers import (
-    SquareModuleDrawer,
-    RoundedModuleDrawer,
-    CircleModuleDrawer,
+from telethon.tl.functions.messages import UploadMediaRequest
+from telethon.tl.types import InputMediaUploadedPhoto, InputPeerSelf, InputPhoto
+from PIL import Image, UnidentifiedImageError
+from qrcode.exceptions import DataOverflowError
+
+from config import (
+    BOT_TOKEN, UPDATE_URL, API_ID, API_HASH,
+    RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_TIMEOUT,
+    RENDER_CACHE_BYTES, RENDER_CACHE_DIR, RENDER_CACHE_DISK_BYTES, MATRIX_CACHE_ENTRIES,
+    PNG_COMPRESS_LEVEL, PALETTE_COMPRESS_LEVEL,
+    DEBUG_SAVE_RENDERS, DOWNLOADS_DIR, FILE_REFS_DB, FILE_REFS_MAX_ENTRIES, LOGO_MAX_FILE_BYTES, RENDER_SERVER_IN_BOT,
+    SESSION_BACKEND, SESSION_DB, SESSION_MAX_COUNT, SESSION_TTL, SESSION_MAX_BYTES, SESSION_SWEEP_INTERVAL,
+    BATCH_MAX_ROWS, BATCH_MAX_FILE_BYTES, BATCH_WINDOW, BATCH_PROGRESS_INTERVAL, BATCH_DIR, BATCH_CONCURRENCY,
+    INLINE_STYLES, INLINE_SIZE, INLINE_DEBOUNCE, INLINE_TIMEOUT, INLINE_CACHE_TIME,
+    ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_CHAT_RATE, ADMISSION_CHAT_BURST,
+    ADMISSION_CONCURRENCY, ADMISSION_MAX_WAITING,
+    METRICS_HOST, METRICS_PORT, PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, PROFILE_DIR,
+    SPECULATIVE_RENDERING, SPECULATIVE_CONCURRENCY, SPECULATIVE_MAX_PENDING,
+)
+from utils import (
+    LOGGER, ERROR_LEVELS, MAX_LABEL_LENGTH, OUTPUT_FORMATS, SIZES, STYLES, AdmissionQueue, BatchArchive, FileRefStore, MatrixCache, MemoryUpload, MetricsRegistry, RenderCache, RenderJob, RenderPool,
+    RenderCrashed, RenderQueueFull, RenderTimeout, Session, SessionBackend, SessionStore, SpeculativeRenderer, SqliteSessionBackend,
+    MediaTooLarge, Overloaded, PositionCallback, RateLimiter, download_capped, fits_in_symbol, ingest_logo, logo_source, max_logo_size, read_batch_rows, run_batch, start_metrics_server,
 )
-from PIL import Image, ImageDraw, ImageFont
-
-from config import BOT_TOKEN, UPDATE_URL, API_ID, API_HASH
-from utils import LOGGER
 
 uvloop.install()
 
 bot = TelegramClient('qr_bot', API_ID, API_HASH)
+metrics = MetricsRegistry()
+render_cache = RenderCache(max_bytes=RENDER_CACHE_BYTES, disk_dir=RENDER_CACHE_DIR, disk_max_bytes=RENDER_CACHE_DISK_BYTES)
+render_pool = RenderPool(
+    workers=RENDER_WORKERS,
+    queue_size=RENDER_QUEUE_SIZE,
+    timeout=RENDER_TIMEOUT,
+    cache=render_cache,
+    matrix_cache=MatrixCache(max_entries=MATRIX_CACHE_ENTRIES),
+    png_compress_level=PNG_COMPRESS_LEVEL,
+    palette_compress_level=PALETTE_COMPRESS_LEVEL,
+    metrics=metrics,
+    profile_sample_rate=PROFILE_SAMPLE_RATE,
+    profile_slow_seconds=PROFILE_SLOW_SECONDS,
+    profile_dir=PROFILE_DIR,
+)
+file_refs = FileRefStore(FILE_REFS_DB, max_entries=FILE_REFS_MAX_ENTRIES)
+render_admission = AdmissionQueue(
+    concurrency=ADMISSION_CONCURRENCY or 2 * render_pool.workers,
+    max_waiting=ADMISSION_MAX_WAITING,
+)
+speculator = SpeculativeRenderer(
+    render_pool,
+    concurrency=SPECULATIVE_CONCURRENCY or max(1, render_pool.workers // 2),
+    max_pending=SPECULATIVE_MAX_PENDING,
+    busy=lambda: render_admission.waiting > 0,
+) if SPECULATIVE_RENDERING else None
+user_limits = RateLimiter(ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+chat_limits = RateLimiter(ADMISSION_CHAT_RATE, ADMISSION_CHAT_BURST)
+# At most one "slow down" message per user every 10 seconds.
+limit_notices = RateLimiter(0.1, 1)
+
+if SESSION_BACKEND == "sqlite":
+    sessions: SessionBackend = SqliteSessionBackend(
+        SESSION_DB,
+        ttl=SESSION_TTL,
+        max_cached=SESSION_MAX_COUNT,
+        sweep_interval=SESSION_SWEEP_INTERVAL,
+    )
+else:
+    sessions = SessionStore(
+        max_sessions=SESSION_MAX_COUNT,
+        ttl=SESSION_TTL,
+        max_bytes=SESSION_MAX_BYTES,
+        sweep_interval=SESSION_SWEEP_INTERVAL,
+    )
+
+running_batches: Set[int] = set()
+inline_tickets: Dict[int, int] = {}
+
+stage_seconds = metrics.histogram("qr_stage_seconds", "Time spent in each stage of producing a QR code.", "stage")
+handler_seconds = metrics.histogram("qr_handler_seconds", "Time to handle an update, by handler.", "handler")
+handler_errors = metrics.counter("qr_handler_errors_total", "Updates whose handler raised, by handler.", "handler")
+metrics.collected_counter(
+    "qr_rate_limited_total", "Updates dropped by rate limits.",
+    lambda: {"user": user_limits.limited, "chat": chat_limits.limited}, "scope",
+)
+metrics.gauge("qr_sessions", "Sessions held in memory.", lambda: sessions.stats().get("sessions", 0))
+metrics.gauge("qr_admission_slots", "Render admission slots in use and callers waiting.", lambda: {"active": render_admission.active, "waiting": render_admission.waiting}, "state")
+metrics.collected_counter(
+    "qr_admission_total", "Renders admitted or turned away by admission control.",
+    lambda: {"admitted": render_admission.admitted, "rejected": render_admission.rejected}, "result",
+)
+metrics.collected_counter(
+    "qr_file_refs_lookups_total", "Lookups of already uploaded files.",
+    lambda: {"hit": file_refs.hits, "miss": file_refs.misses}, "result",
+)
+metrics.gauge("qr_batches_running", "Batches being rendered.", lambda: len(running_batches))
+if speculator is not None:
+    metrics.collected_counter(
+        "qr_speculative_renders_total", "Speculative renders by outcome.",
+        lambda: {key: value for key, value in speculator.stats().items() if key not in ("pending", "running")}, "outcome",
+    )
+    metrics.gauge("qr_speculative_pending", "Speculative renders wanted but not started.", lambda: speculator.stats()["pending"])
 
-user_states: Dict[int, Dict] = {}
-user_data: Dict[int, Dict] = {}
-
-SIZES = {"small": 10, "medium": 15, "large": 20, "xlarge": 25}
-ERROR_LEVELS = {"low": ERROR_CORRECT_L, "medium": ERROR_CORRECT_M, "high": ERROR_CORRECT_Q, "max": ERROR_CORRECT_H}
-STYLES = {
-    "classic": {"drawer": SquareModuleDrawer(), "color": (0, 0, 0)},
-    "blue": {"drawer": SquareModuleDrawer(), "color": (0, 0, 255)},
-    "gradient": {"drawer": RoundedModuleDrawer(), "color": (100, 0, 200)},
-    "dark": {"drawer": SquareModuleDrawer(), "color": (30, 30, 30)},
-    "green": {"drawer": CircleModuleDrawer(), "color": (0, 128, 0)},
-}
 LOGO_SHAPES = {"square": "⬜ Square", "circle": "⭕ Circle", "rounded": "⏹ Rounded"}
+STYLE_NAMES = {
+    "classic": "⬛ Classic", "blue": "🔵 Blue", "gradient": "🌈 Gradient", "dark": "⚫ Dark", "green": "🟢 Green",
+    "sunset": "🌅 Sunset", "aurora": "🌌 Aurora",
+}
+FORMAT_NAMES = {"png": "🖼 PNG", "palette": "🗜 Compact PNG", "svg": "✏️ SVG", "pdf": "📑 PDF"}
 
 START_MSG = """👋 <b>Welcome to Ultimate QR Code Generator!</b>
 
@@ -52,6 +136,7 @@ I can create <b>customizable QR codes</b> with features like:
 <code>• Configure your QR code settings</code>
 <code>• Add optional logo & label</code>
 <code>• Generate and download!</code>
+<code>• Send /batch to convert a whole list into a ZIP</code>
 
 🔒 Works in <b>Private, Groups & Supergroups</b>.
 ✨ Ready? Send <code>/qr</code> to begin!
@@ -59,752 +144,832 @@ I can create <b>customizable QR codes</b> with features like:
 
 
 def get_state(user_id: int) -> str:
-    return user_states.get(user_id, {}).get("state", "")
+    session = sessions.get(user_id)
+    return session.state if session else ""
 
 
 def set_state(user_id: int, state: str):
-    if user_id not in user_states:
-        user_states[user_id] = {}
-    user_states[user_id]["state"] = state
+    session = sessions.get(user_id) or Session()
+    session.state = state
+    sessions.put(user_id, session)
 
 
 def clear_state(user_id: int):
-    user_states.pop(user_id, None)
-    user_data.pop(user_id, None)
+    sessions.pop(user_id)
 
 
-def get_data(user_id: int) -> Dict:
-    return user_data.get(user_id, {})
+def get_data(user_id: int) -> Optional[Session]:
+    session = sessions.get(user_id)
+    return session if session and session.text is not None else None
 
 
-def set_data(user_id: int, data: Dict):
-    user_data[user_id] = data
+def set_data(user_id: int, data: Session):
+    sessions.put(user_id, data)
 
 
-def get_initial_message() -> str:
-    return (
-        "<b>📱 QR Code Generator</b>\n"
-        "<b>━━━━━━━━━━━━━━━━━━━━━━</b>\n"
-        "Send me the data you'd like to convert into a QR code.\n\n"
-        "<b>✅ Supported Formats:</b>\n"
-        "<code>• Plain text</code>\n"
-        "<code>• Website URLs → https://example.com</code>\n"
-        "<code>• Phone numbers → tel:+1234567890</code>\n"
-        "<code>• Email addresses → mailto:email@example.com</code>\n"
-        "<code>• WiFi credentials → WIFI:T:WPA;S:NetworkName;P:Password;;</code>\n"
-        "<code>• SMS messages → smsto:+1234567890:Your message</code>\n"
-        "<code>• vCard contact info</code>\n\n"
-        "<b>🔢 Max Length:</b> <code>2953 characters</code>"
-    )
+def save_debug_render(path: str, png: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(png)
 
 
-def get_settings_message(data: Dict) -> str:
-    size_map = {"small": "📄 Small", "medium": "📄 Medium", "large": "📄 Large", "xlarge": "📄 Extra Large"}
-    err_map = {"low": "L (7%)", "medium": "M (15%)", "high": "H (30%)", "max": "Q (25%)"}
-    style_map = {"classic": "⬛ Classic", "blue": "🔵 Blue", "gradient": "🌈 Gradient", "dark": "⚫ Dark", "green": "🟢 Green"}
+async def send_rendered(chat_id: int, job: RenderJob, caption: str, user_id: int, on_wait: Optional[PositionCallback] = None):
+    key = job.cache_key()
+    media = file_refs.get(key)
+    if media is not None:
+        try:
+            start = time.perf_counter()
+            message = await bot.send_file(chat_id, media, caption=caption, parse_mode='html')
+            stage_seconds.observe(time.perf_counter() - start, "resend")
+            return message
+        except (FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError):
+            LOGGER.info(f"Stale file reference for {key[:16]}, uploading again")
+            file_refs.invalidate(key)
+
+    if key in render_cache or render_pool.is_rendering(key):
+        # Cached, or already being rendered (usually speculatively): no new
+        # work is queued, so there is nothing to admit.
+        png = await render_pool.render(job)
+    else:
+        async with render_admission.slot(on_wait):
+            png = await render_pool.render(job)
+
+    ext = OUTPUT_FORMATS[job.output]["ext"]
+    if DEBUG_SAVE_RENDERS:
+        debug_path = os.path.join(DOWNLOADS_DIR, f"{user_id}_{key[:16]}.{ext}")
+        LOGGER.info(f"Saving debug render to {debug_path}")
+        await asyncio.to_thread(save_debug_render, debug_path, png)
+
+    # Anything but the default PNG goes out as a file, so Telegram does not
+    # recompress it into a JPEG photo.
+    name = f"qr.{ext}"
+    start = time.perf_counter()
+    with MemoryUpload(png, name=name) as upload:
+        message = await bot.send_file(chat_id, upload, caption=caption, parse_mode='html', force_document=job.output != "png")
+    stage_seconds.observe(time.perf_counter() - start, "upload")
+    file_refs.put(key, message.photo or message.document)
+    return message
+
+
+async def upload_rendered_photo(job: RenderJob, png: bytes) -> InputPhoto:
+    """Upload a render as a photo without sending it anywhere, for inline results."""
+    with MemoryUpload(png, name="qr.png") as upload:
+        file = await bot.upload_file(upload)
+    media = await bot(UploadMediaRequest(InputPeerSelf(), InputMediaUploadedPhoto(file)))
+    key = job.cache_key()
+    file_refs.put(key, media.photo)
+    return file_refs.get(key)
+
+
+async def render_inline_photos(jobs: List[RenderJob], photos: List[Optional[InputPhoto]]):
+    missing = [i for i, photo in enumerate(photos) if photo is None]
+    async with render_admission.slot():
+        pngs = await render_pool.render_many([jobs[i] for i in missing])
+    uploaded = await asyncio.gather(*(upload_rendered_photo(jobs[i], png) for i, png in zip(missing, pngs)))
+    for i, photo in zip(missing, uploaded):
+        photos[i] = photo
+
+
+INITIAL_MSG = (
+    "<b>📱 QR Code Generator</b>\n"
+    "<b>━━━━━━━━━━━━━━━━━━━━━━</b>\n"
+    "Send me the data you'd like to convert into a QR code.\n\n"
+    "<b>✅ Supported Formats:</b>\n"
+    "<code>• Plain text</code>\n"
+    "<code>• Website URLs → https://example.com</code>\n"
+    "<code>• Phone numbers → tel:+1234567890</code>\n"
+    "<code>• Email addresses → mailto:email@example.com</code>\n"
+    "<code>• WiFi credentials → WIFI:T:WPA;S:NetworkName;P:Password;;</code>\n"
+    "<code>• SMS messages → smsto:+1234567890:Your message</code>\n"
+    "<code>• vCard contact info</code>\n\n"
+    "<b>🔢 Max Length:</b> <code>7089 digits, 4296 letters or 2953 bytes of text</code>"
+)
 
-    size_text = size_map[data["size"]]
-    err_text = err_map[data["error"]]
-    style_text = style_map[data["style"]]
+BATCH_MSG = (
+    "<b>📦 Batch QR Codes</b>\n"
+    "<b>━━━━━━━━━━━━━━━━━━━━━━</b>\n"
+    "Send a <b>.txt</b> file with one payload per line, or a <b>.csv</b> file with a "
+    "<code>text</code> column and optional <code>size</code>, <code>error</code>, "
+    "<code>style</code>, <code>label</code>, <code>format</code> (png, palette, svg or pdf) "
+    "and <code>name</code> columns.\n\n"
+    f"<b>🔢 Max Rows:</b> <code>{BATCH_MAX_ROWS}</code>"
+)
 
-    logo_part = f"<b>Logo:</b> <code>{data['logo_shape']}</code>\n" if data.get("has_logo") else ""
-    label_part = f"<b>Label:</b> <code>{data['label']}</code>\n" if data.get("label") else ""
+STYLE_MENU_MSG = "<b>🎨 Select QR Code Style</b>\n\n<b>Choose a color scheme for your QR code:</b>"
 
-    return (
-        "<b>⚙️ QR Code Settings</b>\n\n"
-        f"<b>Data:</b> <code>{data['text'][:50]}{'...' if len(data['text']) > 50 else ''}</code>\n"
-        f"<b>Size:</b> <code>{size_text}</code>\n"
-        f"<b>Error Correction:</b> <code>{err_text}</code>\n"
-        f"<b>Style:</b> <code>{style_text}</code>\n"
-        f"{logo_part}{label_part}\n"
-        "<b>Configure your QR code and click 'Generate'!</b>"
-    )
+FORMAT_MENU_MSG = (
+    "<b>📁 Select Output Format</b>\n\n"
+    "<code>• PNG → regular photo</code>\n"
+    "<code>• Compact PNG → smallest lossless image file</code>\n"
+    "<code>• SVG → vector, scales to any size</code>\n"
+    "<code>• PDF → vector, ready to print</code>"
+)
+
+LOGO_UPLOAD_MSG = (
+    "<b>🖼️ Upload Logo Image</b>\n\n"
+    "Send me an image to use as logo in QR code center.\n\n"
+    "<b>✅ Best practices:</b>\n"
+    "<code>• Use square or circular logos</code>\n"
+    "<code>• High contrast with background</code>\n"
+    "<code>• Simple designs work best</code>\n"
+    "<code>• Send PNGs as a file to keep transparency</code>\n"
+    "<code>• Logo will be 25% of QR code size</code>\n\n"
+    "<b>Choose shape or skip to continue without logo.</b>"
+)
 
+LOGO_SHAPE_MSG = "<b>🔲 Select Logo Shape</b>\n\n<b>Choose how your logo should appear:</b>"
 
-def build_settings_keyboard(data: Dict):
-    buttons = []
-    
-    size_buttons = [
-        ("small", "🕷 Small"),
-        ("medium", "💫 Medium"),
-        ("large", "🙈 Large"),
-        ("xlarge", "🙊 Extra Large")
-    ]
-    row1 = []
-    row2 = []
-    for key, label in size_buttons:
-        text = f"✅ {label.split()[1]}" if key == data["size"] else label
-        if key in ["small", "medium"]:
-            row1.append(Button.inline(text, f"size_{key}"))
-        else:
-            row2.append(Button.inline(text, f"size_{key}"))
-    buttons.append(row1)
-    buttons.append(row2)
-
-    err_buttons = [
-        ("low", "😔 Low"),
-        ("medium", "👁 Medium"),
-        ("high", "👀 High"),
-        ("max", "🫀 Max")
+LABEL_MSG = (
+    "<b>🏷️ Label Text</b>\n\n"
+    "Send me the text to display below QR code.\n"
+    "<b>Example:</b> <code>Scan Me, My Website, etc.</code>\n\n"
+    "<b>Click 'Skip Label' to continue without label.</b>"
+)
+
+SIZE_NAMES = {"small": "Small", "medium": "Medium", "large": "Large", "xlarge": "Extra Large"}
+ERROR_NAMES = {"low": "Low", "medium": "Medium", "high": "High", "max": "Max"}
+ERROR_LABELS = {"low": "L (7%)", "medium": "M (15%)", "high": "H (30%)", "max": "Q (25%)"}
+ERROR_PERCENT = {"low": "7", "medium": "15", "high": "30", "max": "25"}
+
+SIZE_BUTTONS = [("small", "🕷 Small"), ("medium", "💫 Medium"), ("large", "🙈 Large"), ("xlarge", "🙊 Extra Large")]
+ERROR_BUTTONS = [("low", "😔 Low"), ("medium", "👁 Medium"), ("high", "👀 High"), ("max", "🫀 Max")]
+STYLE_BUTTONS = [
+    ("classic", "🕷 Classic"), ("blue", "🕸 Blue"), ("gradient", "🤖 Gradient"), ("dark", "🔍 Dark"), ("green", "🙈 Green"),
+    ("sunset", "🌅 Sunset"), ("aurora", "🌌 Aurora"),
+]
+FORMAT_BUTTONS = [("png", "🖼 PNG"), ("palette", "🗜 Compact"), ("svg", "✏️ SVG"), ("pdf", "📑 PDF")]
+
+
+def choice_rows(options, selected: str, prefix: str, per_row: int):
+    buttons = [
+        Button.inline(f"✅ {label.split()[1]}" if key == selected else label, f"{prefix}_{key}")
+        for key, label in options
     ]
-    row3 = []
-    row4 = []
-    for key, label in err_buttons:
-        text = f"✅ {label.split()[1]}" if key == data["error"] else label
-        if key in ["low", "medium"]:
-            row3.append(Button.inline(text, f"error_{key}"))
-        else:
-            row4.append(Button.inline(text, f"error_{key}"))
-    buttons.append(row3)
-    buttons.append(row4)
-
-    buttons.append([Button.inline("🧠 Change Style", "change_style")])
-
-    logo_text = "✅ Add Logo" if data.get("has_logo") else "✍ Add Logo"
-    label_text = "✅ Add Label" if data.get("label") else "🔥 Add Label"
+    return [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
+
+
+def build_settings_keyboard(size: str, error: str, has_logo: bool, has_label: bool):
+    buttons = choice_rows(SIZE_BUTTONS, size, "size", 2) + choice_rows(ERROR_BUTTONS, error, "error", 2)
+    buttons.append([Button.inline("🧠 Change Style", "change_style"), Button.inline("📁 Format", "change_format")])
     buttons.append([
-        Button.inline(logo_text, "add_logo"),
-        Button.inline(label_text, "add_label")
+        Button.inline("✅ Add Logo" if has_logo else "✍ Add Logo", "add_logo"),
+        Button.inline("✅ Add Label" if has_label else "🔥 Add Label", "add_label"),
     ])
-
     buttons.append([Button.inline("💥 Generate QR Code", "generate")])
-    
-    return buttons
-
-
-def build_style_keyboard(data: Dict):
-    buttons = []
-    style_options = [
-        ("classic", "🕷 Classic"),
-        ("blue", "🕸 Blue"),
-        ("gradient", "🤖 Gradient"),
-        ("dark", "🔍 Dark"),
-        ("green", "🙈 Green")
-    ]
-    
-    row1 = []
-    row2 = []
-    row3 = []
-    
-    for i, (key, label) in enumerate(style_options):
-        text = f"✅ {label.split()[1]}" if key == data["style"] else label
-        btn = Button.inline(text, f"style_{key}")
-        if i < 2:
-            row1.append(btn)
-        elif i < 4:
-            row2.append(btn)
-        else:
-            row3.append(btn)
-    
-    buttons.append(row1)
-    buttons.append(row2)
-    buttons.append(row3)
+    return bot.build_reply_markup(buttons)
+
+
+def build_style_keyboard(style: str):
+    buttons = choice_rows(STYLE_BUTTONS, style, "style", 2)
     buttons.append([Button.inline("⬅️ Back To Settings", "back_settings")])
-    
-    return buttons
+    return bot.build_reply_markup(buttons)
 
 
-def build_logo_shape_keyboard():
-    return [
-        [Button.inline("⬜️ Square", "logo_square"), Button.inline("⭕️ Circle", "logo_circle")],
-        [Button.inline("⏹ Rounded", "logo_rounded")],
-        [Button.inline("◀️ Back To Settings", "back_settings")]
-    ]
+def build_format_keyboard(output: str):
+    buttons = choice_rows(FORMAT_BUTTONS, output, "format", 2)
+    buttons.append([Button.inline("⬅️ Back To Settings", "back_settings")])
+    return bot.build_reply_markup(buttons)
 
 
-def build_logo_upload_keyboard():
-    return [
-        [Button.inline("✅ Choose Shape", "choose_logo_shape")],
-        [Button.inline("🔍 Skip Logo", "skip_logo")]
-    ]
+# Every keyboard and fixed message the conversation can show, built once at
+# startup and shared by all users.
+SETTINGS_KEYBOARDS = {
+    (size, error, has_logo, has_label): build_settings_keyboard(size, error, has_logo, has_label)
+    for size in SIZE_NAMES for error in ERROR_NAMES for has_logo in (False, True) for has_label in (False, True)
+}
+STYLE_KEYBOARDS = {style: build_style_keyboard(style) for style in STYLE_NAMES}
+FORMAT_KEYBOARDS = {output: build_format_keyboard(output) for output in FORMAT_NAMES}
+START_KEYBOARD = bot.build_reply_markup([[Button.url("📢 Updates Channel", UPDATE_URL)]])
+CANCEL_KEYBOARD = bot.build_reply_markup([[Button.inline("❌ Cancel", "cancel")]])
+LOGO_SHAPE_KEYBOARD = bot.build_reply_markup([
+    [Button.inline("⬜️ Square", "logo_square"), Button.inline("⭕️ Circle", "logo_circle")],
+    [Button.inline("⏹ Rounded", "logo_rounded")],
+    [Button.inline("◀️ Back To Settings", "back_settings")],
+])
+LOGO_UPLOAD_KEYBOARD = bot.build_reply_markup([
+    [Button.inline("✅ Choose Shape", "choose_logo_shape")],
+    [Button.inline("🔍 Skip Logo", "skip_logo")],
+])
+LOGO_PHOTO_KEYBOARD = bot.build_reply_markup([[Button.inline("◀️ Skip Logo", "skip_logo")]])
+LABEL_KEYBOARD = bot.build_reply_markup([[Button.inline("◀️ Skip Label", "skip_label")]])
+
+SETTINGS_LINES = {
+    (size, error, style, output): (
+        f"<b>Size:</b> <code>📄 {SIZE_NAMES[size]}</code>\n"
+        f"<b>Error Correction:</b> <code>{ERROR_LABELS[error]}</code>\n"
+        f"<b>Style:</b> <code>{STYLE_NAMES[style]}</code>\n"
+        f"<b>Format:</b> <code>{FORMAT_NAMES[output]}</code>\n"
+    )
+    for size in SIZE_NAMES for error in ERROR_NAMES for style in STYLE_NAMES for output in FORMAT_NAMES
+}
+CAPTIONS = {
+    (size, error, style, output): (
+        "<b>✅ QR Code Generated</b>\n\n"
+        f"<b>Size:</b> <code>📄 {SIZE_NAMES[size]}</code>\n"
+        f"<b>Style:</b> <code>{STYLE_NAMES[style]}</code>\n"
+        f"<b>Error Correction:</b> <code>{ERROR_LABELS[error]}</code>"
+        + (f"\n<b>Format:</b> <code>{FORMAT_NAMES[output]}</code>" if output != "png" else "")
+    )
+    for size in SIZE_NAMES for error in ERROR_NAMES for style in STYLE_NAMES for output in FORMAT_NAMES
+}
+LOGO_LINES = {shape: f"<b>Logo:</b> <code>{name}</code>\n" for shape, name in LOGO_SHAPES.items()}
+LOGO_SELECTED_MSGS = {
+    shape: f"<b>🖼️ Upload Logo Image</b>\n\n<b>Selected shape:</b> <code>{name}</code>\n\n<b>Now send me the logo image.</b>"
+    for shape, name in LOGO_SHAPES.items()
+}
+LOGO_UPLOADED_MSGS = {
+    shape: f"<b>✅ Logo uploaded!</b>\n<b>Shape:</b> <code>{name}</code>\n\n"
+    for shape, name in LOGO_SHAPES.items()
+}
+
+
+def settings_keyboard(data: Session):
+    return SETTINGS_KEYBOARDS[(data.size, data.error, data.has_logo, bool(data.label))]
+
+
+def get_settings_message(data: Session) -> str:
+    logo_part = LOGO_LINES[data.logo_shape] if data.has_logo else ""
+    label_part = f"<b>Label:</b> <code>{data.label}</code>\n" if data.label else ""
+
+    return (
+        "<b>⚙️ QR Code Settings</b>\n\n"
+        f"<b>Data:</b> <code>{data.text[:50]}{'...' if len(data.text) > 50 else ''}</code>\n"
+        f"{SETTINGS_LINES[(data.size, data.error, data.style, data.output)]}"
+        f"{logo_part}{label_part}\n"
+        "<b>Configure your QR code and click 'Generate'!</b>"
+    )
+
+
+@bot.on(events.NewMessage())
+@bot.on(events.CallbackQuery())
+async def admission_handler(event):
+    # Registered before every other handler: over-limit updates stop here.
+    # Only updates some route handles count; the routers drop the rest.
+    if isinstance(event, events.CallbackQuery.Event):
+        routed = parse_callback(event.data)[0] in CALLBACK_ROUTES
+    else:
+        routed = route_message(event) is not None
+    if not routed:
+        return
+    wait = max(user_limits.check(event.sender_id), chat_limits.check(event.chat_id))
+    if not wait:
+        return
 
+    LOGGER.warning(f"Rate limited {event.sender_id} in {event.chat_id} for {wait:.1f}s")
+    if isinstance(event, events.CallbackQuery.Event):
+        await event.answer(f"Too Many Requests Please Try Again In {math.ceil(wait)}s", alert=True)
+    elif not limit_notices.check(event.sender_id):
+        await bot.send_message(event.chat_id, f"<b>⏳ Slow down! Try again in {math.ceil(wait)}s.</b>", parse_mode='html')
+    raise events.StopPropagation
 
-def build_logo_photo_keyboard():
-    return [[Button.inline("◀️ Skip Logo", "skip_logo")]]
+
+async def queue_notice(message, position: int):
+    try:
+        await message.edit(f"<b>⏳ Server is busy, you are #{position} in the queue...</b>", parse_mode='html')
+    except Exception as e:
+        LOGGER.warning(f"Queue notice failed: {e}")
 
 
-def build_label_keyboard():
-    return [[Button.inline("◀️ Skip Label", "skip_label")]]
+async def restore_settings(message, data: Session):
+    try:
+        await message.edit(get_settings_message(data), buttons=settings_keyboard(data), parse_mode='html')
+    except Exception as e:
+        LOGGER.warning(f"Settings restore failed: {e}")
 
 
-@bot.on(events.NewMessage(pattern='/start'))
 async def start_handler(event: Message):
     user_id = event.sender_id
     LOGGER.info(f"User {user_id} started bot")
-    
-    buttons = [[Button.url("📢 Updates Channel", UPDATE_URL)]]
-    
-    await bot.send_message(event.chat_id, START_MSG, buttons=buttons, parse_mode='html')
-    print(f"Start message sent to {user_id}")
+    await bot.send_message(event.chat_id, START_MSG, buttons=START_KEYBOARD, parse_mode='html')
+    LOGGER.debug(f"Start message sent to {user_id}")
 
 
-@bot.on(events.NewMessage(pattern='/qr'))
 async def qr_handler(event: Message):
     user_id = event.sender_id
     LOGGER.info(f"User {user_id} started /qr")
-    
-    buttons = [[Button.inline("❌ Cancel", "cancel")]]
-    await bot.send_message(event.chat_id, get_initial_message(), buttons=buttons, parse_mode='html')
+    await bot.send_message(event.chat_id, INITIAL_MSG, buttons=CANCEL_KEYBOARD, parse_mode='html')
     set_state(user_id, "waiting_data")
-    print(f"QR prompt sent to {user_id}")
+    LOGGER.debug(f"QR prompt sent to {user_id}")
 
 
-@bot.on(events.CallbackQuery(pattern=b'cancel'))
-async def cancel_callback(event):
+async def batch_handler(event: Message):
     user_id = event.sender_id
-    LOGGER.info(f"User {user_id} cancelled")
-    
-    await event.edit("<b>❌ QR code generation cancelled.</b>", parse_mode='html')
-    clear_state(user_id)
-    await event.answer()
-    print(f"Cancelled: {user_id}")
+    LOGGER.info(f"User {user_id} started /batch")
+    await bot.send_message(event.chat_id, BATCH_MSG, buttons=CANCEL_KEYBOARD, parse_mode='html')
+    set_state(user_id, "waiting_batch")
+    LOGGER.debug(f"Batch prompt sent to {user_id}")
 
 
-@bot.on(events.NewMessage())
-async def message_handler(event: Message):
-    if event.text and (event.text.startswith('/start') or event.text.startswith('/qr')):
-        return
-    
+async def process_batch(event: Message):
     user_id = event.sender_id
-    state = get_state(user_id)
-    
-    if state == "waiting_data":
-        text = event.text.strip()
-        sender = await event.get_sender()
-        full_name = sender.first_name or "User"
-        
-        print(f"Processing {full_name} Inputs")
-        
-        if len(text) > 2953:
-            await bot.send_message(event.chat_id, "<b>❌ Text too long! Max 2953 characters.</b>", parse_mode='html')
-            LOGGER.warning(f"Too long: {len(text)} from {user_id}")
-            return
-        if not text:
-            await bot.send_message(event.chat_id, "<b>⚠️ Please send valid data.</b>", parse_mode='html')
+    document = event.document
+    if document.size > BATCH_MAX_FILE_BYTES:
+        await bot.send_message(event.chat_id, f"<b>❌ File too large! Max {BATCH_MAX_FILE_BYTES // (1024 * 1024)} MB.</b>", parse_mode='html')
+        return
+    if user_id in running_batches:
+        await bot.send_message(event.chat_id, "<b>⏳ Your previous batch is still running.</b>", parse_mode='html')
+        return
+
+    running_batches.add(user_id)
+    clear_state(user_id)
+    workdir = tempfile.mkdtemp(prefix="qr_batch_", dir=BATCH_DIR)
+    progress = await bot.send_message(event.chat_id, "<b>📦 Downloading list...</b>", parse_mode='html')
+    last_edit = time.monotonic()
+
+    async def on_progress(rendered: int, failed: int):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < BATCH_PROGRESS_INTERVAL:
             return
+        last_edit = time.monotonic()
+        failed_part = f"\n<b>Skipped:</b> <code>{failed}</code>" if failed else ""
+        try:
+            await progress.edit(f"<b>📦 Generating QR codes...</b>\n<b>Done:</b> <code>{rendered}</code>{failed_part}", parse_mode='html')
+        except Exception as e:
+            LOGGER.warning(f"Batch progress edit failed for {user_id}: {e}")
 
-        print(f"Validating All Received Databases")
-        
-        data = {
-            "text": text,
-            "size": "medium",
-            "error": "medium",
-            "style": "classic",
-            "has_logo": False,
-            "logo_shape": None,
-            "logo_image": None,
-            "label": None,
-        }
-        set_data(user_id, data)
-        set_state(user_id, "settings")
-
-        buttons = build_settings_keyboard(data)
-        await bot.send_message(event.chat_id, get_settings_message(data), buttons=buttons, parse_mode='html')
-        await event.delete()
-        LOGGER.info(f"Data received from {user_id}")
-        
-    elif state == "waiting_logo_photo":
-        if event.photo:
-            photo = await event.download_media(bytes)
-            img = Image.open(io.BytesIO(photo))
-
-            data = get_data(user_id)
-            data["has_logo"] = True
-            data["logo_image"] = img
-            set_data(user_id, data)
-            set_state(user_id, "settings")
-
-            msg_text = (
-                f"<b>✅ Logo uploaded!</b>\n"
-                f"<b>Shape:</b> <code>{data['logo_shape']}</code>\n\n"
-                f"<b>⚙️ QR Code Settings</b>\n\n"
-                "<b>Ready to generate!</b>"
+    try:
+        source = await event.download_media(file=os.path.join(workdir, "rows"))
+        archive = BatchArchive(os.path.join(workdir, "qr_codes.zip"))
+        try:
+            result = await run_batch(
+                render_pool, read_batch_rows(source, BATCH_MAX_ROWS), archive, BATCH_WINDOW, on_progress,
+                concurrency=BATCH_CONCURRENCY or max(1, render_pool.workers // 2),
+                admission=render_admission,
             )
-            
-            await bot.send_message(event.chat_id, msg_text, buttons=build_settings_keyboard(data), parse_mode='html')
-            await event.delete()
-            print("Logo received")
-            
-    elif state == "add_label":
-        label = event.text.strip()
-        if len(label) > 100:
-            await bot.send_message(event.chat_id, "<b>❌ Label too long! Max 100 characters.</b>", parse_mode='html')
+        finally:
+            await asyncio.to_thread(archive.close)
+
+        if not result.rendered:
+            await progress.edit("<b>⚠️ No valid rows found in the file.</b>", parse_mode='html')
             return
+        await progress.edit(f"<b>📤 Uploading {result.rendered} QR codes...</b>", parse_mode='html')
+        failed_part = f"\n<b>Skipped:</b> <code>{result.failed}</code> (see errors.txt)" if result.failed else ""
+        caption = f"<b>✅ Batch Generated</b>\n\n<b>QR Codes:</b> <code>{result.rendered}</code>{failed_part}"
+        await bot.send_file(event.chat_id, archive.path, caption=caption, parse_mode='html', force_document=True)
+        await progress.delete()
+        LOGGER.info(f"Batch of {result.rendered} sent to {user_id}")
+    except ValueError as e:
+        await progress.edit(f"<b>❌ Batch rejected: {e}.</b>", parse_mode='html')
+        LOGGER.warning(f"Batch rejected for {user_id}: {e}")
+    except RenderTimeout:
+        await progress.edit("<b>❌ QR Code Generation Timed Out Please Try Again</b>", parse_mode='html')
+        LOGGER.error(f"Batch render timed out for {user_id}")
+    except RenderCrashed:
+        await progress.edit("<b>❌ QR Code Generation Failed Please Try Again</b>", parse_mode='html')
+        LOGGER.error(f"Batch render crashed for {user_id}")
+    except Exception as e:
+        await progress.edit("<b>❌ Batch failed. Please try again.</b>", parse_mode='html')
+        LOGGER.error(f"Error in process_batch: {e}")
+    finally:
+        running_batches.discard(user_id)
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
 
-        data = get_data(user_id)
-        data["label"] = label
-        set_data(user_id, data)
-        set_state(user_id, "settings")
-
-        logo_part = f"<b>✅ Logo uploaded!</b>\n<b>Shape:</b> <code>{data['logo_shape']}</code>\n\n" if data.get("has_logo") else ""
-        msg_text = (
-            f"{logo_part}"
-            f"<b>✅ Label added!</b>\n\n"
-            f"<b>⚙️ QR Code Settings</b>\n\n"
-            "<b>Ready to generate!</b>"
-        )
-        
-        await bot.send_message(event.chat_id, msg_text, buttons=build_settings_keyboard(data), parse_mode='html')
-        await event.delete()
-        print(f"Label: {label}")
 
+async def on_batch_file(event: Message):
+    if event.document:
+        await process_batch(event)
+    else:
+        await bot.send_message(event.chat_id, "<b>⚠️ Please send the list as a .txt or .csv file.</b>", parse_mode='html')
 
-@bot.on(events.CallbackQuery(pattern=b'size_'))
-async def size_callback(event):
-    try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "settings":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        size = event.data.decode().split("_")[1]
-        data = get_data(user_id)
-        
-        size_names = {"small": "Small", "medium": "Medium", "large": "Large", "xlarge": "Extra Large"}
-        
-        if data["size"] == size:
-            await event.answer(f"You Already Chosen {size_names[size]} As Size 🙄", alert=True)
-            return
-        
-        data["size"] = size
-        set_data(user_id, data)
-        await event.edit(get_settings_message(data), buttons=build_settings_keyboard(data), parse_mode='html')
-        await event.answer(f"QR Code Size Updated To {size_names[size]} Size")
-        print(f"Size: {size}")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in size_callback: {e}")
 
+async def on_data(event: Message):
+    user_id = event.sender_id
+    text = event.text.strip()
+    if not text:
+        await bot.send_message(event.chat_id, "<b>⚠️ Please send valid data.</b>", parse_mode='html')
+        return
+    # The real limit depends on the content: up to 7089 digits, 4296
+    # uppercase letters or 2953 bytes of UTF-8 at the lowest error level.
+    if not await asyncio.to_thread(fits_in_symbol, text):
+        await bot.send_message(event.chat_id, "<b>❌ Text too long! It does not fit in a QR code.</b>", parse_mode='html')
+        LOGGER.warning(f"Too long: {len(text)} from {user_id}")
+        return
 
-@bot.on(events.CallbackQuery(pattern=b'error_'))
-async def error_callback(event):
-    try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "settings":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        error = event.data.decode().split("_")[1]
-        data = get_data(user_id)
-        
-        error_percent = {"low": "7", "medium": "15", "high": "30", "max": "25"}
-        error_names = {"low": "Low", "medium": "Medium", "high": "High", "max": "Max"}
-        
-        if data["error"] == error:
-            await event.answer(f"You Already Chosen {error_names[error]} As Error Correction 🙄", alert=True)
-            return
-        
-        data["error"] = error
-        set_data(user_id, data)
-        await event.edit(get_settings_message(data), buttons=build_settings_keyboard(data), parse_mode='html')
-        await event.answer(f"Error Correction Updated To {error_percent[error]} Percent")
-        print(f"Error: {error}")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in error_callback: {e}")
+    data = Session(state="settings", text=text)
+    set_data(user_id, data)
+    speculate(user_id, data)
 
+    await bot.send_message(event.chat_id, get_settings_message(data), buttons=settings_keyboard(data), parse_mode='html')
+    await event.delete()
+    LOGGER.info(f"Data received from {user_id}")
 
-@bot.on(events.CallbackQuery(pattern=b'change_style'))
-async def change_style_callback(event):
-    try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "settings":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        data = get_data(user_id)
-        set_state(user_id, "choose_style")
-        buttons = build_style_keyboard(data)
-        await event.edit(
-            "<b>🎨 Select QR Code Style</b>\n\n<b>Choose a color scheme for your QR code:</b>",
-            buttons=buttons,
-            parse_mode='html'
-        )
-        await event.answer()
-        print("Style menu")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in change_style_callback: {e}")
 
+async def on_logo_photo(event: Message):
+    if not event.photo and not event.document:
+        return
+    user_id = event.sender_id
+    data = get_data(user_id)
+    max_size = await asyncio.to_thread(max_logo_size, data.text, max(SIZES.values()))
+    # Telegram keeps several sizes of every photo; the smallest that still
+    # covers the largest render is all the logo needs.
+    source = logo_source(event.photo, event.document, max_size)
+    if source is None:
+        await bot.send_message(event.chat_id, "<b>⚠️ Please send the logo as a photo or a PNG, JPEG or WebP file.</b>", parse_mode='html')
+        return
+    try:
+        image = await download_capped(bot, source, LOGO_MAX_FILE_BYTES)
+    except MediaTooLarge:
+        await bot.send_message(event.chat_id, f"<b>❌ Logo too large! Max {LOGO_MAX_FILE_BYTES // (1024 * 1024)} MB.</b>", parse_mode='html')
+        LOGGER.warning(f"Logo too large from {user_id}")
+        return
 
-@bot.on(events.CallbackQuery(pattern=b'style_'))
-async def style_callback(event):
     try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "choose_style":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        style = event.data.decode().split("_")[1]
-        data = get_data(user_id)
-        data["style"] = style
-        set_data(user_id, data)
-        set_state(user_id, "settings")
-        await event.edit(get_settings_message(data), buttons=build_settings_keyboard(data), parse_mode='html')
-        await event.answer()
-        print(f"Style: {style}")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in style_callback: {e}")
+        logo = await asyncio.to_thread(ingest_logo, image, max_size)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        await bot.send_message(event.chat_id, "<b>❌ This image could not be used as a logo. Please send another one.</b>", parse_mode='html')
+        LOGGER.warning(f"Unusable logo from {user_id}: {e}")
+        return
 
+    data.has_logo = True
+    data.logo_image = logo
+    data.state = "settings"
+    set_data(user_id, data)
+    speculate(user_id, data)
 
-@bot.on(events.CallbackQuery(pattern=b'back_settings'))
-async def back_settings_callback(event):
-    try:
-        user_id = event.sender_id
-        data = get_data(user_id)
-        set_state(user_id, "settings")
-        await event.edit(get_settings_message(data), buttons=build_settings_keyboard(data), parse_mode='html')
-        await event.answer()
-        print("Back")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in back_settings_callback: {e}")
+    msg_text = (
+        f"{LOGO_UPLOADED_MSGS[data.logo_shape]}"
+        f"<b>⚙️ QR Code Settings</b>\n\n"
+        "<b>Ready to generate!</b>"
+    )
 
+    await bot.send_message(event.chat_id, msg_text, buttons=settings_keyboard(data), parse_mode='html')
+    await event.delete()
+    LOGGER.debug("Logo received")
 
-@bot.on(events.CallbackQuery(pattern=b'add_logo'))
-async def add_logo_callback(event):
-    try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "settings":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        await event.edit(
-            "<b>🖼️ Upload Logo Image</b>\n\n"
-            "Send me an image to use as logo in QR code center.\n\n"
-            "<b>✅ Best practices:</b>\n"
-            "<code>• Use square or circular logos</code>\n"
-            "<code>• High contrast with background</code>\n"
-            "<code>• Simple designs work best</code>\n"
-            "<code>• PNG with transparency recommended</code>\n"
-            "<code>• Logo will be 25% of QR code size</code>\n\n"
-            "<b>Choose shape or skip to continue without logo.</b>",
-            buttons=build_logo_upload_keyboard(),
-            parse_mode='html'
-        )
-        set_state(user_id, "upload_logo")
-        await event.answer()
-        print("Logo start")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in add_logo_callback: {e}")
 
+async def on_label(event: Message):
+    user_id = event.sender_id
+    label = event.text.strip()
+    if len(label) > MAX_LABEL_LENGTH:
+        await bot.send_message(event.chat_id, "<b>❌ Label too long! Max 100 characters.</b>", parse_mode='html')
+        return
 
-@bot.on(events.CallbackQuery(pattern=b'choose_logo_shape'))
-async def choose_logo_shape_callback(event):
-    try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "upload_logo":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        set_state(user_id, "choose_logo_shape")
-        await event.edit(
-            "<b>🔲 Select Logo Shape</b>\n\n<b>Choose how your logo should appear:</b>",
-            buttons=build_logo_shape_keyboard(),
-            parse_mode='html'
-        )
-        await event.answer()
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in choose_logo_shape_callback: {e}")
+    data = get_data(user_id)
+    data.label = label
+    data.state = "settings"
+    set_data(user_id, data)
+    speculate(user_id, data)
+
+    logo_part = LOGO_UPLOADED_MSGS[data.logo_shape] if data.has_logo else ""
+    msg_text = (
+        f"{logo_part}"
+        f"<b>✅ Label added!</b>\n\n"
+        f"<b>⚙️ QR Code Settings</b>\n\n"
+        "<b>Ready to generate!</b>"
+    )
 
+    await bot.send_message(event.chat_id, msg_text, buttons=settings_keyboard(data), parse_mode='html')
+    await event.delete()
+    LOGGER.debug(f"Label: {label}")
 
-@bot.on(events.CallbackQuery(pattern=b'logo_square'))
-async def logo_square_callback(event):
-    try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "choose_logo_shape":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        shape_text = LOGO_SHAPES["square"]
-        data = get_data(user_id)
-        data["logo_shape"] = shape_text
-        set_data(user_id, data)
-        set_state(user_id, "waiting_logo_photo")
-        buttons = build_logo_photo_keyboard()
-        await event.edit(
-            f"<b>🖼️ Upload Logo Image</b>\n\n<b>Selected shape:</b> <code>{shape_text}</code>\n\n<b>Now send me the logo image.</b>",
-            buttons=buttons,
-            parse_mode='html'
-        )
-        await event.answer()
-        print(f"Shape: {shape_text}")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in logo_square_callback: {e}")
 
+async def on_cancel(event, user_id: int, data: Optional[Session], arg: Optional[str]):
+    LOGGER.info(f"User {user_id} cancelled")
+    await event.edit("<b>❌ QR code generation cancelled.</b>", parse_mode='html')
+    clear_state(user_id)
+    if speculator is not None:
+        speculator.cancel(user_id)
+    await event.answer()
+    LOGGER.debug(f"Cancelled: {user_id}")
 
-@bot.on(events.CallbackQuery(pattern=b'logo_circle'))
-async def logo_circle_callback(event):
-    try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "choose_logo_shape":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        shape_text = LOGO_SHAPES["circle"]
-        data = get_data(user_id)
-        data["logo_shape"] = shape_text
-        set_data(user_id, data)
-        set_state(user_id, "waiting_logo_photo")
-        buttons = build_logo_photo_keyboard()
-        await event.edit(
-            f"<b>🖼️ Upload Logo Image</b>\n\n<b>Selected shape:</b> <code>{shape_text}</code>\n\n<b>Now send me the logo image.</b>",
-            buttons=buttons,
-            parse_mode='html'
-        )
-        await event.answer()
-        print(f"Shape: {shape_text}")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in logo_circle_callback: {e}")
+
+def speculate(user_id: int, data: Session):
+    # Start rendering what is on the settings screen while the user decides.
+    if speculator is not None:
+        speculator.speculate(user_id, RenderJob.from_session(data))
+
+
+async def show_settings(event, user_id: int, data: Session):
+    data.state = "settings"
+    set_data(user_id, data)
+    speculate(user_id, data)
+    await event.edit(get_settings_message(data), buttons=settings_keyboard(data), parse_mode='html')
+
+
+async def on_size(event, user_id: int, data: Session, size: str):
+    if data.size == size:
+        await event.answer(f"You Already Chosen {SIZE_NAMES[size]} As Size 🙄", alert=True)
+        return
+    data.size = size
+    await show_settings(event, user_id, data)
+    await event.answer(f"QR Code Size Updated To {SIZE_NAMES[size]} Size")
+    LOGGER.debug(f"Size: {size}")
+
+
+async def on_error(event, user_id: int, data: Session, error: str):
+    if data.error == error:
+        await event.answer(f"You Already Chosen {ERROR_NAMES[error]} As Error Correction 🙄", alert=True)
+        return
+    data.error = error
+    await show_settings(event, user_id, data)
+    await event.answer(f"Error Correction Updated To {ERROR_PERCENT[error]} Percent")
+    LOGGER.debug(f"Error: {error}")
+
+
+async def on_change_style(event, user_id: int, data: Session, arg: Optional[str]):
+    data.state = "choose_style"
+    set_data(user_id, data)
+    await event.edit(STYLE_MENU_MSG, buttons=STYLE_KEYBOARDS[data.style], parse_mode='html')
+    await event.answer()
+    LOGGER.debug("Style menu")
+
+
+async def on_style(event, user_id: int, data: Session, style: str):
+    data.style = style
+    await show_settings(event, user_id, data)
+    await event.answer()
+    LOGGER.debug(f"Style: {style}")
+
+
+async def on_change_format(event, user_id: int, data: Session, arg: Optional[str]):
+    data.state = "choose_format"
+    set_data(user_id, data)
+    await event.edit(FORMAT_MENU_MSG, buttons=FORMAT_KEYBOARDS[data.output], parse_mode='html')
+    await event.answer()
+    LOGGER.debug("Format menu")
+
+
+async def on_format(event, user_id: int, data: Session, output: str):
+    data.output = output
+    await show_settings(event, user_id, data)
+    await event.answer()
+    LOGGER.debug(f"Format: {output}")
+
+
+async def on_back_settings(event, user_id: int, data: Session, arg: Optional[str]):
+    await show_settings(event, user_id, data)
+    await event.answer()
+    LOGGER.debug("Back")
+
+
+async def on_add_logo(event, user_id: int, data: Session, arg: Optional[str]):
+    await event.edit(LOGO_UPLOAD_MSG, buttons=LOGO_UPLOAD_KEYBOARD, parse_mode='html')
+    data.state = "upload_logo"
+    set_data(user_id, data)
+    await event.answer()
+    LOGGER.debug("Logo start")
+
+
+async def on_choose_logo_shape(event, user_id: int, data: Session, arg: Optional[str]):
+    data.state = "choose_logo_shape"
+    set_data(user_id, data)
+    await event.edit(LOGO_SHAPE_MSG, buttons=LOGO_SHAPE_KEYBOARD, parse_mode='html')
+    await event.answer()
 
 
-@bot.on(events.CallbackQuery(pattern=b'logo_rounded'))
-async def logo_rounded_callback(event):
+async def on_logo_shape(event, user_id: int, data: Session, shape: str):
+    data.logo_shape = shape
+    data.state = "waiting_logo_photo"
+    set_data(user_id, data)
+    await event.edit(LOGO_SELECTED_MSGS[shape], buttons=LOGO_PHOTO_KEYBOARD, parse_mode='html')
+    await event.answer()
+    LOGGER.debug(f"Shape: {LOGO_SHAPES[shape]}")
+
+
+async def on_skip_logo(event, user_id: int, data: Session, arg: Optional[str]):
+    data.has_logo = False
+    data.logo_shape = None
+    data.logo_image = None
+    await show_settings(event, user_id, data)
+    await event.answer()
+    LOGGER.debug("Logo skipped")
+
+
+async def on_add_label(event, user_id: int, data: Session, arg: Optional[str]):
+    data.state = "add_label"
+    set_data(user_id, data)
+    await event.edit(LABEL_MSG, buttons=LABEL_KEYBOARD, parse_mode='html')
+    await event.answer()
+    LOGGER.debug("Label start")
+
+
+async def on_skip_label(event, user_id: int, data: Session, arg: Optional[str]):
+    data.label = None
+    await show_settings(event, user_id, data)
+    await event.answer()
+    LOGGER.debug("Label skipped")
+
+
+async def on_generate(event, user_id: int, data: Session, arg: Optional[str]):
+    notified = False
+
+    async def on_wait(position: int):
+        nonlocal notified
+        notified = True
+        await queue_notice(event, position)
+
     try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "choose_logo_shape":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        shape_text = LOGO_SHAPES["rounded"]
-        data = get_data(user_id)
-        data["logo_shape"] = shape_text
-        set_data(user_id, data)
-        set_state(user_id, "waiting_logo_photo")
-        buttons = build_logo_photo_keyboard()
-        await event.edit(
-            f"<b>🖼️ Upload Logo Image</b>\n\n<b>Selected shape:</b> <code>{shape_text}</code>\n\n<b>Now send me the logo image.</b>",
-            buttons=buttons,
-            parse_mode='html'
-        )
+        caption = CAPTIONS[(data.size, data.error, data.style, data.output)]
+        if speculator is not None:
+            speculator.cancel(user_id)
+        await send_rendered(event.chat_id, RenderJob.from_session(data), caption, user_id, on_wait)
+        await event.delete()
+        clear_state(user_id)
         await event.answer()
-        print(f"Shape: {shape_text}")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in logo_rounded_callback: {e}")
+        LOGGER.info(f"QR sent to {user_id}")
+        return
+    except (Overloaded, RenderQueueFull):
+        await event.answer("Too Many Requests Please Try Again Later", alert=True)
+        LOGGER.warning(f"Render queue full, rejected {user_id}")
+    except RenderTimeout:
+        await event.answer("QR Code Generation Timed Out Please Try Again", alert=True)
+        LOGGER.error(f"Render timed out for {user_id}")
+    except RenderCrashed:
+        await event.answer("QR Code Generation Failed Please Try Again", alert=True)
+        LOGGER.error(f"Render crashed for {user_id}")
+    except DataOverflowError:
+        await event.answer("Too Much Data For This Error Correction Level Please Choose A Lower One", alert=True)
+    # The queue notice replaced the settings; bring them back to try again.
+    if notified:
+        await restore_settings(event, data)
+
+
+class CallbackRoute(NamedTuple):
+    handler: Callable[..., Awaitable[None]]
+    # States the action is valid in; None for actions that need no session.
+    states: Optional[FrozenSet[str]]
+    args: Optional[Collection[str]] = None
+
+
+SETTINGS = frozenset({"settings"})
+# Every state of the settings conversation, for back/skip buttons that only
+# return to the settings menu.
+IN_SETTINGS = frozenset({"settings", "choose_style", "choose_format", "upload_logo", "choose_logo_shape", "waiting_logo_photo", "add_label"})
+
+# The conversation's state machine: callback data "<action>" or
+# "<action>_<arg>" maps to its handler, the states it is allowed in and the
+# accepted args. Handlers set the next state themselves.
+CALLBACK_ROUTES: Dict[str, CallbackRoute] = {
+    "cancel": CallbackRoute(on_cancel, None),
+    "size": CallbackRoute(on_size, SETTINGS, SIZES),
+    "error": CallbackRoute(on_error, SETTINGS, ERROR_LEVELS),
+    "change_style": CallbackRoute(on_change_style, SETTINGS),
+    "style": CallbackRoute(on_style, frozenset({"choose_style"}), STYLES),
+    "change_format": CallbackRoute(on_change_format, SETTINGS),
+    "format": CallbackRoute(on_format, frozenset({"choose_format"}), OUTPUT_FORMATS),
+    "back_settings": CallbackRoute(on_back_settings, IN_SETTINGS),
+    "add_logo": CallbackRoute(on_add_logo, SETTINGS),
+    "choose_logo_shape": CallbackRoute(on_choose_logo_shape, frozenset({"upload_logo"})),
+    "logo": CallbackRoute(on_logo_shape, frozenset({"choose_logo_shape"}), LOGO_SHAPES),
+    "skip_logo": CallbackRoute(on_skip_logo, IN_SETTINGS),
+    "add_label": CallbackRoute(on_add_label, SETTINGS),
+    "skip_label": CallbackRoute(on_skip_label, IN_SETTINGS),
+    "generate": CallbackRoute(on_generate, SETTINGS),
+}
 
+COMMAND_ROUTES = {"/start": start_handler, "/qr": qr_handler, "/batch": batch_handler}
 
-@bot.on(events.CallbackQuery(pattern=b'skip_logo'))
-async def skip_logo_callback(event):
-    try:
-        user_id = event.sender_id
+# Plain messages are routed by the sender's conversation state.
+MESSAGE_ROUTES = {
+    "waiting_batch": on_batch_file,
+    "waiting_data": on_data,
+    "waiting_logo_photo": on_logo_photo,
+    "add_label": on_label,
+}
+
+
+def parse_callback(data: bytes) -> Tuple[str, Optional[str]]:
+    action = data.decode()
+    if action in CALLBACK_ROUTES:
+        return action, None
+    action, _, arg = action.partition("_")
+    return action, arg
+
+
+@bot.on(events.CallbackQuery())
+async def callback_router(event):
+    action, arg = parse_callback(event.data)
+    route = CALLBACK_ROUTES.get(action)
+    user_id = event.sender_id
+    data = None
+    if route is not None and route.states is not None:
         data = get_data(user_id)
-        data["has_logo"] = False
-        data.pop("logo_shape", None)
-        data.pop("logo_image", None)
-        set_data(user_id, data)
-        set_state(user_id, "settings")
-        await event.edit(get_settings_message(data), buttons=build_settings_keyboard(data), parse_mode='html')
-        await event.answer()
-        print("Logo skipped")
-    except Exception as e:
+        if data is None or data.state not in route.states:
+            route = None
+    if route is None or (route.args is not None and arg not in route.args):
         await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in skip_logo_callback: {e}")
-
+        return
 
-@bot.on(events.CallbackQuery(pattern=b'add_label'))
-async def add_label_callback(event):
+    start = time.perf_counter()
     try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "settings":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        set_state(user_id, "add_label")
-        await event.edit(
-            "<b>🏷️ Label Text</b>\n\n"
-            "Send me the text to display below QR code.\n"
-            "<b>Example:</b> <code>Scan Me, My Website, etc.</code>\n\n"
-            "<b>Click 'Skip Label' to continue without label.</b>",
-            buttons=build_label_keyboard(),
-            parse_mode='html'
-        )
-        await event.answer()
-        print("Label start")
+        await route.handler(event, user_id, data, arg)
     except Exception as e:
+        handler_errors.inc(route.handler.__name__)
         await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in add_label_callback: {e}")
+        LOGGER.error(f"Error in {action} callback: {e}")
+    finally:
+        handler_seconds.observe(time.perf_counter() - start, route.handler.__name__)
 
 
-@bot.on(events.CallbackQuery(pattern=b'skip_label'))
-async def skip_label_callback(event):
-    try:
-        user_id = event.sender_id
-        data = get_data(user_id)
-        data.pop("label", None)
-        set_data(user_id, data)
-        set_state(user_id, "settings")
-        await event.edit(get_settings_message(data), buttons=build_settings_keyboard(data), parse_mode='html')
-        await event.answer()
-        print("Label skipped")
-    except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in skip_label_callback: {e}")
+def route_message(event: Message) -> Optional[Callable[[Message], Awaitable[None]]]:
+    text = event.text or ""
+    handler = None
+    if text.startswith("/"):
+        handler = COMMAND_ROUTES.get(text.split(maxsplit=1)[0].split("@", 1)[0])
+    if handler is None:
+        handler = MESSAGE_ROUTES.get(get_state(event.sender_id))
+    return handler
 
 
-@bot.on(events.CallbackQuery(pattern=b'generate'))
-async def generate_callback(event):
+@bot.on(events.NewMessage())
+async def message_router(event: Message):
+    handler = route_message(event)
+    if handler is None:
+        return
+
+    start = time.perf_counter()
     try:
-        user_id = event.sender_id
-        state = get_state(user_id)
-        
-        if state != "settings":
-            await event.answer("Session Expired Please Try Again", alert=True)
-            return
-            
-        data = get_data(user_id)
-        sender = await event.get_sender()
-        full_name = sender.first_name or "User"
-        temp_path = f"downloads/{user_id}.png"
-        
-        os.makedirs("downloads", exist_ok=True)
-        
-        print(f"Processing {full_name} Inputs")
-        print(f"Validating All Received Databases")
-        
-        qr = qrcode.QRCode(
-            version=None,
-            error_correction=ERROR_LEVELS[data["error"]],
-            box_size=SIZES[data["size"]],
-            border=4,
-        )
-        qr.add_data(data["text"])
-        qr.make(fit=True)
-
-        style = STYLES[data["style"]]
-        img = qr.make_image(
-            fill_color=style["color"],
-            back_color=(255, 255, 255),
-            module_drawer=style["drawer"],
-        )
-        
-        img = img.convert("RGB")
-
-        if data.get("has_logo") and data.get("logo_image"):
-            logo = data["logo_image"].copy()
-            logo_size = img.size[0] // 4
-            logo = logo.resize((logo_size, logo_size), Image.LANCZOS)
-            
-            if logo.mode != "RGBA":
-                logo = logo.convert("RGBA")
-            
-            img_with_logo = Image.new("RGB", img.size, (255, 255, 255))
-            img_with_logo.paste(img, (0, 0))
-            
-            pos = ((img.size[0] - logo.size[0]) // 2, (img.size[1] - logo.size[1]) // 2)
-            
-            if logo.mode == "RGBA":
-                img_with_logo.paste(logo, pos, logo)
-            else:
-                img_with_logo.paste(logo, pos)
-            
-            img = img_with_logo
-
-        if data.get("label"):
-            label_text = data["label"]
-            label_height = 100
-            new_img = Image.new("RGB", (img.size[0], img.size[1] + label_height), (255, 255, 255))
-            new_img.paste(img, (0, 0))
-            
-            draw = ImageDraw.Draw(new_img)
-            
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-            except:
-                try:
-                    font = ImageFont.truetype("arial.ttf", 40)
-                except:
-                    font = ImageFont.load_default()
-            
-            try:
-                bbox = font.getbbox(label_text)
-                text_width = bbox[2] - bbox[0]
-            except:
-                text_width = len(label_text) * 20
-            
-            text_x = (new_img.size[0] - text_width) // 2
-            text_y = img.size[1] + 30
-            
-            draw.text((text_x, text_y), label_text, fill=(0, 0, 0), font=font)
-            img = new_img
-
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-
-        print(f"Generating Image -> /{temp_path}")
-        
-        with open(temp_path, "wb") as f:
-            f.write(buf.getvalue())
-
-        size_map = {"small": "Small", "medium": "Medium", "large": "Large", "xlarge": "Extra Large"}
-        err_map = {"low": "L (7%)", "medium": "M (15%)", "high": "H (30%)", "max": "Q (25%)"}
-        style_map = {"classic": "⬛ Classic", "blue": "🔵 Blue", "gradient": "🌈 Gradient", "dark": "⚫ Dark", "green": "🟢 Green"}
-
-        size_text = size_map[data["size"]]
-        err_text = err_map[data["error"]]
-        style_text = style_map[data["style"]]
-
-        caption = (
-            "<b>✅ QR Code Generated</b>\n\n"
-            f"<b>Size:</b> <code>📄 {size_text}</code>\n"
-            f"<b>Style:</b> <code>{style_text}</code>\n"
-            f"<b>Error Correction:</b> <code>{err_text}</code>"
-        )
+        await handler(event)
+    except Exception:
+        handler_errors.inc(handler.__name__)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - start, handler.__name__)
 
-        await event.delete()
-        await bot.send_file(
-            event.chat_id,
-            temp_path,
-            caption=caption,
-            parse_mode='html'
-        )
-        clear_state(user_id)
-        await event.answer()
-        LOGGER.info(f"QR sent to {user_id}")
 
-        print(f"Cleaning Download -> /{temp_path}")
+@bot.on(events.InlineQuery())
+async def inline_handler(event):
+    start = time.perf_counter()
+    user_id = event.sender_id
+    text = event.text.strip()
+    # Inline renders use the default (medium) error level.
+    if not text or not fits_in_symbol(text, ERROR_LEVELS["medium"]):
+        await event.answer([], switch_pm="Type text to turn into a QR code", switch_pm_param="start")
+        return
+
+    jobs = [RenderJob(text=text, size=INLINE_SIZE, style=style) for style in INLINE_STYLES]
+    photos = [file_refs.get(job.cache_key()) for job in jobs]
+
+    ticket = None
+    if None in photos:
+        # Telegram sends a query per keystroke; only render once typing pauses.
+        ticket = inline_tickets.get(user_id, 0) + 1
+        inline_tickets[user_id] = ticket
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if inline_tickets.get(user_id) != ticket:
+            return
+
+    try:
+        if ticket is not None:
+            try:
+                await asyncio.wait_for(render_inline_photos(jobs, photos), INLINE_TIMEOUT)
+            except (Overloaded, RenderQueueFull, RenderTimeout, RenderCrashed, asyncio.TimeoutError) as e:
+                LOGGER.warning(f"Inline render for {user_id} incomplete: {type(e).__name__}")
+
+        results = [
+            event.builder.photo(photo, id=style, text=f"<b>QR Code</b> <code>{STYLE_NAMES[style]}</code>", parse_mode='html')
+            for style, photo in zip(INLINE_STYLES, photos) if photo is not None
+        ]
+        # Telegram would keep serving a partial answer for the whole cache
+        # time, so only a complete one is cached.
+        cache_time = INLINE_CACHE_TIME if len(results) == len(jobs) else 0
         try:
-            os.remove(temp_path)
-        except:
-            pass
+            await event.answer(results, cache_time=cache_time, gallery=True)
+        except (FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError):
+            LOGGER.info(f"Stale file reference in inline results for {user_id}, uploading again next time")
+            for job in jobs:
+                file_refs.invalidate(job.cache_key())
+        LOGGER.debug(f"Inline results sent to {user_id}")
     except Exception as e:
-        await event.answer("Session Expired Please Try Again", alert=True)
-        LOGGER.error(f"Error in generate_callback: {e}")
+        handler_errors.inc("inline_handler")
+        LOGGER.error(f"Error in inline_handler: {e}")
+    finally:
+        handler_seconds.observe(time.perf_counter() - start, "inline_handler")
+        if ticket is not None and inline_tickets.get(user_id) == ticket:
+            del inline_tickets[user_id]
 
 
 async def main():
+    print("Starting Render Workers")
+    await render_pool.start()
+    sessions.start()
+    file_refs.start()
+    if speculator is not None:
+        speculator.start()
+    render_server = metrics_server = None
+    if RENDER_SERVER_IN_BOT:
+        from server import start_render_server
+        render_server = await start_render_server(render_pool, metrics=metrics)
+    if METRICS_PORT:
+        metrics_server = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
     print("Creating Bot Client From BOT_TOKEN")
     await bot.start(bot_token=BOT_TOKEN)
     print("Bot Client Created Successfully!")
     LOGGER.info("Bot started successfully")
     print("Bot is running...")
-    await bot.run_until_disconnected()
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        if render_server is not None:
+            await render_server.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+        sessions.stop()
+        if speculator is not None:
+            speculator.stop()
+        render_pool.shutdown()
+        render_cache.close()
+        file_refs.close()
 
 
 if __name__ == "__main__":
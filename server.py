@@ -0,0 +1,164 @@
+"""Local HTTP render service using the same pipeline and worker pool code as the bot.
+
+Endpoints::
+
+    GET  /qr?text=...&size=medium&error=medium&style=classic&label=...
+    POST /qr?text=...&logo_shape=circle      (body: logo image, PNG or JPEG)
+    POST /batch                              (body: JSON list of parameter objects)
+    GET  /health
+    GET  /metrics                            (Prometheus text format)
+
+Parameters match the settings keyboard: ``size`` is one of SIZES, ``error``
+one of ERROR_LEVELS, ``style`` one of STYLES and ``format`` one of
+OUTPUT_FORMATS (png by default). ``/qr`` answers with the image. ``/batch``
+renders all items on the pool in chunks and answers with
+``application/x-qr-batch``: every output prefixed by its length as a 4-byte
+big-endian integer, in request order.
+
+Connections are kept alive, so it can be load tested on localhost with any
+HTTP benchmarking tool, no Telegram involved.
+"""
+import asyncio
+import json
+import struct
+import time
+from typing import Optional
+
+import uvloop
+from PIL import Image
+from qrcode.exceptions import DataOverflowError
+
+from config import (
+    RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_TIMEOUT,
+    RENDER_CACHE_BYTES, RENDER_CACHE_DIR, RENDER_CACHE_DISK_BYTES, MATRIX_CACHE_ENTRIES,
+    PNG_COMPRESS_LEVEL, PALETTE_COMPRESS_LEVEL,
+    RENDER_SERVER_HOST, RENDER_SERVER_PORT, RENDER_SERVER_SOCKET, RENDER_SERVER_MAX_BODY,
+    PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, PROFILE_DIR,
+)
+from utils import (
+    LOGGER, OUTPUT_FORMATS, SIZES, HttpRequest, HttpResponse, HttpServer, MatrixCache, MetricsRegistry, RenderCache, RenderJob, RenderPool,
+    RenderCrashed, RenderQueueFull, RenderTimeout, ingest_logo, max_logo_size, metrics_response,
+)
+
+MAX_BATCH = 1000
+
+
+class RenderService:
+    def __init__(self, pool: RenderPool, metrics: Optional[MetricsRegistry] = None):
+        self.pool = pool
+        self.metrics = metrics or MetricsRegistry()
+        self.request_seconds = self.metrics.histogram("qr_http_request_seconds", "Render service request latency, by path.", "path")
+        self.routes = {
+            ("GET", "/qr"): self.qr,
+            ("POST", "/qr"): self.qr,
+            ("POST", "/batch"): self.batch,
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics_page,
+        }
+
+    async def handle(self, request: HttpRequest) -> HttpResponse:
+        route = self.routes.get((request.method, request.path))
+        if route is None:
+            if any(path == request.path for _, path in self.routes):
+                return HttpResponse.error(405)
+            return HttpResponse.error(404)
+        start = time.perf_counter()
+        try:
+            return await route(request)
+        except ValueError as e:
+            return HttpResponse.error(400, str(e))
+        except DataOverflowError:
+            return HttpResponse.error(400, "text does not fit in a QR code at this error level")
+        except RenderQueueFull:
+            return HttpResponse.error(503, "render queue is full")
+        except RenderTimeout:
+            return HttpResponse.error(504, "render timed out")
+        except RenderCrashed:
+            return HttpResponse.error(500, "render worker crashed")
+        finally:
+            self.request_seconds.observe(time.perf_counter() - start, request.path)
+
+    async def qr(self, request: HttpRequest) -> HttpResponse:
+        logo = None
+        if request.body:
+            text = request.query.get("text", "")
+            max_size = await asyncio.to_thread(max_logo_size, text, max(SIZES.values()))
+            try:
+                logo = await asyncio.to_thread(ingest_logo, request.body, max_size)
+            except OSError:
+                raise ValueError("body is not a supported image")
+            except Image.DecompressionBombError:
+                raise ValueError("logo image is too large")
+        job = await asyncio.to_thread(RenderJob.from_params, request.query, logo)
+        return HttpResponse(200, await self.pool.render(job), OUTPUT_FORMATS[job.output]["mime"])
+
+    async def batch(self, request: HttpRequest) -> HttpResponse:
+        try:
+            items = json.loads(request.body)
+        except json.JSONDecodeError:
+            raise ValueError("body must be a JSON list of parameter objects")
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError("body must be a JSON list of parameter objects")
+        if len(items) > MAX_BATCH:
+            raise ValueError(f"at most {MAX_BATCH} items per batch")
+
+        params = [{k: str(v) for k, v in item.items()} for item in items]
+        jobs = await asyncio.to_thread(lambda: [RenderJob.from_params(item) for item in params])
+        pngs = await self.pool.render_many(jobs)
+        body = b"".join(struct.pack(">I", len(png)) + png for png in pngs)
+        return HttpResponse(200, body, "application/x-qr-batch")
+
+    async def health(self, request: HttpRequest) -> HttpResponse:
+        stats = {"pending": self.pool.pending, "workers": self.pool.workers}
+        if self.pool.cache is not None:
+            stats["cache"] = self.pool.cache.stats()
+        return HttpResponse(200, json.dumps(stats).encode(), "application/json")
+
+    async def metrics_page(self, request: HttpRequest) -> HttpResponse:
+        return metrics_response(self.metrics)
+
+
+async def start_render_server(
+    pool: RenderPool,
+    host: str = RENDER_SERVER_HOST,
+    port: int = RENDER_SERVER_PORT,
+    socket_path: str = RENDER_SERVER_SOCKET,
+    metrics: Optional[MetricsRegistry] = None,
+) -> HttpServer:
+    service = RenderService(pool, metrics)
+    server = HttpServer(service.handle, max_body=RENDER_SERVER_MAX_BODY)
+    await server.start(host, port, socket_path)
+    LOGGER.info(f"Render server listening on {socket_path or f'{host}:{port}'}")
+    return server
+
+
+async def main():
+    metrics = MetricsRegistry()
+    pool = RenderPool(
+        workers=RENDER_WORKERS,
+        queue_size=RENDER_QUEUE_SIZE,
+        timeout=RENDER_TIMEOUT,
+        cache=RenderCache(max_bytes=RENDER_CACHE_BYTES, disk_dir=RENDER_CACHE_DIR, disk_max_bytes=RENDER_CACHE_DISK_BYTES),
+        matrix_cache=MatrixCache(max_entries=MATRIX_CACHE_ENTRIES),
+        png_compress_level=PNG_COMPRESS_LEVEL,
+        palette_compress_level=PALETTE_COMPRESS_LEVEL,
+        metrics=metrics,
+        profile_sample_rate=PROFILE_SAMPLE_RATE,
+        profile_slow_seconds=PROFILE_SLOW_SECONDS,
+        profile_dir=PROFILE_DIR,
+    )
+    print("Starting Render Workers")
+    await pool.start()
+    server = await start_render_server(pool, metrics=metrics)
+    print("Render server is running...")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        pool.shutdown()
+        if pool.cache is not None:
+            pool.cache.close()
+
+
+if __name__ == "__main__":
+    uvloop.run(main())
@@ -0,0 +1,53 @@
+import asyncio
+
+from utils import AdmissionQueue, BatchResult, run_batch
+
+
+class CountingPool:
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def render_many(self, jobs, chunk_size=8, store=True):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return [job.text.encode() for job in jobs]
+
+
+class MemoryArchive:
+    def __init__(self):
+        self.entries = []
+
+    def write(self, entries):
+        self.entries.extend(entries)
+
+
+def _rows(count):
+    return ((number, {"text": f"row {number}"}) for number in range(1, count + 1))
+
+
+def test_batch_keeps_to_its_share_of_the_pool():
+    pool = CountingPool()
+    archive = MemoryArchive()
+    result = asyncio.run(run_batch(pool, _rows(100), archive, window=32, concurrency=2, chunk_size=4))
+    assert result == BatchResult(100, 0)
+    assert pool.peak == 2
+    assert [name for name, _ in archive.entries] == [f"{number:05d}.png" for number in range(1, 101)]
+
+
+def test_batch_waits_for_free_admission_slots():
+    async def run():
+        pool = CountingPool()
+        admission = AdmissionQueue(concurrency=1)
+        await admission.acquire()
+        batch = asyncio.create_task(run_batch(pool, _rows(10), MemoryArchive(), admission=admission, retry_delay=0.01))
+        await asyncio.sleep(0.05)
+        assert pool.peak == 0
+        admission.release()
+        result = await batch
+        assert admission.active == 0
+        return result
+
+    assert asyncio.run(run()) == BatchResult(10, 0)
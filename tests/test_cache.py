@@ -0,0 +1,52 @@
+import asyncio
+import os
+
+from utils import RenderCache
+
+
+def test_disk_tier_spills_promotes_and_survives_restart(tmp_path):
+    async def run():
+        cache = RenderCache(max_bytes=10, disk_dir=str(tmp_path), disk_max_bytes=25)
+        cache.put("a", b"a" * 8)
+        cache.put("b", b"b" * 8)
+        assert await cache.get("a") == b"a" * 8
+        assert cache.disk_hits == 1
+        for key in "cde":
+            cache.put(key, key.encode() * 8)
+        cache.close()
+        return cache
+
+    cache = asyncio.run(run())
+    assert sorted(os.listdir(tmp_path)) == ["b.bin", "c.bin", "d.bin"]
+    assert cache.disk_bytes == 24
+
+    async def reopen():
+        again = RenderCache(max_bytes=10, disk_dir=str(tmp_path), disk_max_bytes=25)
+        try:
+            return await again.get("d")
+        finally:
+            again.close()
+
+    assert asyncio.run(reopen()) == b"d" * 8
+
+
+def test_missing_file_is_dropped_from_the_index(tmp_path):
+    async def run():
+        cache = RenderCache(max_bytes=4, disk_dir=str(tmp_path))
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        cache.put("c", b"cccc")
+        # Reads queue behind writes, so both files exist after this one.
+        assert await cache.get("b") == b"bbbb"
+        os.remove(tmp_path / "a.bin")
+        assert await cache.get("a") is None
+        assert "a" not in cache
+        cache.close()
+
+    asyncio.run(run())
+
+
+def test_legacy_png_entries_are_removed(tmp_path):
+    (tmp_path / "old.png").write_bytes(b"x")
+    RenderCache(disk_dir=str(tmp_path)).close()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from utils.httpserver import HttpError, HttpServer
+
+
+async def _handler(request):
+    raise AssertionError("not reached")
+
+
+def _read(raw: bytes):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await HttpServer(_handler)._read_request(reader)
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("length", ["-1", "abc", "+4", "1_0", ""])
+def test_bad_content_length_is_rejected(length):
+    raw = f"POST /qr HTTP/1.1\r\nContent-Length: {length}\r\n\r\nbody".encode()
+    with pytest.raises(HttpError) as error:
+        _read(raw)
+    assert error.value.status == 400
+
+
+def test_body_is_read_by_content_length():
+    request, keep_alive = _read(b"POST /qr?text=hi HTTP/1.1\r\nContent-Length: 4\r\n\r\nbody")
+    assert request.body == b"body"
+    assert request.query == {"text": "hi"}
+    assert keep_alive
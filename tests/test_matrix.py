@@ -0,0 +1,31 @@
+import pytest
+from qrcode import util
+
+from benchmarks.masks import reference
+from utils.matrix import encode_matrix, pack_modules
+from utils.render import ERROR_LEVELS
+from utils.symbol import mask_penalty
+
+PAYLOADS = [
+    "0123456789" * 5,
+    "HTTPS://EXAMPLE.COM/ABC",
+    "https://example.com/?id=" + "x" * 200,
+    "äöü€✓ mixed bytes",
+    "abcdefgh漢ijklmnop日本語テキスト漢字",
+]
+
+
+@pytest.mark.parametrize("error", list(ERROR_LEVELS))
+@pytest.mark.parametrize("text", PAYLOADS)
+def test_matrix_matches_qrcode_make_fit(text, error):
+    qr = reference(text, ERROR_LEVELS[error])
+    matrix = encode_matrix(text, ERROR_LEVELS[error])
+    assert matrix[:3] == pack_modules(qr.version, qr.modules)[:3]
+
+
+@pytest.mark.parametrize("text", PAYLOADS)
+def test_mask_penalty_matches_lost_point(text):
+    qr = reference(text, ERROR_LEVELS["medium"])
+    for pattern in range(8):
+        qr.makeImpl(True, pattern)
+        assert mask_penalty(qr.modules) == util.lost_point(qr.modules)
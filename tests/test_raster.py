@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+import qrcode
+
+from benchmarks.raster import FLAT_STYLES, reference
+from utils.matrix import pack_modules
+from utils.raster import rasterize
+from utils.render import ERROR_LEVELS, SIZES
+
+
+@pytest.mark.parametrize("style", list(FLAT_STYLES))
+@pytest.mark.parametrize("text", ["https://example.com/?id=42", "HELLO WORLD 1234567890" * 6])
+def test_raster_matches_styled_pil_image(text, style):
+    qr = qrcode.QRCode(error_correction=ERROR_LEVELS["medium"], box_size=SIZES["small"], border=4)
+    qr.add_data(text)
+    qr.make(fit=True)
+    out = rasterize(pack_modules(qr.version, qr.modules), SIZES["small"], FLAT_STYLES[style])
+    ref = reference(qr, FLAT_STYLES[style])
+    assert out.size == ref.size
+    assert np.array_equal(np.asarray(out), np.asarray(ref))
@@ -0,0 +1,25 @@
+import asyncio
+import os
+import signal
+
+from utils import RenderJob, RenderPool
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def test_pool_recovers_from_killed_worker():
+    async def run():
+        pool = RenderPool(workers=1, timeout=30)
+        await pool.start()
+        try:
+            broken = pool._executor
+            for pid in list(broken._processes):
+                os.kill(pid, signal.SIGKILL)
+            png = await pool.render(RenderJob(text="after the crash"))
+            assert png.startswith(PNG_SIGNATURE)
+            assert pool._executor is not broken
+            assert pool.pending == 0
+        finally:
+            pool.shutdown()
+
+    asyncio.run(run())
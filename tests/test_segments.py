@@ -0,0 +1,12 @@
+from qrcode import ERROR_CORRECT_M, util
+
+from utils.segments import plan_segments
+
+
+def test_kanji_payload_keeps_byte_segments_ascii():
+    plan = plan_segments("abcdefgh漢ijklmnop日本語テキスト漢字", ERROR_CORRECT_M)
+    modes = {segment.mode for segment in plan.segments}
+    assert util.MODE_KANJI in modes
+    for segment in plan.segments:
+        if segment.mode == util.MODE_8BIT_BYTE:
+            assert segment.data.isascii()
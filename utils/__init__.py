@@ -0,0 +1,34 @@
+from .logger import LOGGER
+from .admission import AdmissionQueue, Overloaded, PositionCallback, RateLimiter
+from .batch import BatchArchive, BatchResult, read_batch_rows, run_batch
+from .cache import RenderCache
+from .downloads import LOGO_MIME_TYPES, MediaSource, MediaTooLarge, download_capped, logo_source, pick_photo_size
+from .filerefs import FileRefStore
+from .labels import FontManager, LabelLayout, draw_label, get_fonts, render_label
+from .httpserver import HttpRequest, HttpResponse, HttpServer
+from .logos import LOGO_SHAPE_KEYS, Logo, ingest_logo, logo_variant, max_logo_size, shape_mask
+from .matrix import MatrixCache, QRMatrix, encode_matrix
+from .metrics import Counter, Histogram, MetricsRegistry, StageTimer, metrics_response, start_metrics_server
+from .raster import rasterize
+from .segments import SegmentPlan, fits_in_symbol, plan_segments
+from .sessions import Session, SessionBackend, SessionStore, SqliteSessionBackend
+from .render import (
+    SIZES,
+    ERROR_LEVELS,
+    STYLES,
+    OUTPUT_FORMATS,
+    MAX_TEXT_LENGTH,
+    MAX_LABEL_LENGTH,
+    RenderJob,
+    RenderPool,
+    RenderQueueFull,
+    RenderTimeout,
+    RenderCrashed,
+    render_batch,
+    render_job,
+    render_qr,
+)
+from .speculative import SpeculativeRenderer
+from .symbol import mask_penalty
+from .upload import MemoryUpload
+from .vector import VectorModules, render_pdf, render_svg, vector_modules
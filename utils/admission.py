@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+
+class Overloaded(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token buckets keyed by user or chat id.
+
+    Every key refills ``rate`` tokens per second up to ``burst``. Buckets are
+    kept in an LRU bounded by ``max_keys``; a bucket that is dropped would
+    have been full again anyway unless its key is extremely active.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.limited = 0
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def check(self, key: Hashable, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens for ``key``; return 0 or the seconds until that would succeed."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= cost:
+            tokens -= cost
+            wait = 0.0
+        else:
+            self.limited += 1
+            wait = (cost - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class AdmissionQueue:
+    """FIFO limit on concurrent renders with a bounded wait queue.
+
+    Up to ``concurrency`` holders run at once. Later arrivals wait in order,
+    and are told their position through ``on_wait``. Once ``max_waiting``
+    callers are queued, new ones get ``Overloaded`` at once rather than
+    piling up behind them.
+    """
+
+    def __init__(self, concurrency: int, max_waiting: int = 100):
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free and nobody is waiting for it.
+
+        For background work that must never queue ahead of interactive callers.
+        """
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        return False
+
+    async def acquire(self, on_wait: Optional[PositionCallback] = None):
+        if self.try_acquire():
+            return
+        if len(self._waiters) >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            if on_wait is not None:
+                await on_wait(len(self._waiters))
+            # release() hands its slot straight to the first waiter.
+            await waiter
+        except BaseException:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            elif not waiter.cancelled():
+                self.release()
+            raise
+        self.admitted += 1
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, on_wait: Optional[PositionCallback] = None) -> AsyncIterator[None]:
+        await self.acquire(on_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,190 @@
+import asyncio
+import csv
+import re
+import zipfile
+from typing import Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from qrcode.exceptions import DataOverflowError
+
+from .admission import AdmissionQueue
+from .render import OUTPUT_FORMATS, RenderCrashed, RenderJob, RenderPool, RenderQueueFull
+
+BATCH_COLUMNS = ("text", "size", "error", "style", "label", "format", "name")
+
+Row = Tuple[int, Dict[str, str]]
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class BatchResult(NamedTuple):
+    rendered: int
+    failed: int
+
+
+def read_batch_rows(path: str, max_rows: int) -> Iterator[Row]:
+    """Yield ``(line_number, params)`` for every payload in an uploaded file.
+
+    A file whose first line names a ``text`` column is read as CSV with
+    optional ``size``, ``error``, ``style``, ``label``, ``format`` and ``name`` columns;
+    anything else is one payload per non-empty line. Rows are read lazily,
+    so the file is never loaded whole. Raises ``ValueError`` past ``max_rows``.
+    """
+    with open(path, newline="", encoding="utf-8-sig", errors="replace") as f:
+        first = f.readline()
+        header = [column.strip().lower() for column in next(csv.reader([first]), [])]
+        count = 0
+        if "text" in header:
+            rows = (
+                (number, {column: (value or "").strip() for column, value in row.items() if column in BATCH_COLUMNS})
+                for number, row in enumerate(csv.DictReader(f, fieldnames=header), start=2)
+            )
+        else:
+            f.seek(0)
+            rows = ((number, {"text": line.strip()}) for number, line in enumerate(f, start=1))
+
+        for number, params in rows:
+            if not params.get("text"):
+                continue
+            count += 1
+            if count > max_rows:
+                raise ValueError(f"more than {max_rows} rows")
+            yield number, params
+
+
+def entry_name(number: int, job: RenderJob, params: Dict[str, str]) -> str:
+    name = re.sub(r"[^\w.-]+", "_", params.get("name", "")).strip("._")[:64]
+    ext = OUTPUT_FORMATS[job.output]["ext"]
+    return f"{number:05d}_{name}.{ext}" if name else f"{number:05d}.{ext}"
+
+
+class BatchArchive:
+    """ZIP archive written entry by entry, so only one window of outputs is held in memory.
+
+    PNGs and PDFs are already deflated and are stored as is; only text
+    entries (SVG, errors.txt) are compressed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = 0
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def write(self, entries: List[Tuple[str, bytes]]):
+        for name, data in entries:
+            compression = zipfile.ZIP_DEFLATED if name.endswith((".svg", ".txt")) else zipfile.ZIP_STORED
+            self._zip.writestr(name, data, compress_type=compression)
+        self.entries += len(entries)
+
+    def close(self):
+        self._zip.close()
+
+
+async def run_batch(
+    pool: RenderPool,
+    rows: Iterator[Row],
+    archive: BatchArchive,
+    window: int = 256,
+    on_progress: Optional[ProgressCallback] = None,
+    retry_delay: float = 0.5,
+    concurrency: int = 1,
+    admission: Optional[AdmissionQueue] = None,
+    chunk_size: int = 8,
+) -> BatchResult:
+    """Render ``rows`` on ``pool`` into ``archive``, one window at a time.
+
+    The next window renders while the previous one is written to the archive
+    in a thread. Invalid rows are listed in ``errors.txt`` instead of failing
+    the batch. Windows are sent to the pool in chunks of ``chunk_size``, at
+    most ``concurrency`` at once, so the rest of the workers stay free for
+    interactive renders. With ``admission``, every chunk also takes one of its
+    slots, but only a free one nobody is waiting for: the batch backs off
+    and retries instead of queueing ahead of users, as it does when the pool
+    is full. Results are not stored in the render cache.
+    """
+    rendered = 0
+    errors: List[str] = []
+    limit = asyncio.Semaphore(concurrency)
+
+    def parse_window(batch: List[Row]) -> Tuple[List[RenderJob], List[Tuple[int, str]]]:
+        jobs, entries = [], []
+        for number, params in batch:
+            try:
+                job = RenderJob.from_params(params)
+            except ValueError as e:
+                errors.append(f"line {number}: {e}")
+                continue
+            jobs.append(job)
+            entries.append((number, entry_name(number, job, params)))
+        return jobs, entries
+
+    async def render_chunk(jobs: List[RenderJob]) -> List[bytes]:
+        while True:
+            async with limit:
+                if admission is None or admission.try_acquire():
+                    try:
+                        return await pool.render_many(jobs, chunk_size=len(jobs), store=False)
+                    except RenderQueueFull:
+                        pass
+                    finally:
+                        if admission is not None:
+                            admission.release()
+            await asyncio.sleep(retry_delay)
+
+    async def render_jobs(jobs: List[RenderJob]) -> List[bytes]:
+        chunks = await asyncio.gather(*(render_chunk(jobs[i:i + chunk_size]) for i in range(0, len(jobs), chunk_size)))
+        return [png for chunk in chunks for png in chunk]
+
+    async def render_row(job: RenderJob, number: int, name: str) -> Optional[Tuple[str, bytes]]:
+        try:
+            return name, (await render_jobs([job]))[0]
+        except DataOverflowError:
+            errors.append(f"line {number}: text does not fit in a QR code at error level {job.error}")
+        except RenderCrashed:
+            errors.append(f"line {number}: rendering crashed")
+        except ValueError as e:
+            errors.append(f"line {number}: {e}")
+        return None
+
+    async def render_window(batch: List[Row]) -> List[Tuple[str, bytes]]:
+        # Checking each row's capacity is real work; keep it off the loop.
+        jobs, entries = await asyncio.to_thread(parse_window, batch)
+        try:
+            pngs = await render_jobs(jobs)
+        except (DataOverflowError, ValueError, RenderCrashed):
+            # A row the worker rejects fails its whole chunk; retry the
+            # window row by row so only that row lands in errors.txt.
+            rows = await asyncio.gather(*(render_row(job, number, name) for job, (number, name) in zip(jobs, entries)))
+            return [row for row in rows if row is not None]
+        return [(name, png) for (_, name), png in zip(entries, pngs)]
+
+    async def write_window(task: asyncio.Task) -> int:
+        entries = await task
+        await asyncio.to_thread(archive.write, entries)
+        if on_progress is not None:
+            await on_progress(rendered + len(entries), len(errors))
+        return len(entries)
+
+    def windows() -> Iterator[List[Row]]:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= window:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    tasks: List[asyncio.Task] = []
+    try:
+        for batch in windows():
+            tasks.append(asyncio.create_task(render_window(batch)))
+            if len(tasks) > 1:
+                rendered += await write_window(tasks.pop(0))
+        if tasks:
+            rendered += await write_window(tasks.pop(0))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if errors:
+        await asyncio.to_thread(archive.write, [("errors.txt", "\n".join(errors).encode())])
+    return BatchResult(rendered, len(errors))
@@ -0,0 +1,161 @@
+import asyncio
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+# Outputs are PNG, SVG or PDF; the format is part of the key, not the name.
+DISK_SUFFIX = ".bin"
+
+
+class RenderCache:
+    """LRU cache of finished outputs keyed by ``RenderJob.cache_key()``.
+
+    The memory tier holds at most ``max_bytes`` of encoded images. When
+    ``disk_dir`` is set, entries evicted from memory spill to that directory
+    (bounded by ``disk_max_bytes``) and are promoted back on the next hit, so
+    the disk tier also survives restarts. The disk index lives in memory;
+    file reads, writes and deletes run in order on one worker thread, so a
+    read always sees the writes queued before it and the event loop never
+    waits on the disk.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None, disk_max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-cache")
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or key in self._disk
+
+    async def get(self, key: str) -> Optional[bytes]:
+        png = self._entries.get(key)
+        if png is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return png
+
+        png = await self._read_disk(key)
+        if png is not None:
+            self.disk_hits += 1
+            self.put(key, png)
+            return png
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, png: bytes):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._store(key, png)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self.disk_bytes,
+        }
+
+    def close(self):
+        """Wait for queued disk writes to finish."""
+        self._executor.shutdown(wait=True)
+
+    def _store(self, key: str, png: bytes):
+        if len(png) > self.max_bytes:
+            self._write_disk(key, png)
+            return
+        self._entries[key] = png
+        self.bytes += len(png)
+        while self.bytes > self.max_bytes:
+            old_key, old_png = self._entries.popitem(last=False)
+            self.bytes -= len(old_png)
+            self._write_disk(old_key, old_png)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}{DISK_SUFFIX}")
+
+    def _load_disk_index(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith((".tmp", ".png")):
+                # Interrupted writes, and entries named before outputs other
+                # than PNG were cached; the latter are stale keys anyway.
+                _remove(path)
+                continue
+            if not name.endswith(DISK_SUFFIX):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name[:-len(DISK_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self.disk_bytes += size
+        self._trim_disk()
+
+    async def _read_disk(self, key: str) -> Optional[bytes]:
+        if key not in self._disk:
+            return None
+        self._disk.move_to_end(key)
+        png = await asyncio.get_running_loop().run_in_executor(self._executor, _read, self._path(key))
+        if png is None and key in self._disk:
+            # The file is gone or its write failed; forget it.
+            self.disk_bytes -= self._disk.pop(key)
+        return png
+
+    def _write_disk(self, key: str, png: bytes):
+        if not self.disk_dir or key in self._disk or len(png) > self.disk_max_bytes:
+            return
+        self._disk[key] = len(png)
+        self.disk_bytes += len(png)
+        self._executor.submit(_write, self._path(key), png)
+        self._trim_disk()
+
+    def _trim_disk(self):
+        while self.disk_bytes > self.disk_max_bytes:
+            old_key, size = self._disk.popitem(last=False)
+            self.disk_bytes -= size
+            self._executor.submit(_remove, self._path(old_key))
+
+
+def _read(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        _remove(tmp_path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
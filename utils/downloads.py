@@ -0,0 +1,98 @@
+from typing import List, NamedTuple, Optional, Union
+
+from telethon.tl import types
+
+# Document types accepted as logos. Telegram's document thumbnails are
+# always JPEG, so they stand in only for JPEG documents; PNG and WebP
+# uploads are fetched whole to keep their alpha channel.
+LOGO_MIME_TYPES = frozenset({"image/png", "image/jpeg", "image/webp"})
+
+PhotoSizes = Union[types.PhotoSize, types.PhotoSizeProgressive, types.PhotoCachedSize]
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class MediaSource(NamedTuple):
+    """One downloadable rendition of a photo or document.
+
+    ``data`` holds the bytes of sizes Telegram sends inline, in which case
+    ``location`` is None and nothing needs downloading.
+    """
+
+    location: Optional[Union[types.InputPhotoFileLocation, types.InputDocumentFileLocation]]
+    dc_id: int
+    size: int
+    data: Optional[bytes] = None
+
+
+def _size_bytes(size: PhotoSizes) -> int:
+    if isinstance(size, types.PhotoSizeProgressive):
+        return max(size.sizes)
+    if isinstance(size, types.PhotoCachedSize):
+        return len(size.bytes)
+    return size.size
+
+
+def pick_photo_size(sizes: List, side: int) -> Optional[PhotoSizes]:
+    """The smallest size whose longer side is at least ``side`` pixels.
+
+    Falls back to the largest size when none is big enough. Stripped and
+    path sizes are previews, not images, and are never picked.
+    """
+    usable = [
+        size for size in sizes
+        if isinstance(size, (types.PhotoSize, types.PhotoSizeProgressive, types.PhotoCachedSize))
+    ]
+    if not usable:
+        return None
+    usable.sort(key=lambda size: (size.w * size.h, _size_bytes(size)))
+    return next((size for size in usable if max(size.w, size.h) >= side), usable[-1])
+
+
+def logo_source(photo: Optional[types.Photo], document: Optional[types.Document], side: int) -> Optional[MediaSource]:
+    """The cheapest rendition of an uploaded logo that is still ``side`` pixels across.
+
+    Returns None for media that cannot be a logo: no photo sizes, or a
+    document that is not a PNG, JPEG or WebP image.
+    """
+    if photo is not None:
+        size = pick_photo_size(photo.sizes, side)
+        if size is None:
+            return None
+        if isinstance(size, types.PhotoCachedSize):
+            return MediaSource(None, photo.dc_id, len(size.bytes), size.bytes)
+        location = types.InputPhotoFileLocation(photo.id, photo.access_hash, photo.file_reference, size.type)
+        return MediaSource(location, photo.dc_id, _size_bytes(size))
+
+    if document is None or document.mime_type not in LOGO_MIME_TYPES:
+        return None
+    if document.mime_type == "image/jpeg" and document.thumbs:
+        thumb = pick_photo_size(document.thumbs, side)
+        # A thumbnail only wins if it covers ``side`` and is smaller than the file.
+        if thumb is not None and max(thumb.w, thumb.h) >= side and _size_bytes(thumb) < document.size:
+            if isinstance(thumb, types.PhotoCachedSize):
+                return MediaSource(None, document.dc_id, len(thumb.bytes), thumb.bytes)
+            location = types.InputDocumentFileLocation(document.id, document.access_hash, document.file_reference, thumb.type)
+            return MediaSource(location, document.dc_id, _size_bytes(thumb))
+    location = types.InputDocumentFileLocation(document.id, document.access_hash, document.file_reference, "")
+    return MediaSource(location, document.dc_id, document.size)
+
+
+async def download_capped(client, source: MediaSource, max_bytes: int) -> bytes:
+    """Stream ``source`` into memory, raising ``MediaTooLarge`` past ``max_bytes``.
+
+    The size Telegram reports is checked before the first request, and the
+    running total after every chunk, so a wrong size cannot overrun the cap.
+    """
+    if source.size > max_bytes:
+        raise MediaTooLarge(source.size)
+    if source.data is not None:
+        return source.data
+    buffer = bytearray()
+    async for chunk in client.iter_download(source.location, file_size=source.size, dc_id=source.dc_id):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise MediaTooLarge(len(buffer))
+    return bytes(buffer)
@@ -0,0 +1,131 @@
+import asyncio
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple, Union
+
+from telethon.tl import types
+
+from .logger import LOGGER
+
+FileRef = Tuple[str, int, int, bytes]
+
+
+class FileRefStore:
+    """Persistent map from render cache key to an already uploaded Telegram file.
+
+    Rows hold the ``(kind, id, access_hash, file_reference)`` of the photo or
+    document Telegram returned for the first upload, so identical outputs are
+    resent by reference without uploading any bytes. Lookups are served from
+    memory in least-recently-used order, bounded by ``max_entries``; evicted
+    refs are deleted from the SQLite file too, which only makes the map
+    survive restarts. Writes are queued and flushed in batches from a worker
+    thread every ``flush_interval`` seconds once :meth:`start` is called.
+    """
+
+    def __init__(self, path: str = "file_refs.db", max_entries: int = 100_000, flush_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._refs: "OrderedDict[str, FileRef]" = OrderedDict()
+        # Rows to write on the next flush; None deletes the key.
+        self._pending: Dict[str, Optional[FileRef]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-refs")
+        self._flusher: Optional[asyncio.Task] = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_refs ("
+            "key TEXT PRIMARY KEY, kind TEXT, id INTEGER, access_hash INTEGER, file_reference BLOB)"
+        )
+        # Replacing a row gives it a new rowid, so this is oldest write first.
+        rows = self._db.execute("SELECT key, kind, id, access_hash, file_reference FROM file_refs ORDER BY rowid")
+        for key, kind, file_id, access_hash, file_reference in rows:
+            self._refs[key] = (kind, file_id, access_hash, bytes(file_reference))
+        self._evict()
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def get(self, key: str) -> Optional[Union[types.InputPhoto, types.InputDocument]]:
+        ref = self._refs.get(key)
+        if ref is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._refs.move_to_end(key)
+        kind, file_id, access_hash, file_reference = ref
+        if kind == "photo":
+            return types.InputPhoto(file_id, access_hash, file_reference)
+        return types.InputDocument(file_id, access_hash, file_reference)
+
+    def put(self, key: str, media: Union[types.Photo, types.Document, None]):
+        if isinstance(media, types.Photo):
+            kind = "photo"
+        elif isinstance(media, types.Document):
+            kind = "document"
+        else:
+            return
+        ref = (kind, media.id, media.access_hash, media.file_reference)
+        self._refs[key] = ref
+        self._refs.move_to_end(key)
+        self._pending[key] = ref
+        self._evict()
+
+    def invalidate(self, key: str):
+        if self._refs.pop(key, None) is not None:
+            self._pending[key] = None
+
+    def _evict(self):
+        while len(self._refs) > self.max_entries:
+            key, _ = self._refs.popitem(last=False)
+            self._pending[key] = None
+            self.evicted += 1
+
+    def flush(self) -> int:
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        return self._write(pending)
+
+    def _write(self, pending: Dict[str, Optional[FileRef]]) -> int:
+        rows = [(key, *ref) for key, ref in pending.items() if ref is not None]
+        deleted = [(key,) for key, ref in pending.items() if ref is None]
+        with self._db:
+            if rows:
+                self._db.executemany("INSERT OR REPLACE INTO file_refs VALUES (?, ?, ?, ?, ?)", rows)
+            if deleted:
+                self._db.executemany("DELETE FROM file_refs WHERE key = ?", deleted)
+        return len(pending)
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        # Let a batch already handed to the worker finish before the last flush.
+        self._executor.shutdown(wait=True)
+        self.flush()
+        self._db.close()
+
+    async def _run_flusher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            pending, self._pending = self._pending, {}
+            if not pending:
+                continue
+            try:
+                await loop.run_in_executor(self._executor, self._write, pending)
+            except sqlite3.Error as e:
+                LOGGER.error(f"Failed to flush {len(pending)} file refs: {e}")
+                # Put the batch back unless newer writes replaced it meanwhile.
+                for key, ref in pending.items():
+                    self._pending.setdefault(key, ref)
@@ -0,0 +1,117 @@
+import os
+from functools import lru_cache
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+
+FILL_KINDS = ("linear", "radial", "image")
+
+# Image fills are resampled to at most this many pixels per side before
+# they are quantized, for raster output and for embedding in SVG and PDF.
+IMAGE_FILL_RESOLUTION = 512
+
+# Rows of the canvas whose gradient is computed at once, to bound the size
+# of the float temporaries on large symbols.
+CHUNK_ROWS = 512
+
+
+def linear_endpoints(fill: Dict) -> Tuple[float, float, float, float]:
+    """Start and end of a linear fill, in units of the symbol's side.
+
+    ``angle`` is in degrees clockwise from left-to-right. The gradient runs
+    from the symbol's first corner in that direction to the opposite one.
+    """
+    angle = np.radians(fill.get("angle", 0))
+    dx, dy = float(np.cos(angle)), float(np.sin(angle))
+    half = (abs(dx) + abs(dy)) / 2
+    return 0.5 - dx * half, 0.5 - dy * half, 0.5 + dx * half, 0.5 + dy * half
+
+
+def radial_circle(fill: Dict) -> Tuple[float, float, float]:
+    """Centre and radius of a radial fill, in units of the symbol's side.
+
+    The default radius reaches the symbol's corners from the centre.
+    """
+    cx, cy = fill.get("center", (0.5, 0.5))
+    radius = fill.get("radius", max(np.hypot(x - cx, y - cy) for x in (0, 1) for y in (0, 1)))
+    return float(cx), float(cy), float(radius)
+
+
+def gradient_stops(fill: Dict) -> Sequence[Tuple[float, Tuple[int, int, int]]]:
+    """``(offset, color)`` pairs, evenly spaced over 0..1."""
+    colors = fill["colors"]
+    return [(i / (len(colors) - 1), tuple(color)) for i, color in enumerate(colors)]
+
+
+def gradient_colors(fill: Dict, count: int) -> np.ndarray:
+    """Colours of ``count`` equal bands of the gradient, sampled at their middles."""
+    offsets, colors = zip(*gradient_stops(fill))
+    t = (np.arange(count) + 0.5) / count
+    colors = np.array(colors, dtype=np.float64)
+    return np.stack([np.interp(t, offsets, colors[:, c]) for c in range(3)], axis=1).round().astype(np.uint8)
+
+
+def gradient_bands(fill: Dict, size: int, offset: int, extent: int, count: int, top: int, bottom: int) -> np.ndarray:
+    """Band index, 0..count-1, of every pixel in canvas rows ``top:bottom``.
+
+    Pixel centres are mapped to the symbol's unit square, which starts at
+    ``offset`` and is ``extent`` pixels wide, so the quiet zone does not
+    stretch the gradient.
+    """
+    u = (np.arange(size, dtype=np.float32) + 0.5 - offset) / extent
+    v = (np.arange(top, bottom, dtype=np.float32) + 0.5 - offset) / extent
+    if fill["kind"] == "linear":
+        x1, y1, x2, y2 = linear_endpoints(fill)
+        dx, dy = x2 - x1, y2 - y1
+        norm = dx * dx + dy * dy
+        t = ((v - y1) * (dy / norm))[:, None] + ((u - x1) * (dx / norm))[None, :]
+    else:
+        cx, cy, radius = radial_circle(fill)
+        t = np.sqrt(((v - cy) ** 2)[:, None] + ((u - cx) ** 2)[None, :]) / radius
+    t *= count
+    np.clip(t, 0, count - 1, out=t)
+    return t.astype(np.uint8)
+
+
+@lru_cache(maxsize=8)
+def fill_source(path: str) -> Image.Image:
+    """The fill image at ``path`` (relative to ``assets/``), square-cropped and bounded."""
+    with Image.open(os.path.join(ASSETS_DIR, path)) as img:
+        img = img.convert("RGB")
+    side = min(img.size)
+    left, top = (img.size[0] - side) // 2, (img.size[1] - side) // 2
+    img = img.crop((left, top, left + side, top + side))
+    if side > IMAGE_FILL_RESOLUTION:
+        img = img.resize((IMAGE_FILL_RESOLUTION, IMAGE_FILL_RESOLUTION), Image.Resampling.LANCZOS)
+    return img
+
+
+def image_bands(fill: Dict, size: int, offset: int, extent: int, count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Band index of every canvas pixel for an image fill, and the band colours.
+
+    The image is quantized to ``count`` colours at its own resolution and the
+    indices scaled up with nearest neighbour, which PIL does in C.
+    """
+    source = fill_source(fill["path"])
+    quantized = source.quantize(count, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    colors = np.array(quantized.getpalette()[:count * 3], dtype=np.uint8).reshape(-1, 3)
+    bands = np.zeros((size, size), dtype=np.uint8)
+    scaled = quantized.resize((extent, extent), Image.Resampling.NEAREST)
+    bands[offset:offset + extent, offset:offset + extent] = np.asarray(scaled)
+    return bands, colors
+
+
+def fill_palette(colors: np.ndarray, coverage: np.ndarray, back_color: Tuple[int, int, int]) -> np.ndarray:
+    """Palette for canvases indexed by ``band * (levels - 1) + level``.
+
+    Entry 0 is the background; ``coverage`` holds the ink value (1..255) of
+    every level above it. Colours are blended like :func:`raster.color_lut`.
+    """
+    back = np.array(back_color, dtype=np.float64)
+    alpha = coverage.astype(np.float64)[None, :, None] / 255
+    blended = (colors.astype(np.float64)[:, None, :] * alpha + back * (1 - alpha)).astype(np.uint8)
+    return np.concatenate([np.array([back_color], dtype=np.uint8), blended.reshape(-1, 3)])
+
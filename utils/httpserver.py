@@ -0,0 +1,157 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .logger import LOGGER
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+class HttpRequest(NamedTuple):
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes
+
+
+class HttpResponse(NamedTuple):
+    status: int
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+    @classmethod
+    def error(cls, status: int, message: Optional[str] = None) -> "HttpResponse":
+        return cls(status, (message or REASONS.get(status, "Error")).encode() + b"\n")
+
+
+Handler = Callable[[HttpRequest], Awaitable[HttpResponse]]
+
+
+class HttpError(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class HttpServer:
+    """A small HTTP/1.1 server for local services, built on asyncio streams.
+
+    Connections are kept alive between requests (HTTP/1.1 semantics) until
+    the client sends ``Connection: close`` or stays idle for
+    ``idle_timeout`` seconds. Bodies must come with ``Content-Length``.
+    """
+
+    def __init__(self, handler: Handler, max_body: int = 10 * 1024 * 1024, idle_timeout: float = 30.0, max_header_bytes: int = 16 * 1024):
+        self.handler = handler
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self.max_header_bytes = max_header_bytes
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080, socket_path: Optional[str] = None):
+        if socket_path:
+            self._server = await asyncio.start_unix_server(self._serve, path=socket_path, limit=self.max_header_bytes)
+        else:
+            self._server = await asyncio.start_server(self._serve, host, port, limit=self.max_header_bytes)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for task in self._connections:
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request, keep_alive = await asyncio.wait_for(self._read_request(reader), self.idle_timeout)
+                except HttpError as e:
+                    await self._write(writer, HttpResponse.error(e.status), keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                self.requests += 1
+                try:
+                    response = await self.handler(request)
+                except Exception as e:
+                    LOGGER.error(f"Error handling {request.method} {request.path}: {e}")
+                    response = HttpResponse.error(500)
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[Optional[HttpRequest], bool]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HttpError(400)
+            return None, False
+        except asyncio.LimitOverrunError:
+            raise HttpError(431)
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HttpError(400)
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(411)
+        # int() would also take signs, underscores and non-ASCII digits.
+        content_length = headers.get("content-length", "0")
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise HttpError(400)
+        length = int(content_length)
+        if length > self.max_body:
+            raise HttpError(413)
+        body = await reader.readexactly(length) if length else b""
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        return HttpRequest(method.upper(), url.path, query, headers, body), keep_alive
+
+    async def _write(self, writer: asyncio.StreamWriter, response: HttpResponse, keep_alive: bool):
+        head = (
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.writelines((head.encode("latin-1"), response.body))
+        await writer.drain()
@@ -0,0 +1,134 @@
+from functools import lru_cache
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .logger import LOGGER
+
+FONT_PATHS = ("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", "arial.ttf")
+
+LABEL_FONT_SIZE = 40
+LABEL_MIN_FONT_SIZE = 16
+LABEL_MAX_LINES = 3
+LABEL_PADDING = 30
+LABEL_LINE_SPACING = 6
+LABEL_COLOR = (0, 0, 0)
+
+
+class LabelLayout(NamedTuple):
+    font_size: int
+    height: int
+    # (x, y, text) of every line, relative to the top-left of the label area.
+    lines: Tuple[Tuple[int, int, str], ...]
+
+
+class FontManager:
+    """Resolves the label font once and caches sized fonts and measured layouts.
+
+    The first loadable entry of ``paths`` is picked at construction; sized
+    ``FreeTypeFont`` objects and layouts keyed by ``(text, width)`` are kept
+    in LRU caches, so a repeat label costs a dictionary lookup.
+    """
+
+    def __init__(self, paths: Sequence[str] = FONT_PATHS):
+        self.font_path: Optional[str] = None
+        self.font = lru_cache(maxsize=64)(self._load_font)
+        self.layout = lru_cache(maxsize=1024)(self._layout)
+        for path in paths:
+            try:
+                ImageFont.truetype(path, LABEL_FONT_SIZE)
+            except OSError:
+                continue
+            self.font_path = path
+            break
+        else:
+            LOGGER.warning("No TrueType label font found, using Pillow's default font")
+        self.font(LABEL_FONT_SIZE)
+
+    def _load_font(self, size: int) -> ImageFont.FreeTypeFont:
+        if self.font_path is None:
+            return ImageFont.load_default(size)
+        return ImageFont.truetype(self.font_path, size)
+
+    def _text_width(self, font: ImageFont.FreeTypeFont, text: str) -> int:
+        bbox = font.getbbox(text)
+        return bbox[2] - bbox[0]
+
+    def _wrap(self, font: ImageFont.FreeTypeFont, text: str, width: int) -> Tuple[str, ...]:
+        lines = []
+        line = ""
+        for word in text.split():
+            candidate = f"{line} {word}" if line else word
+            if self._text_width(font, candidate) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # Words wider than the whole line are broken by character.
+            line = ""
+            for char in word:
+                if line and self._text_width(font, line + char) > width:
+                    lines.append(line)
+                    line = ""
+                line += char
+        if line:
+            lines.append(line)
+        return tuple(lines)
+
+    def _layout(self, text: str, width: int) -> LabelLayout:
+        usable = max(width - LABEL_PADDING * 2, 1)
+        sizes = range(LABEL_FONT_SIZE, LABEL_MIN_FONT_SIZE - 1, -2)
+        # Prefer the largest size that keeps the label on one line, then the
+        # largest that wraps it into at most LABEL_MAX_LINES lines.
+        for size in sizes:
+            if self._text_width(self.font(size), text) <= usable:
+                lines = (text,)
+                break
+        else:
+            for size in sizes:
+                lines = self._wrap(self.font(size), text, usable)
+                if len(lines) <= LABEL_MAX_LINES:
+                    break
+
+        font = self.font(size)
+        ascent, descent = font.getmetrics()
+        line_height = ascent + descent + LABEL_LINE_SPACING
+        placed = []
+        y = LABEL_PADDING
+        for line in lines:
+            bbox = font.getbbox(line)
+            x = (width - (bbox[2] - bbox[0])) // 2 - bbox[0]
+            placed.append((x, y, line))
+            y += line_height
+        height = y - LABEL_LINE_SPACING + LABEL_PADDING
+        return LabelLayout(size, height, tuple(placed))
+
+
+_fonts: Optional[FontManager] = None
+
+
+def get_fonts() -> FontManager:
+    global _fonts
+    if _fonts is None:
+        _fonts = FontManager()
+    return _fonts
+
+
+def render_label(text: str, width: int) -> Image.Image:
+    """The label area alone, ``width`` pixels wide, as drawn below a QR code."""
+    fonts = get_fonts()
+    layout = fonts.layout(text, width)
+    strip = Image.new("RGB", (width, layout.height), (255, 255, 255))
+    draw = ImageDraw.Draw(strip)
+    font = fonts.font(layout.font_size)
+    for x, y, line in layout.lines:
+        draw.text((x, y), line, fill=LABEL_COLOR, font=font)
+    return strip
+
+
+def draw_label(img: Image.Image, text: str) -> Image.Image:
+    strip = render_label(text, img.size[0])
+    labelled = Image.new("RGB", (img.size[0], img.size[1] + strip.size[1]), (255, 255, 255))
+    labelled.paste(img, (0, 0))
+    labelled.paste(strip, (0, img.size[1]))
+    return labelled
@@ -0,0 +1,113 @@
+import hashlib
+import io
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from qrcode import ERROR_CORRECT_H
+from qrcode.exceptions import DataOverflowError
+from PIL import Image, ImageChops, ImageDraw
+
+from .segments import plan_segments
+
+
+class Logo(NamedTuple):
+    """A logo normalized at upload time.
+
+    ``pixels`` is premultiplied RGBA (PIL mode ``RGBa``), already bounded to
+    the largest size any render of the session can paste, and ``digest``
+    identifies those pixels for render and variant caches.
+    """
+
+    width: int
+    height: int
+    pixels: bytes
+    digest: str
+
+    def image(self) -> Image.Image:
+        return Image.frombuffer("RGBa", (self.width, self.height), self.pixels, "raw", "RGBa", 0, 1)
+
+
+def max_logo_size(text: str, box_size: int, border: int = 4) -> int:
+    # The highest error level needs the largest symbol for a given payload;
+    # logos are pasted at a quarter of the image width.
+    try:
+        version = plan_segments(text, ERROR_CORRECT_H).version
+    except DataOverflowError:
+        # Too long for the highest level: the biggest symbol bounds it.
+        version = 40
+    width = version * 4 + 17
+    return (width + border * 2) * box_size // 4
+
+
+# Largest logo, in decoded pixels, accepted after any JPEG draft scaling: a
+# small, highly compressible PNG could otherwise decode to gigabytes.
+MAX_LOGO_PIXELS = 4096 * 4096
+
+
+def ingest_logo(data: bytes, max_size: int) -> Logo:
+    """Normalize an uploaded image into a :class:`Logo` of at most ``max_size`` pixels a side.
+
+    Raises ``PIL.UnidentifiedImageError`` for data PIL cannot read and
+    ``PIL.Image.DecompressionBombError`` past ``MAX_LOGO_PIXELS``.
+    """
+    img = Image.open(io.BytesIO(data))
+    # For JPEGs, let libjpeg decode straight at a reduced DCT scale.
+    img.draft("RGB", (max_size, max_size))
+    if img.width * img.height > MAX_LOGO_PIXELS:
+        raise Image.DecompressionBombError(f"logo of {img.width}x{img.height} pixels exceeds {MAX_LOGO_PIXELS}")
+    if img.mode not in ("L", "LA", "RGB", "RGBA"):
+        # Palette and other modes only resample with nearest neighbour.
+        img = img.convert("RGBA")
+    # Scale down in the decoded mode, so full-size RGBA is never built.
+    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    img = img.convert("RGBa")
+    pixels = img.tobytes()
+    return Logo(img.width, img.height, pixels, hashlib.sha256(pixels).hexdigest())
+
+
+LOGO_SHAPE_KEYS = ("square", "circle", "rounded")
+
+# Shapes are drawn oversized and downsampled for antialiased edges.
+ANTIALIASING_FACTOR = 4
+ROUNDED_RADIUS_RATIO = 0.2
+
+
+@lru_cache(maxsize=128)
+def shape_mask(shape: str, size: int) -> Optional[Image.Image]:
+    """Antialiased alpha mask for a logo shape, or None for a plain square."""
+    if shape not in ("circle", "rounded"):
+        return None
+    fake_size = size * ANTIALIASING_FACTOR
+    mask = Image.new("L", (fake_size, fake_size), 0)
+    draw = ImageDraw.Draw(mask)
+    if shape == "circle":
+        draw.ellipse((0, 0, fake_size - 1, fake_size - 1), fill=255)
+    else:
+        draw.rounded_rectangle((0, 0, fake_size - 1, fake_size - 1), radius=int(fake_size * ROUNDED_RADIUS_RATIO), fill=255)
+    return mask.resize((size, size), Image.Resampling.LANCZOS)
+
+
+_variants: "OrderedDict[Tuple[str, int, Optional[str]], Image.Image]" = OrderedDict()
+MAX_VARIANTS = 64
+
+
+def logo_variant(logo: Logo, size: int, shape: Optional[str] = None) -> Image.Image:
+    """The logo resized to ``size`` x ``size``, cut to ``shape`` and ready to
+    paste, cached per process."""
+    key = (logo.digest, size, shape)
+    variant = _variants.get(key)
+    if variant is not None:
+        _variants.move_to_end(key)
+        return variant
+
+    variant = logo.image().resize((size, size), Image.Resampling.LANCZOS).convert("RGBA")
+    mask = shape_mask(shape, size) if shape else None
+    if mask is not None:
+        variant.putalpha(ImageChops.multiply(variant.getchannel("A"), mask))
+    _variants[key] = variant
+    while len(_variants) > MAX_VARIANTS:
+        _variants.popitem(last=False)
+    return variant
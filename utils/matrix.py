@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import qrcode
+from qrcode import util
+
+from .metrics import StageTimer
+from .segments import plan_segments
+from .symbol import best_mask, finish_symbol, place_data, symbol_layout
+
+
+class QRMatrix(NamedTuple):
+    """Final module matrix of an encoded symbol, bit-packed row by row.
+
+    Each row occupies ``(width + 7) // 8`` bytes, most significant bit first,
+    so a version 40 symbol takes about 4 KB instead of 31k Python bools.
+    ``default_version`` is the version qrcode's own segmentation would have
+    needed (41 if it does not fit), or 0 when not known.
+    """
+
+    version: int
+    width: int
+    bits: bytes
+    default_version: int = 0
+
+    @property
+    def stride(self) -> int:
+        return (self.width + 7) // 8
+
+
+def pack_modules(version: int, modules: List[List[bool]]) -> QRMatrix:
+    width = len(modules)
+    packed = bytearray()
+    for row in modules:
+        for start in range(0, width, 8):
+            byte = 0
+            for i, dark in enumerate(row[start:start + 8]):
+                if dark:
+                    byte |= 0x80 >> i
+            packed.append(byte)
+    return QRMatrix(version, width, bytes(packed))
+
+
+def encode_matrix(text: str, error_correction: int, timer: Optional[StageTimer] = None) -> QRMatrix:
+    """Encode ``text`` at the smallest version that fits.
+
+    The payload is split into mode segments by :func:`plan_segments`, which
+    often needs a smaller version than qrcode's own chunking. For those
+    segments this produces the same symbol as ``qrcode.QRCode.make(fit=True)``,
+    but the data is placed once and the eight masks are applied and scored with
+    NumPy (see :mod:`utils.symbol`) instead of running ``makeImpl`` and
+    ``lost_point`` in pure Python for every mask.
+
+    With a ``timer``, segmentation is lapped as ``segment``, error
+    correction and final placement as ``encode`` and the search over the
+    eight masks as ``mask``.
+    """
+    timer = timer or StageTimer()
+    qr = qrcode.QRCode(version=None, error_correction=error_correction, border=0)
+    plan = plan_segments(text, error_correction)
+    qr.data_list = plan.segments
+    qr.version = plan.version
+    timer.lap("segment")
+    layout = symbol_layout(qr.version)
+    data = place_data(layout, util.create_data(qr.version, qr.error_correction, qr.data_list))
+    timer.lap("encode")
+    mask = best_mask(layout, data)
+    timer.lap("mask")
+    modules = finish_symbol(qr, layout, data, mask)
+    matrix = QRMatrix(qr.version, layout.width, np.packbits(modules, axis=1).tobytes(), plan.default_version)
+    timer.lap("encode")
+    return matrix
+
+
+class MatrixCache:
+    """LRU cache of :class:`QRMatrix` keyed by ``(text, error)``.
+
+    Size and style only affect rasterization, so every settings change that
+    keeps the payload and error level reuses the encoded symbol.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], QRMatrix]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, text: str, error: str) -> Optional[QRMatrix]:
+        matrix = self._entries.get((text, error))
+        if matrix is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((text, error))
+        self.hits += 1
+        return matrix
+
+    def put(self, text: str, error: str, matrix: QRMatrix):
+        self._entries[(text, error)] = matrix
+        self._entries.move_to_end((text, error))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
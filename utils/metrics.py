@@ -0,0 +1,186 @@
+import bisect
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .httpserver import HttpRequest, HttpResponse, HttpServer
+from .logger import LOGGER
+
+# Upper bounds in seconds, from sub-millisecond stages up to slow uploads.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Sample = Union[float, Dict[str, float]]
+
+
+class StageTimer:
+    """Adds the wall time since the previous lap to ``timings[stage]``.
+
+    With ``timings=None`` laps are not recorded, so the render path can be
+    instrumented unconditionally.
+    """
+
+    __slots__ = ("timings", "last")
+
+    def __init__(self, timings: Optional[Dict[str, float]] = None):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+        self.last = now
+
+
+def _labels(label: Optional[str], value: Optional[str], extra: str = "") -> str:
+    pairs = []
+    if label is not None:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{label}="{escaped}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative latency histogram, optionally split by one label."""
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        # label value -> (per-bucket counts with a final +Inf slot, sum)
+        self._series: Dict[Optional[str], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, seconds: float, label_value: Optional[str] = None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        total[0] += seconds
+
+    def totals(self) -> Dict[Optional[str], Tuple[int, float]]:
+        """``(count, sum)`` of observations per label value."""
+        return {value: (sum(counts), total[0]) for value, (counts, total) in self._series.items()}
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total) in sorted(self._series.items(), key=lambda item: str(item[0])):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label, value, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {_number(total[0])}")
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic count, optionally split by one label."""
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: Dict[Optional[str], float] = {}
+
+    def inc(self, label_value: Optional[str] = None, amount: float = 1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, count in sorted(self._values.items(), key=lambda item: str(item[0])):
+            lines.append(f"{self.name}{_labels(self.label, value)} {_number(count)}")
+        return lines
+
+
+class Collected:
+    """A gauge or counter read from ``collect()`` at scrape time.
+
+    ``collect`` returns a number, or a dict of numbers keyed by the value of
+    ``label``. This is how the existing ``stats()`` of caches, queues and
+    session stores are exported without touching their hot paths.
+    """
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Sample], kind: str = "gauge", label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.kind = kind
+        self.label = label
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        sample = self.collect()
+        if isinstance(sample, dict):
+            for value, number in sample.items():
+                lines.append(f"{self.name}{_labels(self.label, value)} {_number(number)}")
+        else:
+            lines.append(f"{self.name} {_number(sample)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics of one process, exposed in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Union[Histogram, Counter, Collected]] = {}
+
+    def _add(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, label: Optional[str] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, label, buckets))
+
+    def counter(self, name: str, help: str, label: Optional[str] = None) -> Counter:
+        return self._add(Counter(name, help, label))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Sample], label: Optional[str] = None) -> Collected:
+        return self._add(Collected(name, help, collect, "gauge", label))
+
+    def collected_counter(self, name: str, help: str, collect: Callable[[], Sample], label: Optional[str] = None) -> Collected:
+        return self._add(Collected(name, help, collect, "counter", label))
+
+    def expose(self) -> bytes:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.expose())
+            except Exception as e:
+                LOGGER.warning(f"Metric {metric.name} failed: {e}")
+        return ("\n".join(lines) + "\n").encode()
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_response(registry: MetricsRegistry) -> HttpResponse:
+    return HttpResponse(200, registry.expose(), PROMETHEUS_CONTENT_TYPE)
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str, port: int) -> HttpServer:
+    """Serve ``GET /metrics`` for a Prometheus scraper on ``host:port``."""
+
+    async def handle(request: HttpRequest) -> HttpResponse:
+        if request.path != "/metrics":
+            return HttpResponse.error(404)
+        if request.method != "GET":
+            return HttpResponse.error(405)
+        return metrics_response(registry)
+
+    server = HttpServer(handle, max_body=0)
+    await server.start(host, port)
+    LOGGER.info(f"Metrics server listening on {host}:{port}")
+    return server
@@ -0,0 +1,238 @@
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .fills import CHUNK_ROWS, fill_palette, gradient_bands, gradient_colors, image_bands
+from .matrix import QRMatrix
+
+BACK_COLOR = (255, 255, 255)
+
+# Tiles are drawn oversized and shrunk with LANCZOS exactly like qrcode's
+# styled module drawers, so stamped modules are pixel-identical to theirs.
+ANTIALIASING_FACTOR = 4
+
+# Styles with a ``fill`` keep at most this many ink levels (background
+# included), so each level can be combined with many fill colours in one
+# palette; posterized edges are not visible at this depth.
+FILL_LEVELS = 8
+# Palette entries a fill may use; the rest stay free for logo and label
+# colours in palette output.
+FILL_PALETTE_SIZE = 192
+
+# Index of the all-background tile in every tile set.
+_BLANK = 0
+# Index of the plain square tile, also used for the finder patterns ("eyes"),
+# which StyledPilImage always draws with the square drawer.
+_SQUARE = 1
+
+
+def _ink(img: Image.Image) -> np.ndarray:
+    # Tiles are painted black on white; ink is the coverage, 0..255.
+    return 255 - np.asarray(img, dtype=np.uint8)
+
+
+def _circle_tile(box_size: int) -> np.ndarray:
+    fake_size = box_size * ANTIALIASING_FACTOR
+    circle = Image.new("L", (fake_size, fake_size), 255)
+    ImageDraw.Draw(circle).ellipse((0, 0, fake_size, fake_size), fill=0)
+    return _ink(circle.resize((box_size, box_size), Image.Resampling.LANCZOS))
+
+
+def _rounded_tiles(box_size: int) -> np.ndarray:
+    corner_width = box_size // 2
+    fake_width = corner_width * ANTIALIASING_FACTOR
+    base = Image.new("L", (fake_width, fake_width), 255)
+    draw = ImageDraw.Draw(base)
+    draw.ellipse((0, 0, fake_width * 2, fake_width * 2), fill=0)
+    draw.rectangle((fake_width, 0, fake_width, fake_width), fill=0)
+    draw.rectangle((0, fake_width, fake_width, fake_width), fill=0)
+    nw = _ink(base.resize((corner_width, corner_width), Image.Resampling.LANCZOS))
+    corners = {
+        "nw": nw,
+        "ne": nw[:, ::-1],
+        "se": nw[::-1, ::-1],
+        "sw": nw[::-1, :],
+    }
+    square = np.full((corner_width, corner_width), 255, dtype=np.uint8)
+    cw = corner_width
+    slots = {
+        "nw": (slice(0, cw), slice(0, cw)),
+        "ne": (slice(0, cw), slice(cw, 2 * cw)),
+        "se": (slice(cw, 2 * cw), slice(cw, 2 * cw)),
+        "sw": (slice(cw, 2 * cw), slice(0, cw)),
+    }
+
+    # Tile 2 + n is a module whose corners flagged in the 4-bit mask n
+    # (nw=1, ne=2, se=4, sw=8) are rounded. Like RoundedModuleDrawer, odd box
+    # sizes leave the last pixel row and column of each module unpainted.
+    tiles = np.zeros((18, box_size, box_size), dtype=np.uint8)
+    tiles[_SQUARE] = 255
+    for n in range(16):
+        for bit, corner in enumerate(("nw", "ne", "se", "sw")):
+            tiles[2 + n][slots[corner]] = corners[corner] if n & (1 << bit) else square
+    return tiles
+
+
+@lru_cache(maxsize=None)
+def module_tiles(module: str, box_size: int) -> np.ndarray:
+    """Pre-rendered ink tiles for one module kind and box size."""
+    if module == "square":
+        tiles = np.zeros((2, box_size, box_size), dtype=np.uint8)
+        tiles[_SQUARE] = 255
+    elif module == "circle":
+        tiles = np.zeros((3, box_size, box_size), dtype=np.uint8)
+        tiles[_SQUARE] = 255
+        tiles[2] = _circle_tile(box_size)
+    elif module == "rounded":
+        tiles = _rounded_tiles(box_size)
+    else:
+        raise ValueError(f"Unknown module kind: {module}")
+    tiles.setflags(write=False)
+    return tiles
+
+
+@lru_cache(maxsize=None)
+def compact_tiles(module: str, box_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Tiles renumbered to the ink levels they actually use, and those levels.
+
+    Square modules only use 0 and 255, so the canvas becomes a two-entry
+    palette image that PNG stores at one bit per pixel.
+    """
+    tiles = module_tiles(module, box_size)
+    levels = np.union1d(np.unique(tiles), [0])
+    remap = np.zeros(256, dtype=np.uint8)
+    remap[levels] = np.arange(len(levels))
+    compact = remap[tiles]
+    compact.setflags(write=False)
+    levels.setflags(write=False)
+    return compact, levels
+
+
+@lru_cache(maxsize=None)
+def color_lut(color: Tuple[int, int, int], back_color: Tuple[int, int, int] = BACK_COLOR) -> np.ndarray:
+    """Map ink coverage to RGB the way qrcode's SolidFillColorMask does."""
+    ink = np.arange(256)
+    if color == (0, 0, 0) and back_color == BACK_COLOR:
+        lut = np.repeat((255 - ink)[:, None], 3, axis=1)
+    else:
+        norm = (255 - ink - 255) / (0 - 255)
+        # qrcode averages the per-channel estimates; keep its float rounding.
+        norm = (norm + norm + norm) / 3
+        lut = np.stack([(c * norm + b * (1 - norm)).astype(np.int64) for c, b in zip(color, back_color)], axis=1)
+    lut = lut.astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
+@lru_cache(maxsize=None)
+def fill_tiles(module: str, box_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Like :func:`compact_tiles`, with coverage rounded to ``FILL_LEVELS`` steps."""
+    tiles, levels = compact_tiles(module, box_size)
+    steps = np.rint(levels * (FILL_LEVELS - 1) / 255).astype(np.intp)
+    used = np.unique(steps)
+    remap = np.searchsorted(used, steps).astype(np.uint8)
+    reduced = remap[tiles]
+    coverage = (used * 255 // (FILL_LEVELS - 1)).astype(np.uint8)
+    reduced.setflags(write=False)
+    coverage.setflags(write=False)
+    return reduced, coverage
+
+
+def unpack_matrix(matrix: QRMatrix) -> np.ndarray:
+    packed = np.frombuffer(matrix.bits, dtype=np.uint8).reshape(matrix.width, matrix.stride)
+    return np.unpackbits(packed, axis=1, count=matrix.width).astype(bool)
+
+
+def eye_mask(width: int) -> np.ndarray:
+    eyes = np.zeros((width, width), dtype=bool)
+    eyes[:7, :7] = True
+    eyes[:7, width - 7:] = True
+    eyes[width - 7:, :7] = True
+    return eyes
+
+
+def tile_indices(dark: np.ndarray, module: str) -> np.ndarray:
+    if module == "square":
+        idx = np.full(dark.shape, _SQUARE, dtype=np.intp)
+    elif module == "circle":
+        idx = np.full(dark.shape, 2, dtype=np.intp)
+    else:
+        padded = np.pad(dark, 1)
+        n = padded[:-2, 1:-1]
+        s = padded[2:, 1:-1]
+        w = padded[1:-1, :-2]
+        e = padded[1:-1, 2:]
+        idx = 2 + ((~w & ~n) * 1 | (~n & ~e) * 2 | (~e & ~s) * 4 | (~s & ~w) * 8).astype(np.intp)
+    idx[eye_mask(dark.shape[0])] = _SQUARE
+    idx[~dark] = _BLANK
+    return idx
+
+
+def rasterize_ink(matrix: QRMatrix, box_size: int, module: str, border: int = 4, tiles: Optional[np.ndarray] = None) -> np.ndarray:
+    """Stamp one tile per module into a single uint8 coverage canvas."""
+    dark = unpack_matrix(matrix)
+    if tiles is None:
+        tiles = module_tiles(module, box_size)
+    width = matrix.width
+    size = (width + border * 2) * box_size
+    offset = border * box_size
+
+    canvas = np.zeros((size, size), dtype=np.uint8)
+    stamped = tiles[tile_indices(dark, module)]
+    canvas[offset:offset + width * box_size, offset:offset + width * box_size] = (
+        stamped.transpose(0, 2, 1, 3).reshape(width * box_size, width * box_size)
+    )
+    return canvas
+
+
+def rasterize_fill(matrix: QRMatrix, box_size: int, style: Dict, border: int = 4) -> Image.Image:
+    """Render a style with a gradient or image ``fill`` as a ``P`` image.
+
+    Every pixel's palette index combines its ink level with the band of the
+    fill it falls in, ``band * (levels - 1) + level``, so the colour mask is
+    a few whole-array operations and PIL expands the palette in C.
+    """
+    fill = style["fill"]
+    tiles, coverage = fill_tiles(style["module"], box_size)
+    steps = len(coverage) - 1
+    count = (FILL_PALETTE_SIZE - 1) // steps
+    canvas = rasterize_ink(matrix, box_size, style["module"], border, tiles)
+    size = canvas.shape[0]
+    offset = border * box_size
+    extent = matrix.width * box_size
+
+    if fill["kind"] == "image":
+        bands, colors = image_bands(fill, size, offset, extent, count)
+        np.copyto(canvas, bands * np.uint8(steps) + canvas, where=canvas > 0)
+    else:
+        colors = gradient_colors(fill, count)
+        for top in range(0, size, CHUNK_ROWS):
+            block = canvas[top:top + CHUNK_ROWS]
+            bands = gradient_bands(fill, size, offset, extent, count, top, top + block.shape[0])
+            np.copyto(block, bands * np.uint8(steps) + block, where=block > 0)
+
+    img = Image.frombuffer("P", (size, size), canvas, "raw", "P", 0, 1)
+    img.putpalette(fill_palette(colors, coverage[1:], BACK_COLOR).tobytes())
+    return img
+
+
+def rasterize(matrix: QRMatrix, box_size: int, style: Dict, border: int = 4, palette: bool = False) -> Image.Image:
+    """Render the symbol as RGB, or with ``palette`` as a ``P`` image holding
+    only the colours the module shapes produce."""
+    if style.get("fill"):
+        img = rasterize_fill(matrix, box_size, style, border)
+        return img if palette else img.convert("RGB")
+    if palette:
+        tiles, levels = compact_tiles(style["module"], box_size)
+        ink = rasterize_ink(matrix, box_size, style["module"], border, tiles)
+        lut = color_lut(style["color"])[levels]
+    else:
+        ink = rasterize_ink(matrix, box_size, style["module"], border)
+        lut = color_lut(style["color"])
+    # Colour through a palette: PIL expands P -> RGB in C, far faster than
+    # indexing the LUT with NumPy.
+    img = Image.frombuffer("P", (ink.shape[1], ink.shape[0]), ink, "raw", "P", 0, 1)
+    img.putpalette(lut.tobytes())
+    return img if palette else img.convert("RGB")
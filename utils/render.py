@@ -0,0 +1,530 @@
+import asyncio
+import cProfile
+import hashlib
+import io
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from qrcode import ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q, ERROR_CORRECT_H
+
+from .cache import RenderCache
+from .logger import LOGGER
+from .labels import draw_label, render_label
+from .logos import LOGO_SHAPE_KEYS, Logo, logo_variant
+from .matrix import MatrixCache, QRMatrix, encode_matrix
+from .segments import fits_in_symbol
+from .metrics import MetricsRegistry, StageTimer
+from .raster import rasterize
+from .vector import render_pdf, render_svg
+from .sessions import Session
+
+SIZES = {"small": 10, "medium": 15, "large": 20, "xlarge": 25}
+ERROR_LEVELS = {"low": ERROR_CORRECT_L, "medium": ERROR_CORRECT_M, "high": ERROR_CORRECT_Q, "max": ERROR_CORRECT_H}
+# ``color`` is the module colour; a ``fill`` replaces it with a gradient
+# ("linear" with an ``angle``, or "radial") through ``colors``, or with an
+# image from ``assets/`` ("image" with a ``path``). See utils/fills.py.
+STYLES = {
+    "classic": {"module": "square", "color": (0, 0, 0)},
+    "blue": {"module": "square", "color": (0, 0, 255)},
+    "gradient": {
+        "module": "rounded",
+        "color": (100, 0, 200),
+        "fill": {"kind": "linear", "angle": 45, "colors": ((100, 0, 200), (0, 90, 200))},
+    },
+    "dark": {"module": "square", "color": (30, 30, 30)},
+    "green": {"module": "circle", "color": (0, 128, 0)},
+    "sunset": {
+        "module": "circle",
+        "color": (170, 20, 60),
+        "fill": {"kind": "radial", "colors": ((120, 0, 110), (170, 20, 60), (200, 70, 0))},
+    },
+    "aurora": {
+        "module": "square",
+        "color": (40, 40, 130),
+        "fill": {"kind": "image", "path": "fills/aurora.png"},
+    },
+}
+
+# "palette" keeps only the colours the modules use (one bit per pixel for
+# square styles), falling back to the regular PNG when that is smaller;
+# "svg" and "pdf" are drawn from the matrix as vectors.
+OUTPUT_FORMATS = {
+    "png": {"mime": "image/png", "ext": "png"},
+    "palette": {"mime": "image/png", "ext": "png"},
+    "svg": {"mime": "image/svg+xml", "ext": "svg"},
+    "pdf": {"mime": "application/pdf", "ext": "pdf"},
+}
+
+# zlib levels for PNG output, set per worker by RenderPool.
+PNG_COMPRESS_LEVEL = 6
+PALETTE_COMPRESS_LEVEL = 6
+
+# Profiling of slow renders, set per worker by RenderPool: this fraction of
+# renders runs under cProfile, and those slower than PROFILE_SLOW_SECONDS
+# are dumped to PROFILE_DIR.
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_SLOW_SECONDS = 0.5
+PROFILE_DIR: Optional[str] = None
+
+# Palette entries for palette renders with a label but no logo.
+LABEL_PALETTE_SIZE = 16
+
+MAX_TEXT_LENGTH = 2953
+MAX_LABEL_LENGTH = 100
+
+# Bumped whenever rasterization changes, so cached PNGs from an older
+# renderer are never served.
+RENDER_VERSION = "6"
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+class RenderCrashed(Exception):
+    pass
+
+
+class RenderJob(NamedTuple):
+    """Everything a worker process needs to render one QR code.
+
+    Only plain values travel to the pool: the logo is the normalized
+    :class:`Logo` built at upload time, never a PIL image. ``matrix``
+    carries an already encoded symbol so the worker can skip straight to
+    rasterization; it is not part of the cache key.
+    """
+
+    text: str
+    size: str = "medium"
+    error: str = "medium"
+    style: str = "classic"
+    logo: Optional[Logo] = None
+    logo_shape: Optional[str] = None
+    label: Optional[str] = None
+    output: str = "png"
+    matrix: Optional[QRMatrix] = None
+
+    @classmethod
+    def from_session(cls, session: Session) -> "RenderJob":
+        return cls(
+            text=session.text,
+            size=session.size,
+            error=session.error,
+            style=session.style,
+            logo=session.logo_image if session.has_logo else None,
+            logo_shape=session.logo_shape,
+            label=session.label,
+            output=session.output,
+        )
+
+    @classmethod
+    def from_params(cls, params: Dict[str, str], logo: Optional[Logo] = None) -> "RenderJob":
+        """Build a job from string parameters named like the settings keyboard.
+
+        Raises ``ValueError`` with a user-facing message on invalid input.
+        """
+        text = params.get("text", "")
+        if not text:
+            raise ValueError("text is required")
+        job = cls(
+            text=text,
+            size=params.get("size") or "medium",
+            error=params.get("error") or "medium",
+            style=params.get("style") or "classic",
+            logo=logo,
+            logo_shape=(params.get("logo_shape") or "square") if logo else None,
+            label=params.get("label") or None,
+            output=params.get("format") or "png",
+        )
+        for name, allowed in (("size", SIZES), ("error", ERROR_LEVELS), ("style", STYLES), ("output", OUTPUT_FORMATS)):
+            if getattr(job, name) not in allowed:
+                param = "format" if name == "output" else name
+                raise ValueError(f"{param} must be one of: {', '.join(allowed)}")
+        # Capacity depends on the content and the error level, not just length.
+        if not fits_in_symbol(text, ERROR_LEVELS[job.error]):
+            raise ValueError(f"text does not fit in a QR code at error level {job.error}")
+        if logo and job.logo_shape not in LOGO_SHAPE_KEYS:
+            raise ValueError(f"logo_shape must be one of: {', '.join(LOGO_SHAPE_KEYS)}")
+        if job.label and len(job.label) > MAX_LABEL_LENGTH:
+            raise ValueError(f"label is longer than {MAX_LABEL_LENGTH} characters")
+        return job
+
+    def cache_key(self) -> str:
+        # Content address of the output: identical settings and an identical
+        # logo file always produce the same output.
+        logo_digest = self.logo.digest if self.logo else ""
+        fields = (RENDER_VERSION, self.text, self.error, self.size, self.style, logo_digest, self.logo_shape or "", self.label or "", self.output)
+        return hashlib.sha256("\x00".join(fields).encode()).hexdigest()
+
+
+def render_qr(job: RenderJob) -> bytes:
+    return render_job(job)[0]
+
+
+def render_job(job: RenderJob, timings: Optional[Dict[str, float]] = None) -> Tuple[bytes, QRMatrix]:
+    """Render ``job``, returning the output and the encoded matrix.
+
+    When ``timings`` is given, seconds spent in each stage (``segment``, ``encode``,
+    ``mask``, ``rasterize``, ``logo``, ``label``, ``save``; ``compose`` for palette
+    overlays and ``vector`` for SVG and PDF) are added to it.
+    """
+    timer = StageTimer(timings)
+    matrix = job.matrix or encode_matrix(job.text, ERROR_LEVELS[job.error], timer)
+    box_size = SIZES[job.size]
+    style = STYLES[job.style]
+
+    if job.output in ("svg", "pdf"):
+        size = (matrix.width + 8) * box_size
+        logo = label = None
+        if job.logo:
+            logo = logo_variant(job.logo, size // 4, job.logo_shape)
+            timer.lap("logo")
+        if job.output == "svg":
+            data = render_svg(matrix, box_size, style, logo=logo, label=job.label)
+        else:
+            if job.label:
+                label = render_label(job.label, size)
+                timer.lap("label")
+            data = render_pdf(matrix, box_size, style, logo=logo, label=label)
+        timer.lap("vector")
+        return data, matrix
+
+    palette = job.output == "palette"
+    data = _render_png(job, matrix, box_size, style, palette, timer)
+    if palette and (job.logo or style.get("fill")):
+        # PIL writes palette PNGs unfiltered, so photographic logos and fills
+        # can compress worse than the regular PNG; keep whichever is smaller.
+        regular = _render_png(job, matrix, box_size, style, False, timer)
+        if len(regular) < len(data):
+            data = regular
+    return data, matrix
+
+
+def _render_png(job: RenderJob, matrix: QRMatrix, box_size: int, style: Dict, palette: bool, timer: StageTimer) -> bytes:
+    img = rasterize(matrix, box_size, style, palette=palette)
+    timer.lap("rasterize")
+    if img.mode == "P":
+        if job.logo or job.label:
+            img = _compose_palette(img, job)
+            timer.lap("compose")
+    else:
+        if job.logo:
+            logo = logo_variant(job.logo, img.size[0] // 4, job.logo_shape)
+            pos = ((img.size[0] - logo.size[0]) // 2, (img.size[1] - logo.size[1]) // 2)
+            img.paste(logo, pos, logo)
+            timer.lap("logo")
+
+        if job.label:
+            img = draw_label(img, job.label)
+            timer.lap("label")
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=PALETTE_COMPRESS_LEVEL if img.mode == "P" else PNG_COMPRESS_LEVEL)
+    timer.lap("save")
+    return buf.getvalue()
+
+
+def _compose_palette(img: Image.Image, job: RenderJob) -> Image.Image:
+    """Add the logo and label to a palette render without leaving palette mode.
+
+    Only the logo area and the label strip carry new colours: they are
+    composited in RGB, quantized together into the palette slots the modules
+    left free and pasted back as indices, so the symbol itself stays exact
+    and the full image is never converted.
+    """
+    palette = img.getpalette()
+    levels = len(palette) // 3
+    size = img.size[0]
+    patches = []
+
+    if job.logo:
+        logo = logo_variant(job.logo, size // 4, job.logo_shape)
+        pos = ((size - logo.size[0]) // 2, (size - logo.size[1]) // 2)
+        region = img.crop((pos[0], pos[1], pos[0] + logo.size[0], pos[1] + logo.size[1])).convert("RGB")
+        region.paste(logo, (0, 0), logo)
+        patches.append((pos, region))
+
+    if job.label:
+        strip = render_label(job.label, size)
+        labelled = Image.new("P", (size, img.size[1] + strip.size[1]))
+        labelled.paste(img, (0, 0))
+        patches.append(((0, img.size[1]), strip))
+        img = labelled
+
+    sheet = Image.new("RGB", (max(p.size[0] for _, p in patches), sum(p.size[1] for _, p in patches)))
+    y = 0
+    for _, patch in patches:
+        sheet.paste(patch, (0, y))
+        y += patch.size[1]
+    # A label alone is one colour antialiased on white, which a handful of
+    # shades reproduce; keeping the palette at 16 entries lets the whole
+    # image be written at 4 bits per pixel instead of 8.
+    colors = (LABEL_PALETTE_SIZE if not job.logo and levels <= LABEL_PALETTE_SIZE // 2 else 256) - levels
+    quantized = sheet.quantize(colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    indices = np.asarray(quantized) + np.uint8(levels)
+
+    y = 0
+    for pos, patch in patches:
+        block = np.ascontiguousarray(indices[y:y + patch.size[1], :patch.size[0]])
+        img.paste(Image.frombuffer("P", patch.size, block, "raw", "P", 0, 1), pos)
+        y += patch.size[1]
+    img.putpalette(palette + quantized.getpalette()[:colors * 3])
+    return img
+
+
+def render_timed(job: RenderJob) -> Tuple[bytes, QRMatrix, Dict[str, float]]:
+    """Render ``job`` recording its stage timings, under cProfile for a sample of jobs."""
+    timings: Dict[str, float] = {}
+    if PROFILE_DIR is None or random.random() >= PROFILE_SAMPLE_RATE:
+        data, matrix = render_job(job, timings)
+        return data, matrix, timings
+
+    profile = cProfile.Profile()
+    data, matrix = profile.runcall(render_job, job, timings)
+    if sum(timings.values()) >= PROFILE_SLOW_SECONDS:
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{job.cache_key()[:12]}.prof"
+        profile.dump_stats(os.path.join(PROFILE_DIR, name))
+    return data, matrix, timings
+
+
+def render_batch(jobs: List[RenderJob]) -> List[Tuple[bytes, QRMatrix, Dict[str, float]]]:
+    return [render_timed(job) for job in jobs]
+
+
+def _init_worker(
+    png_compress_level: int = PNG_COMPRESS_LEVEL,
+    palette_compress_level: int = PALETTE_COMPRESS_LEVEL,
+    profile_sample_rate: float = 0.0,
+    profile_slow_seconds: float = PROFILE_SLOW_SECONDS,
+    profile_dir: Optional[str] = None,
+):
+    global PNG_COMPRESS_LEVEL, PALETTE_COMPRESS_LEVEL, PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, PROFILE_DIR
+    PNG_COMPRESS_LEVEL = png_compress_level
+    PALETTE_COMPRESS_LEVEL = palette_compress_level
+    PROFILE_SAMPLE_RATE = profile_sample_rate
+    PROFILE_SLOW_SECONDS = profile_slow_seconds
+    PROFILE_DIR = profile_dir if profile_sample_rate > 0 else None
+    _warm_worker()
+
+
+def _warm_worker():
+    # Pay for the lazy imports, PIL plugin registration and qrcode's blank
+    # matrix tables once per process instead of on the first user request.
+    render_qr(RenderJob("warmup", label="warmup"))
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class RenderPool:
+    """Runs :func:`render_qr` on a process pool so the event loop never blocks.
+
+    ``queue_size`` bounds the number of jobs admitted at once (running plus
+    waiting); once it is reached :meth:`render` raises ``RenderQueueFull``
+    instead of letting the backlog grow. A job that exceeds ``timeout`` raises
+    ``RenderTimeout``; its worker finishes the render in the background and
+    is then reused. When a worker dies (an OOM kill, say) the pool is broken
+    for every job on it: the pool is rebuilt and each affected job retried
+    once, and a job that breaks the new pool as well raises ``RenderCrashed``.
+
+    With a ``cache`` attached, finished PNGs are looked up by content before
+    any work is queued, and concurrent requests for the same output share a
+    single render. Encoded matrices are kept in ``matrix_cache`` and sent
+    along with later jobs for the same text and error level, whichever worker
+    picks them up.
+
+    With a ``metrics`` registry, the stage timings workers send back with
+    every result feed the ``qr_stage_seconds`` histogram, and queue depth and
+    cache counters are exported with it. A ``profile_sample_rate`` above zero
+    makes workers profile that fraction of renders and keep the profiles of
+    those slower than ``profile_slow_seconds`` in ``profile_dir``.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: int = 64,
+        timeout: float = 30.0,
+        cache: Optional[RenderCache] = None,
+        matrix_cache: Optional[MatrixCache] = None,
+        png_compress_level: int = PNG_COMPRESS_LEVEL,
+        palette_compress_level: int = PALETTE_COMPRESS_LEVEL,
+        metrics: Optional[MetricsRegistry] = None,
+        profile_sample_rate: float = 0.0,
+        profile_slow_seconds: float = PROFILE_SLOW_SECONDS,
+        profile_dir: Optional[str] = "profiles",
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.worker_settings = (png_compress_level, palette_compress_level, profile_sample_rate, profile_slow_seconds, profile_dir)
+        self.queue_size = max(queue_size, self.workers)
+        self.timeout = timeout
+        self.cache = cache
+        self.matrix_cache = matrix_cache if matrix_cache is not None else MatrixCache()
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stage_seconds = None
+        self.encodes = None
+        if metrics is not None:
+            self._register_metrics(metrics)
+
+    def _register_metrics(self, metrics: MetricsRegistry):
+        self.stage_seconds = metrics.histogram("qr_stage_seconds", "Time spent in each stage of producing a QR code.", "stage")
+        self.encodes = metrics.counter(
+            "qr_encodes_total", "Symbols encoded, by how many versions smaller than qrcode's default segmentation.", "versions_saved",
+        )
+        metrics.gauge("qr_render_pending", "Render tasks running or queued on the pool.", lambda: self.pending)
+        metrics.gauge("qr_render_workers", "Render worker processes.", lambda: self.workers)
+        metrics.collected_counter(
+            "qr_matrix_cache_lookups_total", "Encoded matrix cache lookups.",
+            lambda: {"hit": self.matrix_cache.hits, "miss": self.matrix_cache.misses}, "result",
+        )
+        if self.cache is not None:
+            metrics.collected_counter(
+                "qr_render_cache_lookups_total", "Rendered output cache lookups.",
+                lambda: {"hit": self.cache.hits, "disk_hit": self.cache.disk_hits, "miss": self.cache.misses}, "result",
+            )
+            metrics.gauge("qr_render_cache_bytes", "Bytes of rendered output cached in memory.", lambda: self.cache.bytes)
+
+    async def start(self):
+        if self._executor is not None:
+            return
+        profile_dir = self.worker_settings[4]
+        if self.worker_settings[2] > 0 and profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=self.worker_settings)
+        loop = asyncio.get_running_loop()
+        # Touch every worker so they are forked and warmed before traffic arrives.
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)))
+
+    def is_rendering(self, key: str) -> bool:
+        """Whether the output for cache ``key`` is being rendered right now."""
+        return key in self._inflight
+
+    async def render(self, job: RenderJob) -> bytes:
+        if self.cache is None:
+            return await self._render(job)
+
+        key = job.cache_key()
+        png = await self.cache.get(key)
+        if png is not None:
+            return png
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            png = await self._render(job)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when no one else was waiting.
+            future.exception()
+            raise
+        else:
+            self.cache.put(key, png)
+            future.set_result(png)
+            return png
+        finally:
+            del self._inflight[key]
+
+    async def render_many(self, jobs: Sequence[RenderJob], chunk_size: int = 8, store: bool = True) -> List[bytes]:
+        """Render several jobs, shipping cache misses to the workers in chunks.
+
+        Each chunk is one task on the pool (one pickling round trip and one
+        queue slot); at most ``workers`` chunks of a call run at once. With
+        ``store=False`` the caches are read but not filled, for one-off bulk
+        work that would otherwise evict interactive entries.
+        """
+        results: List[Optional[bytes]] = [None] * len(jobs)
+        misses = []
+        for i, job in enumerate(jobs):
+            png = await self.cache.get(job.cache_key()) if self.cache is not None else None
+            if png is None:
+                misses.append(i)
+            else:
+                results[i] = png
+
+        limit = asyncio.Semaphore(self.workers)
+
+        async def run_chunk(indices: List[int]):
+            async with limit:
+                pngs = await self._run([jobs[i] for i in indices], store)
+            for i, png in zip(indices, pngs):
+                results[i] = png
+                if store and self.cache is not None:
+                    self.cache.put(jobs[i].cache_key(), png)
+
+        await asyncio.gather(*(run_chunk(misses[i:i + chunk_size]) for i in range(0, len(misses), chunk_size)))
+        return results
+
+    async def _render(self, job: RenderJob) -> bytes:
+        return (await self._run([job]))[0]
+
+    async def _run(self, jobs: List[RenderJob], store: bool = True) -> List[bytes]:
+        if self._executor is None:
+            await self.start()
+        if self.pending >= self.queue_size:
+            raise RenderQueueFull()
+
+        for i, job in enumerate(jobs):
+            matrix = job.matrix or self.matrix_cache.get(job.text, job.error)
+            if matrix is not None:
+                jobs[i] = job._replace(matrix=matrix)
+
+        self.pending += 1
+        try:
+            results = await self._submit(jobs)
+        finally:
+            self.pending -= 1
+
+        for job, (_, matrix, timings) in zip(jobs, results):
+            if job.matrix is None:
+                if store:
+                    self.matrix_cache.put(job.text, job.error, matrix)
+                if self.encodes is not None:
+                    saved = matrix.default_version - matrix.version
+                    self.encodes.inc("overflow" if matrix.default_version > 40 else str(saved))
+            if self.stage_seconds is not None:
+                for stage, seconds in timings.items():
+                    self.stage_seconds.observe(seconds, stage)
+        return [png for png, _, _ in results]
+
+    async def _submit(self, jobs: List[RenderJob]) -> List[Tuple[bytes, QRMatrix, Dict[str, float]]]:
+        loop = asyncio.get_running_loop()
+        for _ in range(2):
+            executor = self._executor
+            try:
+                future = loop.run_in_executor(executor, render_batch, jobs)
+                return await asyncio.wait_for(future, self.timeout * len(jobs))
+            except asyncio.TimeoutError:
+                raise RenderTimeout()
+            except BrokenProcessPool:
+                LOGGER.error(f"Render worker died with {len(jobs)} job(s) on it, restarting the pool")
+                await self._restart(executor)
+        raise RenderCrashed()
+
+    async def _restart(self, broken: Optional[ProcessPoolExecutor]):
+        # Every job on the broken pool lands here; only the first rebuilds it.
+        if self._executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        await self.start()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,203 @@
+from bisect import bisect_left
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from qrcode import ERROR_CORRECT_L, util
+from qrcode.exceptions import DataOverflowError
+
+# Most characters any symbol holds (version 40-L, all digits).
+MAX_SYMBOL_CHARS = 7089
+
+BYTE, ALNUM, NUMERIC, KANJI = range(4)
+MODES = (util.MODE_8BIT_BYTE, util.MODE_ALPHA_NUM, util.MODE_NUMBER, util.MODE_KANJI)
+
+# Character count indicators change width at versions 10 and 27, so each
+# range gets its own optimal segmentation.
+VERSION_RANGES = ((1, 9), (10, 26), (27, 40))
+
+# Costs are in sixths of a bit: a digit takes 10/3 bits, an alphanumeric
+# character 11/2, a byte 8 and a Kanji character 13.
+ALNUM_COST = 33
+NUMERIC_COST = 20
+KANJI_COST = 78
+_NO = 1 << 60
+
+_ALNUM_CHARS = frozenset(util.ALPHA_NUM.decode())
+
+
+class KanjiData(util.QRData):
+    """A Kanji mode segment: Shift JIS double-byte characters, 13 bits each."""
+
+    def __init__(self, data: bytes):
+        self.mode = util.MODE_KANJI
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data) // 2
+
+    def write(self, buffer):
+        for i in range(0, len(self.data), 2):
+            code = (self.data[i] << 8) | self.data[i + 1]
+            code -= 0x8140 if code <= 0x9FFC else 0xC140
+            buffer.put((code >> 8) * 0xC0 + (code & 0xFF), 13)
+
+
+class SegmentPlan(NamedTuple):
+    """How a payload is split into mode segments, and the version that needs.
+
+    ``default_version`` is what qrcode's own ``add_data`` chunking would
+    need at the same error level, 41 if that does not fit at all.
+    """
+
+    version: int
+    segments: List[util.QRData]
+    default_version: int
+
+    @property
+    def versions_saved(self) -> int:
+        return self.default_version - self.version
+
+
+def _kanji(char: str) -> Optional[bytes]:
+    try:
+        encoded = char.encode("shift_jis")
+    except UnicodeEncodeError:
+        return None
+    if len(encoded) != 2:
+        return None
+    code = (encoded[0] << 8) | encoded[1]
+    if 0x8140 <= code <= 0x9FFC or 0xE040 <= code <= 0xEBBF:
+        return encoded
+    return None
+
+
+def _char_costs(text: str) -> List[Tuple[int, int, int, int]]:
+    # Kanji mode is only offered when every other non-ASCII character is
+    # Kanji too, and then non-ASCII characters must be Kanji: byte segments
+    # hold plain ASCII, which readers decode the same whether they guess
+    # UTF-8 or Shift JIS.
+    use_kanji = not text.isascii() and all(char.isascii() or _kanji(char) is not None for char in text)
+    costs = []
+    for char in text:
+        if char.isascii():
+            costs.append((
+                48,
+                ALNUM_COST if char in _ALNUM_CHARS else _NO,
+                NUMERIC_COST if "0" <= char <= "9" else _NO,
+                _NO,
+            ))
+        elif use_kanji:
+            costs.append((_NO, _NO, _NO, KANJI_COST))
+        else:
+            costs.append((48 * len(char.encode()), _NO, _NO, _NO))
+    return costs
+
+
+def _optimal_modes(costs: Sequence[Tuple[int, int, int, int]], version: int) -> List[int]:
+    """Mode of every character in the shortest encoding at ``version``'s header widths.
+
+    Dynamic programming over the characters: ``best[m]`` is the cheapest
+    encoding of the prefix whose last segment is in mode ``m``. Switching
+    pays the new segment's header on top of the previous one rounded up to
+    whole bits, and since that header does not depend on where we switch
+    from, one cheapest predecessor serves all four modes.
+    """
+    heads = [(4 + util.length_in_bits(mode, version)) * 6 for mode in MODES]
+    best = list(heads)
+    choices = []
+    for char in costs:
+        current = [best[m] + char[m] if char[m] != _NO else _NO for m in range(4)]
+        rounded = [(cost + 5) // 6 * 6 for cost in current]
+        cheapest = min(rounded)
+        came_from = rounded.index(cheapest)
+        choice = [BYTE, ALNUM, NUMERIC, KANJI]
+        for m in range(4):
+            if cheapest + heads[m] < current[m]:
+                current[m] = cheapest + heads[m]
+                choice[m] = came_from
+        choices.append(choice)
+        best = current
+
+    modes = [0] * len(costs)
+    mode = best.index(min(best))
+    for i in range(len(costs) - 1, -1, -1):
+        mode = choices[i][mode]
+        modes[i] = mode
+    return modes
+
+
+def _segments(text: str, modes: List[int]) -> List[util.QRData]:
+    segments = []
+    start = 0
+    for end in range(1, len(text) + 1):
+        if end < len(text) and modes[end] == modes[start]:
+            continue
+        chunk = text[start:end]
+        mode = modes[start]
+        if mode == KANJI:
+            segments.append(KanjiData(chunk.encode("shift_jis")))
+        else:
+            segments.append(util.QRData(chunk.encode(), mode=MODES[mode], check_data=False))
+        start = end
+    return segments
+
+
+def _data_bits(mode: int, length: int) -> int:
+    if mode == util.MODE_NUMBER:
+        return 10 * (length // 3) + (0, 4, 7)[length % 3]
+    if mode == util.MODE_ALPHA_NUM:
+        return 11 * (length // 2) + 6 * (length % 2)
+    if mode == util.MODE_KANJI:
+        return 13 * length
+    return 8 * length
+
+
+def segment_bits(segments: Sequence[util.QRData], version: int) -> int:
+    """Length of the encoded segments at ``version``, before terminator and padding."""
+    return sum(4 + util.length_in_bits(s.mode, version) + _data_bits(s.mode, len(s)) for s in segments)
+
+
+def _fit(bits: int, error_correction: int, first: int, last: int) -> Optional[int]:
+    # Counts never overflow their indicator in a range whose largest
+    # symbol can hold the data, so capacity is the only limit.
+    version = bisect_left(util.BIT_LIMIT_TABLE[error_correction], bits, first, last + 1)
+    return version if version <= last else None
+
+
+def _default_version(text: str, error_correction: int) -> int:
+    chunks = list(util.optimal_data_chunks(text, minimum=20))
+    for first, last in VERSION_RANGES:
+        version = _fit(segment_bits(chunks, first), error_correction, first, last)
+        if version is not None:
+            return version
+    return 41
+
+
+def plan_segments(text: str, error_correction: int) -> SegmentPlan:
+    """Split ``text`` into the mode segments that need the smallest version.
+
+    Raises ``DataOverflowError`` if it does not fit in any version at
+    ``error_correction``.
+    """
+    if len(text) > MAX_SYMBOL_CHARS:
+        raise DataOverflowError()
+    costs = _char_costs(text)
+    # Lower bound in bits if every character got its cheapest mode and no
+    # header; ranges whose largest symbol cannot hold even that are skipped.
+    floor = sum(min(char) for char in costs) // 6
+    for first, last in VERSION_RANGES:
+        if floor > util.BIT_LIMIT_TABLE[error_correction][last]:
+            continue
+        segments = _segments(text, _optimal_modes(costs, first))
+        version = _fit(segment_bits(segments, first), error_correction, first, last)
+        if version is not None:
+            return SegmentPlan(version, segments, _default_version(text, error_correction))
+    raise DataOverflowError()
+
+
+def fits_in_symbol(text: str, error_correction: int = ERROR_CORRECT_L) -> bool:
+    """Whether ``text`` fits at all; with the default, in the largest symbol there is."""
+    try:
+        plan_segments(text, error_correction)
+    except DataOverflowError:
+        return False
+    return True
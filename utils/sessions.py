@@ -0,0 +1,443 @@
+import asyncio
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from .logger import LOGGER
+from .logos import Logo
+
+
+class Session:
+    """Conversation state and QR settings of one user."""
+
+    __slots__ = ("state", "text", "size", "error", "style", "has_logo", "logo_shape", "logo_image", "label", "output", "last_seen", "nbytes")
+
+    def __init__(self, state: str = "", text: Optional[str] = None):
+        self.state = state
+        self.text = text
+        self.size = "medium"
+        self.error = "medium"
+        self.style = "classic"
+        self.has_logo = False
+        self.logo_shape: Optional[str] = None
+        self.logo_image: Optional[Logo] = None
+        self.label: Optional[str] = None
+        self.output = "png"
+        self.last_seen = 0.0
+        self.nbytes = 0
+
+    def measure(self) -> int:
+        return (
+            sys.getsizeof(self)
+            + len(self.text or "")
+            + len(self.label or "")
+            + (len(self.logo_image.pixels) if self.logo_image else 0)
+        )
+
+
+class SessionBackend(ABC):
+    """Where the conversation helpers in ``qr.py`` keep sessions.
+
+    ``get`` returns the live :class:`Session` (refreshing its idle timer),
+    ``put`` must be called after every change for it to be kept, and
+    ``pop`` ends the session.
+    """
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[Session]:
+        ...
+
+    @abstractmethod
+    def put(self, user_id: int, session: Session):
+        ...
+
+    @abstractmethod
+    def pop(self, user_id: int) -> Optional[Session]:
+        ...
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class SessionStore(SessionBackend):
+    """In-memory sessions bounded by count, idle time and total size.
+
+    Sessions are kept in least-recently-used order. Storing a session past
+    ``max_sessions`` or ``max_bytes`` evicts the oldest ones, and a background
+    sweeper drops sessions idle for more than ``ttl`` seconds, so abandoned
+    conversations (and their logos) do not pile up.
+    """
+
+    def __init__(self, max_sessions: int = 100_000, ttl: float = 3600, max_bytes: int = 256 * 1024 * 1024, sweep_interval: float = 60):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.bytes = 0
+        self.evicted = 0
+        self.expired = 0
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: int) -> Optional[Session]:
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.last_seen > self.ttl:
+            self._drop(user_id)
+            self.expired += 1
+            return None
+        session.last_seen = now
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def put(self, user_id: int, session: Session):
+        old = self._sessions.get(user_id)
+        if old is not None:
+            self.bytes -= old.nbytes
+        session.nbytes = session.measure()
+        session.last_seen = time.monotonic()
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        self.bytes += session.nbytes
+
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self.bytes > self.max_bytes):
+            self._drop(next(iter(self._sessions)))
+            self.evicted += 1
+
+    def pop(self, user_id: int) -> Optional[Session]:
+        if user_id not in self._sessions:
+            return None
+        return self._drop(user_id)
+
+    def sweep(self) -> int:
+        deadline = time.monotonic() - self.ttl
+        dropped = 0
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen > deadline:
+                break
+            self._drop(user_id)
+            dropped += 1
+        self.expired += dropped
+        return dropped
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self.bytes,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_running_loop().create_task(self._run_sweeper())
+
+    def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _run_sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            dropped = self.sweep()
+            if dropped:
+                LOGGER.info(f"Expired {dropped} idle sessions, {len(self._sessions)} active")
+
+    def _drop(self, user_id: int) -> Session:
+        session = self._sessions.pop(user_id)
+        self.bytes -= session.nbytes
+        return session
+
+
+SessionRow = Tuple[int, str, Optional[str], str, str, str, int, Optional[str], Optional[str], Optional[str], float]
+
+
+class SqliteSessionBackend(SessionBackend):
+    """Sessions persisted in a SQLite database in WAL mode.
+
+    Several bot processes can share one database file. Reads are served from
+    a local cache and only go back to the database once an entry is older
+    than ``cache_ttl`` seconds. Writes are queued and flushed in batches from
+    a worker thread every ``flush_interval`` seconds. Logos live in their own
+    table keyed by digest, so the hot session row stays a few hundred bytes;
+    a flush only writes the blobs of logos the table does not hold yet,
+    checked in the same transaction so a concurrent sweep cannot orphan a
+    session's logo.
+    """
+
+    def __init__(
+        self,
+        path: str = "sessions.db",
+        ttl: float = 3600,
+        max_cached: int = 100_000,
+        cache_ttl: float = 1.0,
+        flush_interval: float = 0.05,
+        sweep_interval: float = 60,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.cache_hits = 0
+        self.db_reads = 0
+        self.flushed = 0
+        self._cache: "OrderedDict[int, Tuple[Session, float]]" = OrderedDict()
+        self._dirty: Dict[int, Optional[SessionRow]] = {}
+        self._flushing: Dict[int, Optional[SessionRow]] = {}
+        self._write_lock = threading.Lock()
+        # Flushes and sweeps run here, so stop() can wait for the one in flight.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+        self._pending_logos: Dict[str, Logo] = {}
+        self._flushing_logos: Dict[str, Logo] = {}
+        self._tasks = []
+
+        self._reader = self._connect()
+        self._writer = self._connect(check_same_thread=False)
+        with self._writer:
+            self._writer.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id INTEGER PRIMARY KEY, state TEXT, text TEXT, size TEXT, error TEXT, style TEXT, "
+                "has_logo INTEGER, logo_shape TEXT, label TEXT, logo_digest TEXT, updated REAL, output TEXT)"
+            )
+            columns = {row[1] for row in self._writer.execute("PRAGMA table_info(sessions)")}
+            if "output" not in columns:
+                self._writer.execute("ALTER TABLE sessions ADD COLUMN output TEXT")
+            self._writer.execute(
+                "CREATE TABLE IF NOT EXISTS logos ("
+                "digest TEXT PRIMARY KEY, width INTEGER, height INTEGER, pixels BLOB)"
+            )
+            self._writer.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=check_same_thread)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, user_id: int) -> Optional[Session]:
+        now = time.monotonic()
+        unflushed = user_id in self._dirty or user_id in self._flushing
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            session, loaded_at = cached
+            if now - session.last_seen > self.ttl:
+                self.pop(user_id)
+                return None
+            if unflushed or now - loaded_at < self.cache_ttl:
+                self.cache_hits += 1
+                session.last_seen = now
+                self._cache.move_to_end(user_id)
+                return session
+        elif unflushed:
+            # Ended locally and not yet deleted from the database.
+            return None
+
+        session = self._load(user_id)
+        if session is None:
+            self._cache.pop(user_id, None)
+            return None
+        session.last_seen = now
+        self._remember(user_id, session)
+        return session
+
+    def put(self, user_id: int, session: Session):
+        session.last_seen = time.monotonic()
+        logo = session.logo_image
+        if logo is not None:
+            self._pending_logos[logo.digest] = logo
+        self._dirty[user_id] = (
+            user_id, session.state, session.text, session.size, session.error, session.style,
+            int(session.has_logo), session.logo_shape, session.label,
+            logo.digest if logo is not None else None, time.time(), session.output,
+        )
+        self._remember(user_id, session)
+
+    def pop(self, user_id: int) -> Optional[Session]:
+        cached = self._cache.pop(user_id, None)
+        self._dirty[user_id] = None
+        return cached[0] if cached else None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "db_reads": self.db_reads,
+            "pending_writes": len(self._dirty),
+            "flushed": self.flushed,
+        }
+
+    def _remember(self, user_id: int, session: Session):
+        self._cache[user_id] = (session, time.monotonic())
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_cached:
+            old_id = next(iter(self._cache))
+            if old_id in self._dirty or old_id in self._flushing:
+                # Keep unflushed sessions; the next flush makes them evictable.
+                self._cache.move_to_end(old_id)
+                break
+            del self._cache[old_id]
+
+    def _load(self, user_id: int) -> Optional[Session]:
+        self.db_reads += 1
+        row = self._reader.execute(
+            "SELECT state, text, size, error, style, has_logo, logo_shape, label, logo_digest, updated, output "
+            "FROM sessions WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        state, text, size, error, style, has_logo, logo_shape, label, logo_digest, updated, output = row
+        if time.time() - updated > self.ttl:
+            return None
+
+        session = Session(state, text)
+        session.size = size
+        session.error = error
+        session.style = style
+        session.has_logo = bool(has_logo)
+        session.logo_shape = logo_shape
+        session.label = label
+        session.output = output or "png"
+        if logo_digest:
+            cached = self._cache.get(user_id)
+            old_logo = cached[0].logo_image if cached else None
+            if old_logo is not None and old_logo.digest == logo_digest:
+                session.logo_image = old_logo
+            else:
+                session.logo_image = self._load_logo(logo_digest)
+        return session
+
+    def _load_logo(self, digest: str) -> Optional[Logo]:
+        logo = self._pending_logos.get(digest)
+        if logo is not None:
+            return logo
+        row = self._reader.execute("SELECT width, height, pixels FROM logos WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        return Logo(row[0], row[1], bytes(row[2]), digest)
+
+    def flush(self) -> int:
+        dirty, self._dirty = self._dirty, {}
+        logos, self._pending_logos = self._pending_logos, {}
+        if not dirty and not logos:
+            return 0
+        return self._write(dirty, logos)
+
+    def _write(self, dirty: Dict[int, Optional[SessionRow]], logos: Dict[str, Logo]) -> int:
+        rows = [row for row in dirty.values() if row is not None]
+        deleted = [(user_id,) for user_id, row in dirty.items() if row is None]
+        with self._write_lock, self._writer:
+            # Taking the write lock up front keeps other processes' sweeps
+            # from deleting a logo between the check below and the commit.
+            self._writer.execute("BEGIN IMMEDIATE")
+            missing = [logo for logo in logos.values() if not self._has_logo(logo.digest)]
+            if missing:
+                self._writer.executemany(
+                    "INSERT INTO logos VALUES (?, ?, ?, ?)",
+                    [(logo.digest, logo.width, logo.height, logo.pixels) for logo in missing],
+                )
+            if rows:
+                self._writer.executemany(
+                    "INSERT OR REPLACE INTO sessions ("
+                    "user_id, state, text, size, error, style, has_logo, logo_shape, label, logo_digest, updated, output"
+                    ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            if deleted:
+                self._writer.executemany("DELETE FROM sessions WHERE user_id = ?", deleted)
+        self.flushed += len(dirty)
+        return len(dirty)
+
+    def _has_logo(self, digest: str) -> bool:
+        return self._writer.execute("SELECT 1 FROM logos WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def sweep(self) -> int:
+        with self._write_lock, self._writer:
+            expired = self._writer.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,)).rowcount
+            self._writer.execute("DELETE FROM logos WHERE digest NOT IN (SELECT logo_digest FROM sessions WHERE logo_digest IS NOT NULL)")
+        return expired
+
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._run_flusher()), loop.create_task(self._run_sweeper())]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._executor.shutdown(wait=True)
+        # A cancelled flusher cannot put back a batch whose write failed.
+        # Writing it again is harmless if it went through.
+        for user_id, row in self._flushing.items():
+            self._dirty.setdefault(user_id, row)
+        for digest, logo in self._flushing_logos.items():
+            self._pending_logos.setdefault(digest, logo)
+        self._flushing = {}
+        self._flushing_logos = {}
+        self.flush()
+        self._reader.close()
+        self._writer.close()
+
+    async def _run_flusher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            dirty, self._dirty = self._dirty, {}
+            logos, self._pending_logos = self._pending_logos, {}
+            if not dirty and not logos:
+                continue
+            self._flushing = dirty
+            self._flushing_logos = logos
+            try:
+                await loop.run_in_executor(self._executor, self._write, dirty, logos)
+            except sqlite3.Error as e:
+                LOGGER.error(f"Failed to flush {len(dirty)} sessions: {e}")
+                # Put the batch back unless newer writes replaced it meanwhile.
+                for user_id, row in dirty.items():
+                    self._dirty.setdefault(user_id, row)
+                for digest, logo in logos.items():
+                    self._pending_logos.setdefault(digest, logo)
+            finally:
+                self._flushing = {}
+                self._flushing_logos = {}
+
+    def _sweep_cache(self):
+        deadline = time.monotonic() - self.ttl
+        while self._cache:
+            user_id, (session, _) = next(iter(self._cache.items()))
+            if session.last_seen > deadline or user_id in self._dirty:
+                break
+            del self._cache[user_id]
+
+    async def _run_sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self._sweep_cache()
+            try:
+                expired = await asyncio.get_running_loop().run_in_executor(self._executor, self.sweep)
+            except sqlite3.Error as e:
+                LOGGER.error(f"Failed to sweep sessions: {e}")
+                continue
+            if expired:
+                LOGGER.info(f"Expired {expired} idle sessions")
@@ -0,0 +1,115 @@
+import asyncio
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+from qrcode.exceptions import DataOverflowError
+
+from .logger import LOGGER
+from .render import RenderCrashed, RenderJob, RenderPool, RenderQueueFull, RenderTimeout
+
+
+class SpeculativeRenderer:
+    """Renders what users are looking at on the settings screen before they ask.
+
+    :meth:`speculate` records the job for a user's current settings; a newer
+    call for the same user replaces it, so settings that were toggled past
+    are dropped before they cost anything. Up to ``concurrency`` background
+    tasks pick the oldest wanted jobs and render them on ``pool``, which
+    stores the result in its cache. On Generate the output is then a cache
+    hit, or the request joins the render already in flight.
+
+    Speculation only uses spare capacity: a job starts only while the pool
+    has an idle worker and ``busy()`` is false (the bot passes "real renders
+    are queued for admission"). A render that has started is never
+    cancelled, since a real request for the same output may have joined it.
+    """
+
+    def __init__(
+        self,
+        pool: RenderPool,
+        concurrency: int = 1,
+        max_pending: int = 1000,
+        busy: Optional[Callable[[], bool]] = None,
+        poll_interval: float = 0.05,
+    ):
+        self.pool = pool
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.busy = busy or (lambda: False)
+        self.poll_interval = poll_interval
+        self.started = 0
+        self.dropped = 0
+        self.cached = 0
+        self.failed = 0
+        self.running = 0
+        self._wanted: "OrderedDict[Hashable, RenderJob]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def speculate(self, owner: Hashable, job: RenderJob):
+        if self.pool.cache is None:
+            return
+        if self._wanted.pop(owner, None) is not None:
+            self.dropped += 1
+        if job.cache_key() in self.pool.cache:
+            self.cached += 1
+            return
+        self._wanted[owner] = job
+        while len(self._wanted) > self.max_pending:
+            self._wanted.popitem(last=False)
+            self.dropped += 1
+        self._wakeup.set()
+
+    def cancel(self, owner: Hashable):
+        """Forget ``owner``'s job if it has not started."""
+        if self._wanted.pop(owner, None) is not None:
+            self.dropped += 1
+
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._run()) for _ in range(self.concurrency)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def _has_capacity(self) -> bool:
+        return self.pool.pending < self.pool.workers and not self.busy()
+
+    async def _run(self):
+        while True:
+            if not self._wanted:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if not self._has_capacity():
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            _, job = self._wanted.popitem(last=False)
+            if job.cache_key() in self.pool.cache:
+                self.cached += 1
+                continue
+            self.started += 1
+            self.running += 1
+            try:
+                await self.pool.render(job)
+            except (RenderQueueFull, RenderTimeout, RenderCrashed, DataOverflowError):
+                self.failed += 1
+            except Exception as e:
+                self.failed += 1
+                LOGGER.warning(f"Speculative render failed: {e}")
+            finally:
+                self.running -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._wanted),
+            "running": self.running,
+            "started": self.started,
+            "dropped": self.dropped,
+            "cached": self.cached,
+            "failed": self.failed,
+        }
@@ -0,0 +1,154 @@
+from functools import lru_cache
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+import qrcode
+
+
+class SymbolLayout(NamedTuple):
+    """Everything about a version's module grid that does not depend on the data.
+
+    ``base`` holds the function patterns with the format and version areas
+    left light, which is how qrcode's ``makeImpl(test=True)`` scores masks.
+    ``rows`` and ``cols`` list the data modules in placement order, and
+    ``masks`` holds the eight mask patterns restricted to those modules.
+    """
+
+    version: int
+    width: int
+    base: np.ndarray
+    rows: np.ndarray
+    cols: np.ndarray
+    masks: np.ndarray
+
+
+def _placement_order(free: List[List[bool]]) -> Tuple[List[int], List[int]]:
+    # Same zigzag as QRCode.map_data: two-module columns from the right,
+    # alternating upwards and downwards, skipping the vertical timing line.
+    width = len(free)
+    rows, cols = [], []
+    row, inc = width - 1, -1
+    for col in range(width - 1, 0, -2):
+        if col <= 6:
+            col -= 1
+        while 0 <= row < width:
+            for c in (col, col - 1):
+                if free[row][c]:
+                    rows.append(row)
+                    cols.append(c)
+            row += inc
+        row -= inc
+        inc = -inc
+    return rows, cols
+
+
+def _mask_patterns(width: int) -> np.ndarray:
+    i, j = np.indices((width, width))
+    return np.stack([
+        (i + j) % 2 == 0,
+        i % 2 == 0,
+        j % 3 == 0,
+        (i + j) % 3 == 0,
+        (i // 2 + j // 3) % 2 == 0,
+        (i * j) % 2 + (i * j) % 3 == 0,
+        ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+        ((i * j) % 3 + (i + j) % 2) % 2 == 0,
+    ])
+
+
+@lru_cache(maxsize=None)
+def symbol_layout(version: int) -> SymbolLayout:
+    width = version * 4 + 17
+    qr = qrcode.QRCode(version=version, border=0)
+    qr.modules_count = width
+    qr.modules = [[None] * width for _ in range(width)]
+    qr.setup_position_probe_pattern(0, 0)
+    qr.setup_position_probe_pattern(width - 7, 0)
+    qr.setup_position_probe_pattern(0, width - 7)
+    qr.setup_position_adjust_pattern()
+    qr.setup_timing_pattern()
+    qr.setup_type_info(True, 0)
+    if version >= 7:
+        qr.setup_type_number(True)
+
+    free = [[module is None for module in row] for row in qr.modules]
+    base = np.array([[bool(module) for module in row] for row in qr.modules])
+    rows, cols = _placement_order(free)
+    masks = _mask_patterns(width) & np.array(free)
+    return SymbolLayout(version, width, base, np.array(rows), np.array(cols), masks)
+
+
+def place_data(layout: SymbolLayout, data: List[int]) -> np.ndarray:
+    """Unmasked data modules of the codewords ``data``; everything else is light."""
+    bits = np.unpackbits(np.asarray(data, dtype=np.uint8)).astype(bool)
+    count = min(len(bits), len(layout.rows))
+    modules = np.zeros((layout.width, layout.width), dtype=bool)
+    modules[layout.rows[:count], layout.cols[:count]] = bits[:count]
+    return modules
+
+
+def _run_penalty(modules: np.ndarray) -> int:
+    # A light/dark value of 2 after every row keeps runs from wrapping.
+    height, width = modules.shape
+    padded = np.full((height, width + 1), 2, dtype=np.int8)
+    padded[:, :width] = modules
+    flat = padded.ravel()
+    ends = np.flatnonzero(flat[1:] != flat[:-1])
+    lengths = np.diff(ends, prepend=-1)
+    long_runs = lengths[lengths >= 5]
+    return int((long_runs - 2).sum())
+
+
+def _block_penalty(modules: np.ndarray) -> int:
+    top_left = modules[:-1, :-1]
+    same = (top_left == modules[:-1, 1:]) & (top_left == modules[1:, :-1]) & (top_left == modules[1:, 1:])
+    return 3 * int(np.count_nonzero(same))
+
+
+def _finder_penalty(modules: np.ndarray) -> int:
+    # 1:1:3:1:1 dark-light-dark-light-dark with four light modules on either side.
+    windows = modules.shape[1] - 10
+    if windows <= 0:
+        return 0
+
+    def at(k: int) -> np.ndarray:
+        return modules[:, k:k + windows]
+
+    core = ~at(1) & at(4) & ~at(5) & at(6) & ~at(9)
+    light_after = at(0) & at(2) & at(3) & ~at(7) & ~at(8) & ~at(10)
+    light_before = ~at(0) & ~at(2) & ~at(3) & at(7) & at(8) & at(10)
+    return 40 * int(np.count_nonzero(core & (light_after | light_before)))
+
+
+def _balance_penalty(modules: np.ndarray) -> int:
+    # Kept in floating point exactly like qrcode, so rounding at the 5% steps agrees.
+    percent = float(np.count_nonzero(modules)) / modules.size
+    return int(abs(percent * 100 - 50) / 5) * 10
+
+
+def mask_penalty(modules: np.ndarray) -> int:
+    """Penalty score of a square boolean module grid, equal to ``qrcode.util.lost_point``."""
+    modules = np.asarray(modules, dtype=bool)
+    return (
+        _run_penalty(modules) + _run_penalty(modules.T)
+        + _block_penalty(modules)
+        + _finder_penalty(modules) + _finder_penalty(modules.T)
+        + _balance_penalty(modules)
+    )
+
+
+def best_mask(layout: SymbolLayout, data: np.ndarray) -> int:
+    """The mask qrcode's ``best_mask_pattern`` picks: lowest penalty, first on ties."""
+    penalties = [mask_penalty(layout.base | (data ^ mask)) for mask in layout.masks]
+    return penalties.index(min(penalties))
+
+
+def finish_symbol(qr: qrcode.QRCode, layout: SymbolLayout, data: np.ndarray, pattern: int) -> np.ndarray:
+    """Masked modules with the real format (and version) information of ``qr``."""
+    qr.modules_count = layout.width
+    # qrcode's setters index modules[row][col], which works on an array as well.
+    qr.modules = layout.base | (data ^ layout.masks[pattern])
+    qr.setup_type_info(False, pattern)
+    if layout.version >= 7:
+        qr.setup_type_number(False)
+    return qr.modules
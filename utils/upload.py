@@ -0,0 +1,52 @@
+import io
+import os
+
+
+class MemoryUpload(io.RawIOBase):
+    """Read-only stream over an encoded image for ``send_file``.
+
+    Telethon uploads by calling ``read(part_size)`` repeatedly; serving those
+    reads from a ``memoryview`` means the encoded PNG itself is never copied
+    or written to disk, only the parts handed to the upload requests.
+    """
+
+    def __init__(self, data: bytes, name: str = "qr.png"):
+        super().__init__()
+        self._view = memoryview(data)
+        self._pos = 0
+        self.name = name
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        elif whence == os.SEEK_END:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, min(self._pos, len(self._view)))
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        part = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return part
+
+    def readinto(self, buffer) -> int:
+        part = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(part)] = part
+        self._pos += len(part)
+        return len(part)
+
+    def close(self):
+        self._view.release()
+        super().close()
@@ -0,0 +1,315 @@
+import base64
+import io
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from xml.sax.saxutils import escape
+
+import numpy as np
+from PIL import Image
+
+from .fills import fill_source, gradient_stops, linear_endpoints, radial_circle
+from .labels import LABEL_COLOR, get_fonts
+from .matrix import QRMatrix
+from .raster import BACK_COLOR, tile_indices, unpack_matrix
+
+# Cubic Bezier control distance for a quarter circle of radius 1.
+KAPPA = 0.5522847498
+
+
+class VectorModules(NamedTuple):
+    """Dark modules grouped by the primitive that draws them, in module units.
+
+    ``runs`` are ``(x, y, length)`` horizontal runs of square modules
+    (finder patterns included), ``circles`` the top-left corners of circle
+    modules and ``rounded`` ``(x, y, corners)`` with the same 4-bit corner
+    mask (nw=1, ne=2, se=4, sw=8) the rasterizer uses.
+    """
+
+    runs: List[Tuple[int, int, int]]
+    circles: List[Tuple[int, int]]
+    rounded: List[Tuple[int, int, int]]
+
+
+def vector_modules(matrix: QRMatrix, module: str) -> VectorModules:
+    idx = tile_indices(unpack_matrix(matrix), module)
+    # Tile 1 is the plain square; for rounded modules tile 2 (no rounded
+    # corner) is a square too.
+    square = (idx == 1) | ((idx == 2) if module == "rounded" else False)
+
+    runs = []
+    padded = np.zeros((matrix.width, matrix.width + 2), dtype=np.int8)
+    padded[:, 1:-1] = square
+    edges = np.diff(padded, axis=1)
+    for y in range(matrix.width):
+        starts = np.flatnonzero(edges[y] == 1)
+        ends = np.flatnonzero(edges[y] == -1)
+        runs.extend((int(x), y, int(end - x)) for x, end in zip(starts, ends))
+
+    circles: List[Tuple[int, int]] = []
+    rounded: List[Tuple[int, int, int]] = []
+    if module == "circle":
+        ys, xs = np.nonzero(idx == 2)
+        circles = list(zip(xs.tolist(), ys.tolist()))
+    elif module == "rounded":
+        ys, xs = np.nonzero(idx > 2)
+        rounded = list(zip(xs.tolist(), ys.tolist(), (idx[ys, xs] - 2).tolist()))
+    return VectorModules(runs, circles, rounded)
+
+
+def _num(value: float) -> str:
+    text = f"{value:.4f}".rstrip("0").rstrip(".")
+    return text if text not in ("", "-0") else "0"
+
+
+def _hex(color: Tuple[int, int, int]) -> str:
+    return "#%02x%02x%02x" % color
+
+
+def _png_data_uri(img: Image.Image) -> str:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+
+def _svg_fill(fill: Dict, width: int) -> str:
+    """``<defs>`` for a gradient fill, in the module units of the symbol path."""
+    stops = "".join(f'<stop offset="{_num(offset)}" stop-color="{_hex(color)}"/>' for offset, color in gradient_stops(fill))
+    if fill["kind"] == "linear":
+        x1, y1, x2, y2 = (_num(c * width) for c in linear_endpoints(fill))
+        gradient = f'<linearGradient id="fill" gradientUnits="userSpaceOnUse" x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}">{stops}</linearGradient>'
+    else:
+        cx, cy, r = (_num(c * width) for c in radial_circle(fill))
+        gradient = f'<radialGradient id="fill" gradientUnits="userSpaceOnUse" cx="{cx}" cy="{cy}" r="{r}">{stops}</radialGradient>'
+    return f"<defs>{gradient}</defs>"
+
+
+def svg_path(modules: VectorModules) -> str:
+    parts = [f"M{x} {y}h{n}v1h-{n}z" for x, y, n in modules.runs]
+    parts += [f"M{x} {y}.5a.5 .5 0 1 0 1 0a.5 .5 0 1 0-1 0z" for x, y in modules.circles]
+    for x, y, corners in modules.rounded:
+        path = f"M{x}.5 {y}"
+        path += "a.5 .5 0 0 1 .5 .5" if corners & 2 else "h.5v.5"
+        path += "a.5 .5 0 0 1-.5 .5" if corners & 4 else "v.5h-.5"
+        path += "a.5 .5 0 0 1-.5-.5" if corners & 8 else "h-.5v-.5"
+        path += "a.5 .5 0 0 1 .5-.5z" if corners & 1 else "v-.5z"
+        parts.append(path)
+    return "".join(parts)
+
+
+def render_svg(
+    matrix: QRMatrix,
+    box_size: int,
+    style: Dict,
+    border: int = 4,
+    logo: Optional[Image.Image] = None,
+    label: Optional[str] = None,
+) -> bytes:
+    """SVG of the symbol with the same geometry as :func:`rasterize`.
+
+    Sizes are in pixels of the equivalent PNG. The logo is embedded as a PNG
+    and the label is live text, so viewers substitute their own bold sans
+    font.
+    """
+    size = (matrix.width + border * 2) * box_size
+    modules = vector_modules(matrix, style["module"])
+    height = size
+    label_svg = ""
+    if label:
+        fonts = get_fonts()
+        layout = fonts.layout(label, size)
+        ascent, _ = fonts.font(layout.font_size).getmetrics()
+        label_svg = "".join(
+            f'<text x="{size // 2}" y="{size + y + ascent}">{escape(line)}</text>' for _, y, line in layout.lines
+        )
+        label_svg = (
+            f'<g font-family="DejaVu Sans, Arial, sans-serif" font-weight="bold" font-size="{layout.font_size}" '
+            f'text-anchor="middle" fill="{_hex(LABEL_COLOR)}">{label_svg}</g>'
+        )
+        height += layout.height
+
+    logo_svg = ""
+    if logo is not None:
+        pos = ((size - logo.size[0]) // 2, (size - logo.size[1]) // 2)
+        logo_svg = (
+            f'<image x="{pos[0]}" y="{pos[1]}" width="{logo.size[0]}" height="{logo.size[1]}" '
+            f'href="{_png_data_uri(logo)}"/>'
+        )
+
+    offset = border * box_size
+    transform = f"translate({offset} {offset}) scale({box_size})"
+    fill = style.get("fill")
+    if fill is None:
+        modules_svg = f'<path transform="{transform}" fill="{_hex(style["color"])}" d="{svg_path(modules)}"/>'
+    elif fill["kind"] == "image":
+        # The image shows through the modules, used as a clip path.
+        extent = matrix.width * box_size
+        modules_svg = (
+            f'<clipPath id="modules"><path transform="{transform}" d="{svg_path(modules)}"/></clipPath>'
+            f'<image x="{offset}" y="{offset}" width="{extent}" height="{extent}" preserveAspectRatio="none" '
+            f'clip-path="url(#modules)" href="{_png_data_uri(fill_source(fill["path"]))}"/>'
+        )
+    else:
+        modules_svg = f'{_svg_fill(fill, matrix.width)}<path transform="{transform}" fill="url(#fill)" d="{svg_path(modules)}"/>'
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{height}" viewBox="0 0 {size} {height}">'
+        f'<rect width="{size}" height="{height}" fill="{_hex(BACK_COLOR)}"/>'
+        f"{modules_svg}{logo_svg}{label_svg}</svg>"
+    ).encode()
+
+
+def pdf_path(modules: VectorModules) -> str:
+    """PDF path construction operators in module units, y pointing down."""
+    k = KAPPA * 0.5
+    ops = [f"{x} {y} {n} 1 re" for x, y, n in modules.runs]
+    for x, y in modules.circles:
+        cx, cy = x + 0.5, y + 0.5
+        ops.append(
+            f"{_num(cx + .5)} {_num(cy)} m "
+            f"{_num(cx + .5)} {_num(cy + k)} {_num(cx + k)} {_num(cy + .5)} {_num(cx)} {_num(cy + .5)} c "
+            f"{_num(cx - k)} {_num(cy + .5)} {_num(cx - .5)} {_num(cy + k)} {_num(cx - .5)} {_num(cy)} c "
+            f"{_num(cx - .5)} {_num(cy - k)} {_num(cx - k)} {_num(cy - .5)} {_num(cx)} {_num(cy - .5)} c "
+            f"{_num(cx + k)} {_num(cy - .5)} {_num(cx + .5)} {_num(cy - k)} {_num(cx + .5)} {_num(cy)} c h"
+        )
+    for x, y, corners in modules.rounded:
+        # Walk clockwise (on screen) from the middle of the top edge; each
+        # corner is either a quarter arc of radius .5 or a right angle.
+        ops.append(f"{_num(x + .5)} {y} m")
+        if corners & 2:
+            ops.append(f"{_num(x + .5 + k)} {y} {x + 1} {_num(y + .5 - k)} {x + 1} {_num(y + .5)} c")
+        else:
+            ops.append(f"{x + 1} {y} l {x + 1} {_num(y + .5)} l")
+        if corners & 4:
+            ops.append(f"{x + 1} {_num(y + .5 + k)} {_num(x + .5 + k)} {y + 1} {_num(x + .5)} {y + 1} c")
+        else:
+            ops.append(f"{x + 1} {y + 1} l {_num(x + .5)} {y + 1} l")
+        if corners & 8:
+            ops.append(f"{_num(x + .5 - k)} {y + 1} {x} {_num(y + .5 + k)} {x} {_num(y + .5)} c")
+        else:
+            ops.append(f"{x} {y + 1} l {x} {_num(y + .5)} l")
+        if corners & 1:
+            ops.append(f"{x} {_num(y + .5 - k)} {_num(x + .5 - k)} {y} {_num(x + .5)} {y} c h")
+        else:
+            ops.append(f"{x} {y} l h")
+    return "\n".join(ops)
+
+
+class _PdfWriter:
+    def __init__(self):
+        self.objects: List[bytes] = []
+
+    def add(self, body: bytes) -> int:
+        self.objects.append(body)
+        return len(self.objects)
+
+    def stream(self, attrs: str, data: bytes) -> int:
+        data = zlib.compress(data)
+        return self.add(f"<< {attrs} /Filter /FlateDecode /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream")
+
+    def image(self, img: Image.Image) -> int:
+        attrs = f"/Type /XObject /Subtype /Image /Width {img.size[0]} /Height {img.size[1]} /BitsPerComponent 8"
+        if img.mode == "RGBA":
+            smask = self.stream(attrs + " /ColorSpace /DeviceGray", img.getchannel("A").tobytes())
+            attrs += f" /SMask {smask} 0 R"
+        return self.stream(attrs + " /ColorSpace /DeviceRGB", img.convert("RGB").tobytes())
+
+    def finish(self, root: int) -> bytes:
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(self.objects, start=1):
+            offsets.append(len(out))
+            out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+        xref = len(out)
+        out += f"xref\n0 {len(self.objects) + 1}\n0000000000 65535 f \n".encode()
+        out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+        out += f"trailer\n<< /Size {len(self.objects) + 1} /Root {root} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+        return bytes(out)
+
+
+def _pdf_color(color: Tuple[int, int, int]) -> str:
+    return " ".join(_num(c / 255) for c in color)
+
+
+def _pdf_shading(fill: Dict, width: int) -> str:
+    """Axial or radial shading dictionary for a gradient fill, in module units."""
+    stops = gradient_stops(fill)
+    functions = [
+        f"<< /FunctionType 2 /Domain [0 1] /C0 [{_pdf_color(a)}] /C1 [{_pdf_color(b)}] /N 1 >>"
+        for (_, a), (_, b) in zip(stops, stops[1:])
+    ]
+    if len(functions) == 1:
+        function = functions[0]
+    else:
+        bounds = " ".join(_num(offset) for offset, _ in stops[1:-1])
+        function = (
+            f"<< /FunctionType 3 /Domain [0 1] /Functions [{' '.join(functions)}] "
+            f"/Bounds [{bounds}] /Encode [{' '.join(['0 1'] * len(functions))}] >>"
+        )
+    if fill["kind"] == "linear":
+        coords = " ".join(_num(c * width) for c in linear_endpoints(fill))
+        kind = 2
+    else:
+        cx, cy, r = (_num(c * width) for c in radial_circle(fill))
+        coords = f"{cx} {cy} 0 {cx} {cy} {r}"
+        kind = 3
+    return f"<< /ShadingType {kind} /ColorSpace /DeviceRGB /Coords [{coords}] /Function {function} /Extend [true true] >>"
+
+
+def render_pdf(
+    matrix: QRMatrix,
+    box_size: int,
+    style: Dict,
+    border: int = 4,
+    logo: Optional[Image.Image] = None,
+    label: Optional[Image.Image] = None,
+) -> bytes:
+    """Single-page PDF of the symbol, one point per pixel of the equivalent PNG.
+
+    Modules are filled vector paths. The logo and the pre-rendered ``label``
+    strip are embedded as images, since PDF's standard fonts cannot draw
+    arbitrary Unicode labels.
+    """
+    size = (matrix.width + border * 2) * box_size
+    height = size + (label.size[1] if label is not None else 0)
+    pdf = _PdfWriter()
+    xobjects = {}
+    shadings = {}
+
+    content = [
+        # Flip to a top-left origin so everything below uses pixel coordinates.
+        f"1 0 0 -1 0 {height} cm",
+        f"{_pdf_color(BACK_COLOR)} rg 0 0 {size} {height} re f",
+        f"q {box_size} 0 0 {box_size} {border * box_size} {border * box_size} cm",
+        pdf_path(vector_modules(matrix, style["module"])),
+    ]
+    fill = style.get("fill")
+    if fill is None:
+        content[2] += f" {_pdf_color(style['color'])} rg"
+        content.append("f Q")
+    elif fill["kind"] == "image":
+        # Clip to the modules, then paint the image over the symbol.
+        xobjects["Fill"] = pdf.image(fill_source(fill["path"]))
+        content.append(f"W n {matrix.width} 0 0 -{matrix.width} 0 {matrix.width} cm /Fill Do Q")
+    else:
+        shadings["Fill"] = pdf.add(_pdf_shading(fill, matrix.width).encode())
+        content.append("W n /Fill sh Q")
+    if logo is not None:
+        xobjects["Logo"] = pdf.image(logo)
+        x, y = (size - logo.size[0]) // 2, (size - logo.size[1]) // 2
+        content.append(f"q {logo.size[0]} 0 0 -{logo.size[1]} {x} {y + logo.size[1]} cm /Logo Do Q")
+    if label is not None:
+        xobjects["Label"] = pdf.image(label)
+        content.append(f"q {label.size[0]} 0 0 -{label.size[1]} 0 {height} cm /Label Do Q")
+
+    contents = pdf.stream("", "\n".join(content).encode())
+    resources = " ".join(
+        f"/{kind} << " + " ".join(f"/{name} {number} 0 R" for name, number in entries.items()) + " >>"
+        for kind, entries in (("XObject", xobjects), ("Shading", shadings)) if entries
+    )
+    pages = len(pdf.objects) + 2
+    page = pdf.add(
+        f"<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {size} {height}] "
+        f"/Resources << {resources} >> /Contents {contents} 0 R >>".encode()
+    )
+    pdf.add(f"<< /Type /Pages /Kids [{page} 0 R] /Count 1 >>".encode())
+    root = pdf.add(f"<< /Type /Catalog /Pages {pages} 0 R >>".encode())
+    return pdf.finish(root)